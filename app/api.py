@@ -1,28 +1,46 @@
-from flask import request, jsonify, session,make_response,logging
+from flask import request, jsonify, session,make_response,Response,stream_with_context
 from functools import wraps
+import logging
 import os
 from .db_config import get_user_data,get_all_user_details,get_db_connection
-from .user_management import (add_bonus_to_creator,get_promo_codes_by_creator,register_user, login_user,
-                             upload_profile_picture,change_email,change_password,get_user_by_email)
+from .user_management import (get_promo_codes_by_creator,register_user, login_user,
+                             upload_profile_picture,change_email,change_password,get_user_by_email,
+                             link_wallet_address, login_with_wallet, issue_wallet_nonce,
+                             verify_wallet_signature)
 from dotenv import load_dotenv
 import jwt
 from .db_setup import create_app
-from .handle_token import create_promo_code, update_spender_id, transfer_tanacoin,check_promocode_status
+from .handle_token import (create_promo_code, transfer_tanacoin,check_promocode_status,
+                           batch_transfer_tanacoin, parse_batch_transfers, TRANSFER_BATCH_CHUNK_SIZE)
 from .self_utils import generate_promo_code
 import base64
 from .send_mail import send_password_reset_email,send_contact_email
-from .kyc_handler import KYCService
-import asyncio
+from .kyc_handler import (KYCService, KYCUploadRequest, KYC_MAX_REQUEST_BYTES, KYC_REVIEW_PAGE_SIZE,
+                          parse_review_decisions)
+from werkzeug.exceptions import RequestEntityTooLarge
+from .payment_jobs import enqueue_verification_job, get_finished_job, get_job, SUPPORTED_PAYMENT_METHODS
+from .batch_verify import iter_verify_ndjson, parse_items
+from .wallet_communications import get_rate_quotes
+from .money import Money
+from .promo_bulk import create_promo_codes_bulk, parse_bulk_request
+from . import payment_scanner  # noqa: F401  registers the scanner service when enabled
+from . import promo_archive  # noqa: F401  registers the promo expiry sweeper
+from . import kyc_cleanup  # noqa: F401  registers the stale temporary KYC sweeper
+from .background import start_background_services, background_enabled_in_web
+from . import metrics
 load_dotenv()
 SECRET_KEY = os.getenv('SECRET_KEY')
 RECEIVER_ADDRESS = os.getenv("RECEIVER_ADDRESS")
 INFURA_API_KEY = os.getenv("INFURA_API_KEY")
 app = create_app()
+app.request_class = KYCUploadRequest
+if background_enabled_in_web():
+    start_background_services()
 
 # Function to validate the JWT token
 def token_required(f):
     @wraps(f)
-    def decorated():
+    def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
 
         if not token:
@@ -38,7 +56,7 @@ def token_required(f):
             return jsonify({'message': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Invalid token'}), 403
-        return f(current_user)
+        return f(current_user, *args, **kwargs)
     return decorated
 @app.route('/dashboard', methods=['GET', 'POST'])
 @token_required
@@ -55,7 +73,9 @@ def dashboard(current_user):
         if action == 'transfer':
             try:
                 recipient_tnc_wallet_id = request.json.get('recipient_tnc_wallet_id')
-                amount = float(request.json.get('amount'))
+                amount = Money.parse(request.json.get('amount'), 'TNC')
+                if amount.units <= 0:
+                    return jsonify({'error': 'Transfer amount must be positive.'}), 400
                 result = transfer_tanacoin(user_id, recipient_tnc_wallet_id, amount)
                 print(result)
                 # Extracting message and status code from the result
@@ -65,6 +85,16 @@ def dashboard(current_user):
             except (ValueError, TypeError):
                 return jsonify({'error': 'Invalid input for transfer.'}), 400
 
+        elif action == 'batch_transfer':
+            transfers, errors = parse_batch_transfers(request.json.get('transfers'))
+            if errors:
+                return jsonify({'error': 'Invalid input for batch transfer.', 'details': errors}), 400
+            chunk_size = request.json.get('chunk_size') or TRANSFER_BATCH_CHUNK_SIZE
+            if not isinstance(chunk_size, int) or chunk_size <= 0:
+                return jsonify({'error': 'chunk_size must be a positive integer.'}), 400
+            result, status_code = batch_transfer_tanacoin(user_id, transfers, chunk_size)
+            return jsonify(result), status_code
+
         elif action == 'add_promo_code':
             print('add promocode action called ')
             try:
@@ -73,7 +103,9 @@ def dashboard(current_user):
                 promo_code, added_tnc_percentage, start_date, end_date = generate_promo_code()
                 
                 # Now add the generated promo code to the database
-                create_promo_code(promo_code, added_tnc_percentage, start_date, end_date, creator_id)
+                created, error = create_promo_code(promo_code, added_tnc_percentage, start_date, end_date, creator_id)
+                if not created:
+                    return jsonify({'error': f'An error occurred while creating promo code: {error}'}), 500
 
                 return jsonify({'message': f'Promo code {promo_code} crée avec succée!','added_tnc_percentage':added_tnc_percentage,'promo_code':promo_code}), 200
 
@@ -83,7 +115,12 @@ def dashboard(current_user):
         elif action == 'get_promo_codes':
             print('getpromocode called')
             try:
-                promocodes = get_promo_codes_by_creator(user_id)
+                # Paging is opt-in; without limit/cursor the full list is returned as before
+                limit = request.json.get('limit')
+                page = get_promo_codes_by_creator(user_id, int(limit) if limit else None, request.json.get('cursor'))
+                if page is None:
+                    return jsonify({'error': 'An error occurred while retrieving promo codes.'}), 500
+                promocodes, next_cursor = page
                 
                 # Format the response to return the promo codes
                 promo_list = []
@@ -94,9 +131,12 @@ def dashboard(current_user):
                         'start_date': code['start_date'].strftime('%Y-%m-%d %H:%M:%S'),  # Convert datetime to string
                         'end_date': code['end_date'].strftime('%Y-%m-%d %H:%M:%S'),  # Convert datetime to string
                         'created_at': code['created_at'].strftime('%Y-%m-%d %H:%M:%S'),  # Convert datetime to string
+                        'archived': code['archived'],
                     })
 
-                return jsonify({'promocodes': promo_list}), 200
+                return jsonify({'promocodes': promo_list, 'next_cursor': next_cursor}), 200
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             except Exception as e:
                 return jsonify({'error': f'An error occurred while retrieving promo codes: {str(e)}'}), 500
 
@@ -206,6 +246,7 @@ def promocodevalidation(current_user):
 @app.route('/api/transaction-status', methods=['POST', 'GET'])
 @token_required
 def transaction_status(current_user):
+    """Queue a payment for background verification and return its job."""
     data = request.get_json()
     tx_hash = data.get('tx_hash')
     payment_method = data.get('payment_method')
@@ -218,38 +259,114 @@ def transaction_status(current_user):
     if not payment_method:
         return jsonify({"status": "error", "message": "Payment method is required"}), 400
 
-    added_percentage = 0
-    creator_id = None
+    if payment_method not in SUPPORTED_PAYMENT_METHODS:
+        return jsonify({"status": "error", "message": "Unsupported payment method"}), 400
+
+    finished = get_finished_job(user_id, tx_hash=tx_hash)
+    if finished and finished['status'] == 'completed':
+        # Repeat poll for a payment that was already credited
+        return jsonify(finished), 200
 
     if promo_code:
+        # Reject a bad code up front; the worker still claims it atomically when crediting
         promo_status = check_promocode_status(promo_code, user_id)
         if promo_status.get('status') != 'valid':
-            return jsonify({"status": "error", "message": promo_status.get('message', "Invalid or expired promo code")}), 400
-        creator_id = promo_status.get('creator_id')
-        added_percentage = float(promo_status.get('added_tnc_percentage', 0))
+            return jsonify({"status": "error",
+                            "message": promo_status.get('message', "Invalid or expired promo code")}), 400
 
     try:
-        result = None
-        if payment_method == 'ETH':
-            result = None
-        elif payment_method == 'BTC':
-            result = None
-        elif payment_method == 'USDT':
-            result = None
-        else:
-            return jsonify({"status": "error", "message": "Unsupported payment method"}), 400
-
-        if result.get("status") == "confirmed" and added_percentage > 0:
-            update_spender_id(promo_code, user_id)
-            tanacoin_purchased = result.get("tanacoin_purchased", "0")
-            add_bonus_to_creator(tanacoin_purchased, added_percentage, creator_id)
-
-        return jsonify(result)
+        job = enqueue_verification_job(user_id, tx_hash, payment_method, promo_code)
+        return jsonify(job), 200 if job['status'] == 'completed' else 202
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/api/transaction-status/<int:job_id>', methods=['GET'])
+@token_required
+def transaction_job_status(current_user, job_id):
+    """Return the state of a queued payment verification."""
+    job = get_job(job_id, current_user['user_id'])
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+@app.route('/api/transactions/verify-batch', methods=['POST'])
+@token_required
+def verify_transactions_batch(current_user):
+    """Check many tx hashes concurrently and stream the results as NDJSON (admins only)."""
+    if not current_user.get('is_superuser', False):
+        return jsonify({"message": "Unauthorized access. Admins only."}), 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "Expected a JSON object."}), 400
+    transactions = data.get('transactions') or []
+    tx_hashes = data.get('tx_hashes') or []
+    default_method = data.get('payment_method') or 'ETH'
+    if (not isinstance(transactions, list) or not isinstance(tx_hashes, list)
+            or not isinstance(default_method, str)
+            or not all(isinstance(t, dict) and isinstance(t.get('tx_hash', ''), str)
+                       and isinstance(t.get('payment_method') or '', str) for t in transactions)
+            or not all(isinstance(h, str) for h in tx_hashes)):
+        return jsonify({"message": "tx_hashes and transaction fields must be strings."}), 400
+    lines = [f"{t.get('tx_hash', '')},{t.get('payment_method') or ''}" for t in transactions] + tx_hashes
+    items = parse_items(lines, default_method.upper())
+    if not items:
+        return jsonify({"message": "No transaction hashes provided."}), 400
+    if any(item['payment_method'] not in SUPPORTED_PAYMENT_METHODS for item in items):
+        return jsonify({"message": "Unsupported payment method"}), 400
+
+    options = {}
+    concurrency = data.get('concurrency')
+    if concurrency is not None:
+        if isinstance(concurrency, bool) or not isinstance(concurrency, int):
+            return jsonify({"message": "concurrency must be an integer."}), 400
+        options['concurrency'] = max(1, min(concurrency, 100))
+    return Response(stream_with_context(iter_verify_ndjson(items, **options)), mimetype='application/x-ndjson')
+
+
+@app.route('/api/rates', methods=['GET'])
+def rates():
+    """Tanacoin prices per currency, including promo-adjusted prices."""
+    body, etag, max_age = get_rate_quotes()
+    if body is None:
+        return jsonify({"message": "Rates are temporarily unavailable"}), 503
+    response = make_response(body, 200)
+    response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    # Turns the response into a bodiless 304 when If-None-Match matches
+    return response.make_conditional(request)
+
+
+@app.route('/api/promo-codes/bulk', methods=['POST'])
+@token_required
+def bulk_promo_codes(current_user):
+    """Generate a campaign's worth of promo codes in one request (admins only)."""
+    if not current_user.get('is_superuser', False):
+        return jsonify({"message": "Unauthorized access. Admins only."}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        campaign = parse_bulk_request(data, default_creator_id=current_user['user_id'])
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    codes, error = create_promo_codes_bulk(**campaign)
+    if error:
+        return jsonify({"message": error, "created": len(codes), "codes": codes}), 500
+    return jsonify({"created": len(codes), "codes": codes}), 201
+
+
+@app.route('/api/metrics', methods=['GET'])
+@token_required
+def metrics_snapshot(current_user):
+    """Expose process metrics, including circuit breaker state, to admins."""
+    if not current_user.get('is_superuser', False):
+        return jsonify({"message": "Unauthorized access. Admins only."}), 403
+    return jsonify(metrics.snapshot()), 200
+
+
 @app.route('/signup', methods=['POST'])
 def signup():
     """Handle user signup."""
@@ -273,63 +390,55 @@ def kyc_status():
     This endpoint checks both regular KYC documents and temporary KYC documents
     if the user has just registered and their documents are still being processed.
     """
+    user_id = request.args.get('user_id')
+    temp_user_id = request.args.get('temp_user_id')
+
+    if not user_id and not temp_user_id:
+        return jsonify({
+            'status': 'not_started',
+            'message': 'User ID or temporary user ID is required',
+            'documents': []
+        }), 400
+
+    connection = get_db_connection()
     try:
-        user_id = request.args.get('user_id')
-        temp_user_id = request.args.get('temp_user_id')
-        
-        if not user_id and not temp_user_id:
-            return jsonify({
-                'status': 'not_started',
-                'message': 'User ID or temporary user ID is required',
-                'documents': []
-            }), 400
-            
-        connection = get_db_connection()
         kyc_service = KYCService(connection)
-        
-        # First check regular KYC status
-        if user_id:
-            result = asyncio.run(kyc_service.get_kyc_status(user_id))
-            if 'error' in result:
-                return jsonify({"message": result['error']}), 500
-                
-            # If no documents found but we have a temp_user_id, check temp documents
-            if result.get('status') == 'not_started' and temp_user_id:
-                temp_result = asyncio.run(kyc_service.get_kyc_status(temp_user_id))
-                if 'error' not in temp_result and temp_result.get('documents'):
-                    result = {
-                        'status': 'in_progress',
-                        'message': 'Documents uploaded but not yet linked to your account',
-                        'documents': temp_result['documents']
-                    }
-        else:
-            # Only temp_user_id provided
-            result = asyncio.run(kyc_service.get_kyc_status(temp_user_id))
-            if 'error' in result:
-                return jsonify({"message": result['error']}), 500
-        
+
+        # Account and temporary documents are resolved together in one query
+        result = kyc_service.get_kyc_status(user_id, temp_user_id)
+        if 'error' in result:
+            return jsonify({"message": result['error']}), 500
+
         return jsonify(result), 200
-        
+
     except Exception as e:
         logging.error(f"Error in kyc_status endpoint: {str(e)}")
         return jsonify({"message": f"Server error: {str(e)}"}), 500
     finally:
-        if 'connection' in locals() and connection:
-            connection.close()
+        connection.close()
+
 @app.route('/kyc/upload', methods=['POST'])
 def upload_kyc():
-    user_id = request.form.get('user_id')
-    document_type = request.form.get('document_type')
-    file = request.files.get('file')
+    # The form is parsed lazily, so the cap applies before any of the body is read
+    request.max_content_length = KYC_MAX_REQUEST_BYTES
+    try:
+        user_id = request.form.get('user_id')
+        document_type = request.form.get('document_type')
+        file = request.files.get('file')
+    except RequestEntityTooLarge as e:
+        return jsonify({"success": False, "message": e.description}), 413
     if not all([user_id, document_type, file]):
         return jsonify({"message": "Missing required fields."}), 400
     connection = get_db_connection()
-    kyc_service = KYCService(connection)
-    print(kyc_service)
-    success, message = asyncio.run(kyc_service.upload_kyc_document(user_id, document_type, file))
-    print(success ,message)
-    connection.close()
-    return jsonify({"success": success, "message": message}), 200 if success else 400
+    try:
+        kyc_service = KYCService(connection)
+        success, message = kyc_service.upload_kyc_document(user_id, document_type, file)
+        return jsonify({"success": success, "message": message}), 200 if success else 400
+    except Exception as e:
+        logging.error(f"Error uploading KYC document: {str(e)}")
+        return jsonify({"success": False, "message": f"Failed to upload KYC document: {str(e)}"}), 500
+    finally:
+        connection.close()
 
 @app.route('/api/kyc/link-documents', methods=['POST'])
 def link_kyc_documents():
@@ -344,7 +453,7 @@ def link_kyc_documents():
     connection = get_db_connection()
     try:
         kyc_service = KYCService(connection)
-        success, message = asyncio.run(kyc_service.link_temp_documents(temp_user_id, new_user_id))
+        success, message = kyc_service.link_temp_documents(temp_user_id, new_user_id)
         return jsonify({"success": success, "message": message}), 200 if success else 400
     except Exception as e:
         logging.error(f"Error linking KYC documents: {str(e)}")
@@ -352,6 +461,45 @@ def link_kyc_documents():
     finally:
         connection.close()
 
+@app.route('/api/kyc/review-queue', methods=['GET'])
+@token_required
+def kyc_review_queue(current_user):
+    """Pending KYC documents, oldest first, one keyset page at a time (admins only)."""
+    if not current_user.get('is_superuser', False):
+        return jsonify({"message": "Unauthorized access. Admins only."}), 403
+    try:
+        limit = int(request.args.get('limit', KYC_REVIEW_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"message": "limit must be an integer"}), 400
+    connection = get_db_connection()
+    try:
+        kyc_service = KYCService(connection)
+        documents, next_cursor = kyc_service.get_review_queue(limit, request.args.get('cursor'))
+        return jsonify({"documents": documents, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    finally:
+        connection.close()
+
+
+@app.route('/api/kyc/verify-bulk', methods=['POST'])
+@token_required
+def kyc_verify_bulk(current_user):
+    """Approve or reject many KYC documents in one transaction (admins only)."""
+    if not current_user.get('is_superuser', False):
+        return jsonify({"message": "Unauthorized access. Admins only."}), 403
+    data = request.get_json(silent=True) or {}
+    decisions, errors = parse_review_decisions(data.get('decisions'))
+    if errors:
+        return jsonify({"message": "Invalid review decisions.", "details": errors}), 400
+    connection = get_db_connection()
+    try:
+        kyc_service = KYCService(connection)
+        success, message, updated = kyc_service.verify_documents(decisions, current_user['user_id'])
+        return jsonify({"success": success, "message": message, "updated": updated}), 200 if success else 400
+    finally:
+        connection.close()
+
 @app.route('/api/superuser-dashboard', methods=['GET', 'PUT'])
 @token_required
 def superuser_dashboard(current_user):
@@ -476,24 +624,44 @@ def forgot_password():
     else:
         return {"message": "Failed to send password reset email"}, 500
     
+@app.route('/connect_wallet/nonce', methods=['POST'])
+def connect_wallet_nonce():
+    """Issue the message a wallet must sign (personal_sign) before /connect_wallet."""
+    data = request.get_json(silent=True) or {}
+    wallet_address = data.get('wallet_address')
+    if not wallet_address:
+        return jsonify({"message": "Wallet address is required."}), 400
+    message = issue_wallet_nonce(wallet_address)
+    if not message:
+        return jsonify({"message": "Could not issue a wallet nonce."}), 500
+    return jsonify({"message": message}), 200
+
 @app.route('/connect_wallet', methods=['POST'])
 def connect_wallet():
-    data = request.json
+    data = request.get_json(silent=True) or {}
     # Check if wallet address is provided
     wallet_address = data.get('wallet_address')
     if not wallet_address:
         return jsonify({"message": "Wallet address is required."}), 400
-    wallet_address = data.get('wallet_address')
-    print(wallet_address)
     chain_id = data.get('chain_id')
-    print(chain_id)
+    # Addresses are public: only a signature over our nonce proves ownership
+    if not verify_wallet_signature(wallet_address, data.get('signature')):
+        return jsonify({"message": "A valid signature of the wallet nonce is required."}), 401
+    # A signed-in user connecting a wallet links it to their account
+    token = request.headers.get('Authorization')
+    if token:
+        try:
+            payload = jwt.decode(token.split(" ")[1] if " " in token else token, SECRET_KEY, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return jsonify({'message': 'Invalid token'}), 403
+        linked, message = link_wallet_address(payload.get('user_id'), wallet_address, chain_id)
+        return jsonify({"message": message}), 200 if linked else 409
     # Attempt to log in the user using the wallet address
-    login_response = login_user(wallet_connect=True, wallet_address=wallet_address, chain_id=chain_id)
+    login_response = login_with_wallet(wallet_address)
     if login_response[1] == 200:  # If login is successful
         return jsonify(login_response[0]), 200
     # If login fails, we assume the user is not registered and attempt to register
-    data['wallet_connect'] = True
-    registration_response = register_user(data)
+    registration_response = register_user(data, verified_wallet_address=wallet_address, chain_id=chain_id)
     # Return the registration response
     return jsonify(registration_response[0]), registration_response[1]
 
@@ -0,0 +1,60 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Tuple
+
+# Background services run as daemon threads inside each web worker process
+# (RUN_BACKGROUND_SERVICES=1, the default) or in a dedicated process started
+# with `python -m app.background`.
+_services: List[Tuple[str, Callable[[threading.Event], None]]] = []
+_started = False
+_start_lock = threading.Lock()
+stop_event = threading.Event()
+
+
+def register_service(name: str, target: Callable[[threading.Event], None]) -> None:
+    """Register a long-running loop; target receives the shared stop event."""
+    _services.append((name, target))
+
+
+def register_periodic(name: str, interval: float, func: Callable[[], None]) -> None:
+    """Register func to be called every `interval` seconds."""
+    def loop(stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                func()
+            except Exception as e:
+                logging.error(f"Background service '{name}' failed: {e}")
+            stop.wait(interval)
+    register_service(name, loop)
+
+
+def start_background_services() -> bool:
+    """Start every registered service once per process."""
+    global _started
+    with _start_lock:
+        if _started:
+            return False
+        for name, target in _services:
+            thread = threading.Thread(target=target, args=(stop_event,), name=name, daemon=True)
+            thread.start()
+            logging.info(f"Started background service '{name}'")
+        _started = True
+        return True
+
+
+def background_enabled_in_web() -> bool:
+    return os.getenv('RUN_BACKGROUND_SERVICES', '1') == '1'
+
+
+if __name__ == '__main__':
+    # Importing the API registers every service without serving HTTP
+    os.environ['RUN_BACKGROUND_SERVICES'] = '0'
+    from . import api  # noqa: F401
+    start_background_services()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        stop_event.set()
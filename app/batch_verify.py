@@ -0,0 +1,240 @@
+"""Concurrent verification of many payment transaction hashes.
+
+Used for reconciliation and support: nothing is credited, every hash is only
+looked up and reported as one NDJSON line. Ethereum lookups are sent as
+JSON-RPC batches under their own request rate limit, through the same RPC
+endpoint pool and Infura circuit breaker as payment verification, so they
+follow its endpoint ranking, hedging and cooldowns. BTC lookups go through
+the shared BTC scheduler, so they count against the same provider quota as
+payment verification.
+
+    python -m app.batch_verify hashes.txt --method ETH --concurrency 20 > report.ndjson
+"""
+import argparse
+import asyncio
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+import requests
+
+from .eth_rpc import JsonRpcError, decode_usdt_transfer, hex_to_int
+from .btc_providers import BtcProviderError
+from .circuit_breaker import CircuitOpenError
+from .money import Money
+from .wallet_communications import (RECEIVER_ADDRESS,
+                                    RECEIVER_BTC_ADDRESS, RECEIVER_USDT_ADDRESS, REQUIRED_BTC_CONFIRMATIONS,
+                                    REQUIRED_ETH_CONFIRMATIONS, USDT_CONTRACT_ADDRESS,
+                                    btc_scheduler, eth_client, infura_breaker)
+
+BATCH_VERIFY_CONCURRENCY = int(os.getenv('BATCH_VERIFY_CONCURRENCY', 10))
+BATCH_VERIFY_ETH_RPS = float(os.getenv('BATCH_VERIFY_ETH_RPS', 10))
+ETH_RPC_BATCH_SIZE = int(os.getenv('ETH_RPC_BATCH_SIZE', 50))
+
+
+class AsyncRateLimiter:
+    """Token bucket shared by every coroutine calling one provider."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _same_address(a: Optional[str], b: Optional[str]) -> bool:
+    return bool(a and b) and a.lower() == b.lower()
+
+
+def summarize_eth_transaction(tx_hash: str, transaction: Optional[Dict[str, Any]],
+                              receipt: Optional[Dict[str, Any]], latest_block: int) -> Dict[str, Any]:
+    """Turn raw JSON-RPC transaction/receipt objects into a report line."""
+    if not transaction:
+        return {"tx_hash": tx_hash, "status": "not_found"}
+
+    block_number = hex_to_int(transaction.get('blockNumber'))
+    to_address = transaction.get('to')
+    input_data = transaction.get('input') or '0x'
+    line = {
+        "tx_hash": tx_hash,
+        "from": transaction.get('from'),
+        "block_number": block_number,
+    }
+    usdt_transfer = decode_usdt_transfer(input_data) if _same_address(to_address, USDT_CONTRACT_ADDRESS) else None
+    if usdt_transfer:
+        line.update({"type": "USDT", "to": usdt_transfer[0], "value_units": usdt_transfer[1]})
+        line["to_receiver"] = _same_address(line["to"], RECEIVER_USDT_ADDRESS)
+    else:
+        line.update({"type": "ETH", "to": to_address, "value_units": hex_to_int(transaction.get('value')) or 0})
+        line["to_receiver"] = _same_address(to_address, RECEIVER_ADDRESS)
+    line["value"] = str(Money(line["value_units"], line["type"]))
+
+    if block_number is None or not receipt:
+        line.update({"status": "pending", "confirmations": 0})
+    elif hex_to_int(receipt.get('status')) != 1:
+        line["status"] = "failed"
+    else:
+        confirmations = latest_block - block_number + 1
+        line["confirmations"] = confirmations
+        line["status"] = "confirmed" if confirmations >= REQUIRED_ETH_CONFIRMATIONS else "pending"
+    return line
+
+
+def summarize_btc_transaction(tx_hash: str, tx_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a BlockCypher transaction into a report line."""
+    outputs = tx_data.get("outputs") or [{}]
+    to_receiver = [o for o in outputs if RECEIVER_BTC_ADDRESS in (o.get("addresses") or [])]
+    output = to_receiver[0] if to_receiver else outputs[0]
+    confirmations = tx_data.get("confirmations", 0)
+    return {
+        "tx_hash": tx_hash,
+        "type": "BTC",
+        "from": (tx_data.get("inputs") or [{}])[0].get("addresses", ["Unknown"])[0],
+        "to": (output.get("addresses") or ["Unknown"])[0],
+        "value_units": output.get("value", 0),
+        "value": str(Money(output.get("value", 0), "BTC")),
+        "to_receiver": bool(to_receiver),
+        "block_number": tx_data.get("block_height"),
+        "confirmations": confirmations,
+        "status": "confirmed" if confirmations >= REQUIRED_BTC_CONFIRMATIONS else "pending",
+    }
+
+
+class BatchVerifier:
+    def __init__(self, concurrency: int = BATCH_VERIFY_CONCURRENCY, eth_rps: float = BATCH_VERIFY_ETH_RPS,
+                 client=None, batch_size: int = ETH_RPC_BATCH_SIZE):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.eth_limiter = AsyncRateLimiter(eth_rps)
+        self.client = client or eth_client
+        self.batch_size = batch_size
+
+    async def _eth_batch(self, tx_hashes: List[str]) -> List[Dict[str, Any]]:
+        """Look up transactions and receipts for a chunk of hashes in one JSON-RPC batch."""
+        calls = [('eth_blockNumber', ())]
+        for tx_hash in tx_hashes:
+            calls.append(('eth_getTransactionByHash', (tx_hash,)))
+            calls.append(('eth_getTransactionReceipt', (tx_hash,)))
+        async with self.semaphore:
+            await self.eth_limiter.acquire()
+            try:
+                # The pool's client is blocking; it fails over and hedges on its own threads
+                results = await asyncio.to_thread(infura_breaker.call, self.client.batch, calls)
+            except (requests.RequestException, TimeoutError, ValueError, JsonRpcError, CircuitOpenError) as e:
+                return [{"tx_hash": h, "status": "error", "message": str(e)} for h in tx_hashes]
+
+        latest_block = results[0] if not isinstance(results[0], Exception) else None
+        latest_block = hex_to_int(latest_block) or 0
+        lines = []
+        for i, tx_hash in enumerate(tx_hashes):
+            transaction, receipt = results[2 * i + 1], results[2 * i + 2]
+            if isinstance(transaction, Exception):
+                lines.append({"tx_hash": tx_hash, "status": "error", "message": str(transaction)})
+                continue
+            receipt = None if isinstance(receipt, Exception) else receipt
+            lines.append(summarize_eth_transaction(tx_hash, transaction, receipt, latest_block))
+        return lines
+
+    async def _btc_lookup(self, tx_hash: str) -> List[Dict[str, Any]]:
+        # Queued behind the scheduler's quota rather than holding a concurrency slot
+        try:
+            tx_data = await asyncio.wrap_future(btc_scheduler.submit(tx_hash))
+        except (BtcProviderError, CircuitOpenError) as e:
+            return [{"tx_hash": tx_hash, "status": "error", "message": str(e)}]
+        if not tx_data:
+            return [{"tx_hash": tx_hash, "status": "not_found"}]
+        return [summarize_btc_transaction(tx_hash, tx_data)]
+
+    async def verify(self, items: Iterable[Dict[str, str]]) -> AsyncIterator[Dict[str, Any]]:
+        """Yield one report line per item as soon as its lookup completes."""
+        eth_hashes, tasks = [], []
+        for item in items:
+            if item['payment_method'] == 'BTC':
+                tasks.append(asyncio.ensure_future(self._btc_lookup(item['tx_hash'])))
+            else:
+                eth_hashes.append(item['tx_hash'])
+        for i in range(0, len(eth_hashes), self.batch_size):
+            tasks.append(asyncio.ensure_future(self._eth_batch(eth_hashes[i:i + self.batch_size])))
+
+        for finished in asyncio.as_completed(tasks):
+            for line in await finished:
+                yield line
+
+
+def parse_items(lines: Iterable[str], default_method: str = 'ETH') -> List[Dict[str, str]]:
+    """Parse `tx_hash` or `tx_hash,method` lines, skipping blanks and duplicates."""
+    items, seen = [], set()
+    for raw in lines:
+        parts = [p.strip() for p in raw.split(',')]
+        if not parts[0] or parts[0] in seen:
+            continue
+        seen.add(parts[0])
+        method = (parts[1] if len(parts) > 1 and parts[1] else default_method).upper()
+        items.append({"tx_hash": parts[0], "payment_method": method})
+    return items
+
+
+async def _run(items: List[Dict[str, str]], emit, **options) -> None:
+    verifier = BatchVerifier(**options)
+    async for line in verifier.verify(items):
+        emit(line)
+
+
+def iter_verify_ndjson(items: List[Dict[str, str]], **options) -> Iterator[str]:
+    """Run the verification on its own event loop and yield NDJSON lines as they arrive."""
+    lines: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def worker():
+        try:
+            asyncio.run(_run(items, lambda line: lines.put(json.dumps(line, default=str) + '\n'), **options))
+        except Exception as e:
+            lines.put(json.dumps({"status": "error", "message": str(e)}) + '\n')
+        finally:
+            lines.put(None)
+
+    threading.Thread(target=worker, name='batch-verify', daemon=True).start()
+    while True:
+        line = lines.get()
+        if line is None:
+            return
+        yield line
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Verify many payment transaction hashes.")
+    parser.add_argument('input', nargs='?', default='-', help="file with one `tx_hash[,method]` per line")
+    parser.add_argument('--method', default='ETH', choices=['ETH', 'USDT', 'BTC'])
+    parser.add_argument('--concurrency', type=int, default=BATCH_VERIFY_CONCURRENCY)
+    parser.add_argument('--eth-rps', type=float, default=BATCH_VERIFY_ETH_RPS)
+    parser.add_argument('--batch-size', type=int, default=ETH_RPC_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    with source:
+        items = parse_items(source, args.method)
+
+    def emit(line):
+        sys.stdout.write(json.dumps(line, default=str) + '\n')
+        sys.stdout.flush()
+
+    asyncio.run(_run(items, emit, concurrency=args.concurrency, eth_rps=args.eth_rps,
+                     batch_size=args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
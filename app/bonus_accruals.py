@@ -0,0 +1,119 @@
+"""Durable queue of promo-creator bonuses, flushed in coalesced batches.
+
+Every confirmed promo purchase only inserts a row into
+``creator_bonus_accruals``. A periodic flush folds all pending accruals into
+one ledger credit per creator, so an influencer code with thousands of
+purchases costs its creator's wallet one write per flush interval.
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from . import metrics
+from .background import register_periodic
+from .db_schema import register_schema
+from .db_setup import get_db_connection
+from .ledger import append_entries
+from .money import Money, to_fraction
+
+BONUS_FLUSH_INTERVAL = float(os.getenv('BONUS_FLUSH_INTERVAL_SECONDS', 5))
+BONUS_FLUSH_BATCH = int(os.getenv('BONUS_FLUSH_BATCH', 10000))
+
+register_schema("""
+    CREATE TABLE IF NOT EXISTS creator_bonus_accruals (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        creator_id INT NOT NULL,
+        amount DECIMAL(30, 8) NOT NULL,
+        reference VARCHAR(100) NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        flushed_at DATETIME NULL,
+        UNIQUE KEY uq_bonus_accruals_reference (reference),
+        KEY idx_bonus_accruals_pending (flushed_at, id)
+    )
+""")
+
+
+def accrue_bonus(cursor, creator_id: int, amount: Money, reference: Optional[str] = None) -> bool:
+    """Queue a bonus on the caller's transaction; a repeated reference is ignored."""
+    cursor.execute("""
+        INSERT IGNORE INTO creator_bonus_accruals (creator_id, amount, reference)
+        VALUES (%s, %s, %s)
+    """, (creator_id, amount.to_decimal(), reference))
+    queued = cursor.rowcount > 0
+    if queued:
+        metrics.inc('bonus_accruals_queued')
+    return queued
+
+
+def flush_bonus_accruals(limit: int = BONUS_FLUSH_BATCH) -> int:
+    """Credit pending accruals, one ledger entry per creator; returns accruals flushed."""
+    started = time.monotonic()
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            # SKIP LOCKED lets a second flusher (another worker) take the next rows instead of waiting
+            cursor.execute("""
+                SELECT id, creator_id, amount FROM creator_bonus_accruals
+                WHERE flushed_at IS NULL
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (limit,))
+            accruals = cursor.fetchall()
+            if not accruals:
+                connection.rollback()
+                metrics.set_gauge('bonus_flush_last_batch', 0)
+                return 0
+
+            totals: Dict[int, Money] = defaultdict(lambda: Money.zero('TNC'))
+            ids: Dict[int, List[int]] = defaultdict(list)
+            for accrual in accruals:
+                totals[accrual['creator_id']] += Money.from_fraction(to_fraction(accrual['amount']), 'TNC')
+                ids[accrual['creator_id']].append(accrual['id'])
+
+            creators = sorted(totals)
+            cursor.execute(f"""
+                SELECT user_id, tnc_wallet_id FROM tnc_wallets
+                WHERE user_id IN ({', '.join(['%s'] * len(creators))})
+            """, creators)
+            wallets = {row['user_id']: row['tnc_wallet_id'] for row in cursor.fetchall()}
+            missing = [creator for creator in creators if creator not in wallets]
+            if missing:
+                logging.warning(f"Bonus accruals kept for creators without a wallet: {missing}")
+
+            credited = [creator for creator in creators if creator in wallets]
+            append_entries(cursor, [
+                (wallets[creator], totals[creator], 'promo_bonus', f"accruals:{ids[creator][0]}-{ids[creator][-1]}")
+                for creator in credited
+            ])
+            flushed_ids = [accrual_id for creator in credited for accrual_id in ids[creator]]
+            if flushed_ids:
+                cursor.execute(f"""
+                    UPDATE creator_bonus_accruals SET flushed_at = NOW()
+                    WHERE id IN ({', '.join(['%s'] * len(flushed_ids))})
+                """, flushed_ids)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    metrics.inc('bonus_accruals_flushed', len(flushed_ids))
+    metrics.inc('bonus_creator_credits', len(credited))
+    metrics.set_gauge('bonus_flush_last_seconds', round(time.monotonic() - started, 3))
+    metrics.set_gauge('bonus_flush_last_creators', len(credited))
+    metrics.set_gauge('bonus_flush_max_accruals_per_creator', max(len(ids[c]) for c in credited) if credited else 0)
+    # A full batch means the flush is falling behind the accrual rate
+    metrics.set_gauge('bonus_flush_last_batch', len(accruals))
+    return len(flushed_ids)
+
+
+def _bonus_flush_stats() -> Dict[str, float]:
+    return {'interval_seconds': BONUS_FLUSH_INTERVAL, 'batch_limit': BONUS_FLUSH_BATCH}
+
+
+metrics.register_collector('bonus_accruals', 'config', _bonus_flush_stats)
+register_periodic('bonus-accrual-flush', BONUS_FLUSH_INTERVAL, flush_bonus_accruals)
@@ -0,0 +1,261 @@
+"""BTC transaction providers and the quota-aware scheduler in front of them.
+
+Providers return BlockCypher-shaped transaction dicts (``inputs``, ``outputs``,
+``confirmations``...) or None when the hash is unknown. The scheduler is the
+only caller: it serializes requests through per-second and per-hour token
+buckets, shares one request between callers asking for the same hash, and
+backs off when the provider reports throttling.
+
+The buckets live in each process, while the provider counts every request
+made with our token. BTC_QUOTA_PER_SECOND and BTC_QUOTA_PER_HOUR are the
+account-wide limits and every process enforces its share of them:
+BTC_QUOTA_SHARES defaults to WEB_CONCURRENCY, the number of gunicorn workers.
+Count one more share for each other process looking up BTC transactions,
+such as a running ``app.batch_verify`` job.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Deque, Dict, Optional
+
+import requests
+
+from . import metrics
+
+BTC_PROVIDER = os.getenv('BTC_PROVIDER', 'blockcypher')
+BLOCKCYPHER_TOKEN = os.getenv('BLOCKCYPHER_TOKEN')
+BTC_STANDIN_FIXTURES = os.getenv('BTC_STANDIN_FIXTURES')
+BTC_QUOTA_PER_SECOND = float(os.getenv('BTC_QUOTA_PER_SECOND', 3))
+BTC_QUOTA_PER_HOUR = float(os.getenv('BTC_QUOTA_PER_HOUR', 100))
+BTC_QUOTA_SHARES = max(1, int(os.getenv('BTC_QUOTA_SHARES', os.getenv('WEB_CONCURRENCY', 1))))
+BTC_SCHEDULER_MAX_WAIT = float(os.getenv('BTC_SCHEDULER_MAX_WAIT_SECONDS', 10))
+
+
+class BtcProviderError(Exception):
+    """The provider could not answer (network error, server error)."""
+
+
+class BtcRateLimited(BtcProviderError):
+    """The provider throttled us; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"BTC provider rate limited, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class SchedulerBusy(Exception):
+    """The request could not be served within the caller's wait budget."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("BTC lookups are queued behind the provider quota")
+        self.name = 'btc_scheduler'
+        self.retry_after = retry_after
+
+
+class BtcProvider(ABC):
+    name = 'base'
+
+    @abstractmethod
+    def get_transaction(self, tx_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the transaction, or None when the provider does not know the hash."""
+
+    def remaining_quota(self) -> Optional[int]:
+        """Requests left in the provider's current window, if it reports it."""
+        return None
+
+
+class BlockCypherProvider(BtcProvider):
+    name = 'blockcypher'
+
+    def __init__(self, base_url: str, token: Optional[str] = BLOCKCYPHER_TOKEN, timeout: float = 5):
+        self.base_url = base_url
+        self.token = token
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._remaining: Optional[int] = None
+
+    def get_transaction(self, tx_hash: str) -> Optional[Dict[str, Any]]:
+        params = {'token': self.token} if self.token else None
+        try:
+            response = self.session.get(f"{self.base_url}/txs/{tx_hash}", params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise BtcProviderError(str(e)) from e
+
+        remaining = response.headers.get('X-Ratelimit-Remaining')
+        if remaining and remaining.isdigit():
+            self._remaining = int(remaining)
+        if response.status_code == 429:
+            raise BtcRateLimited(float(response.headers.get('Retry-After', 60)))
+        if response.status_code == 404:
+            return None
+        if response.status_code >= 500:
+            raise BtcProviderError(f"BlockCypher returned {response.status_code}")
+        if response.status_code != 200:
+            # 400 and friends: malformed hash, treat it like an unknown transaction
+            return None
+        return response.json()
+
+    def remaining_quota(self) -> Optional[int]:
+        return self._remaining
+
+
+class LocalBtcProvider(BtcProvider):
+    """Stand-in provider serving transactions from memory or a JSON fixture file.
+
+    The fixture file maps tx hashes to BlockCypher-shaped transaction objects.
+    """
+    name = 'local'
+
+    def __init__(self, transactions: Optional[Dict[str, Dict[str, Any]]] = None,
+                 fixtures_path: Optional[str] = BTC_STANDIN_FIXTURES):
+        self.transactions = dict(transactions or {})
+        if fixtures_path:
+            with open(fixtures_path) as f:
+                self.transactions.update(json.load(f))
+
+    def add_transaction(self, tx_hash: str, tx_data: Dict[str, Any]) -> None:
+        self.transactions[tx_hash] = tx_data
+
+    def get_transaction(self, tx_hash: str) -> Optional[Dict[str, Any]]:
+        return self.transactions.get(tx_hash)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class BtcRequestScheduler:
+    """Serve provider lookups within the provider's quota.
+
+    Requests are queued and dispatched by a single thread. Concurrent lookups of
+    the same hash share one provider call. The hourly quota is spread evenly:
+    its bucket holds at most a minute's worth of tokens, so a burst cannot
+    exhaust the whole hour at once.
+    """
+
+    def __init__(self, provider: BtcProvider, per_second: float = BTC_QUOTA_PER_SECOND / BTC_QUOTA_SHARES,
+                 per_hour: float = BTC_QUOTA_PER_HOUR / BTC_QUOTA_SHARES,
+                 call_wrapper: Optional[Callable[..., Any]] = None):
+        self.provider = provider
+        self.call_wrapper = call_wrapper
+        self._second = _TokenBucket(per_second, max(1.0, per_second))
+        self._hour = _TokenBucket(per_hour / 3600, max(1.0, per_hour / 60))
+        self._paused_until = 0.0
+        self._queue: Deque[str] = deque()
+        self._inflight: Dict[str, Future] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        metrics.register_collector('btc_scheduler', provider.name, self.stats)
+
+    def _ensure_dispatcher(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._dispatch_loop, name='btc-scheduler', daemon=True)
+            self._thread.start()
+
+    def submit(self, tx_hash: str) -> Future:
+        with self._cond:
+            future = self._inflight.get(tx_hash)
+            if future is not None:
+                metrics.inc('btc_scheduler_coalesced')
+                return future
+            future = Future()
+            self._inflight[tx_hash] = future
+            self._queue.append(tx_hash)
+            self._ensure_dispatcher()
+            self._cond.notify()
+            return future
+
+    def get_transaction(self, tx_hash: str, timeout: float = BTC_SCHEDULER_MAX_WAIT) -> Optional[Dict[str, Any]]:
+        future = self.submit(tx_hash)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # The lookup stays queued; a later poll for the same hash picks it up
+            raise SchedulerBusy(self.estimated_wait())
+
+    def estimated_wait(self) -> float:
+        with self._cond:
+            backlog = len(self._queue)
+            return max(self._paused_until - time.monotonic(), 0) + backlog / max(self._hour.rate, 1e-9)
+
+    def _reserve(self) -> float:
+        """Take a token from both buckets, or return how long to wait for one."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._second.refill(now)
+        self._hour.refill(now)
+        remaining = self.provider.remaining_quota()
+        if remaining is not None:
+            self._hour.tokens = min(self._hour.tokens, remaining)
+        wait = max(self._second.wait_time(), self._hour.wait_time())
+        if wait == 0:
+            self._second.tokens -= 1
+            self._hour.tokens -= 1
+        return wait
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                wait = self._reserve()
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+                tx_hash = self._queue.popleft()
+                future = self._inflight[tx_hash]
+
+            try:
+                if self.call_wrapper:
+                    result = self.call_wrapper(self.provider.get_transaction, tx_hash)
+                else:
+                    result = self.provider.get_transaction(tx_hash)
+            except BtcRateLimited as e:
+                logging.warning(f"{self.provider.name} throttled, pausing {e.retry_after:.0f}s")
+                metrics.inc('btc_scheduler_throttled')
+                with self._cond:
+                    self._paused_until = time.monotonic() + e.retry_after
+                    self._queue.appendleft(tx_hash)
+                continue
+            except Exception as e:
+                with self._cond:
+                    self._inflight.pop(tx_hash, None)
+                future.set_exception(e)
+                continue
+
+            metrics.inc('btc_scheduler_requests')
+            with self._cond:
+                self._inflight.pop(tx_hash, None)
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'hourly_tokens': round(self._hour.tokens, 2),
+                'provider_remaining': self.provider.remaining_quota(),
+                'paused_for': max(0.0, round(self._paused_until - time.monotonic(), 1)),
+            }
+
+
+def create_btc_provider(base_url: str, timeout: float) -> BtcProvider:
+    if BTC_PROVIDER == 'local':
+        return LocalBtcProvider()
+    return BlockCypherProvider(base_url, timeout=timeout)
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from . import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is temporarily unavailable")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker with half-open probing.
+
+    The breaker keeps the outcome of calls made during the last
+    ``window_seconds``. Once at least ``minimum_calls`` were recorded and the
+    failure rate reaches ``failure_rate_threshold`` the circuit opens and every
+    call fails immediately with CircuitOpenError. After ``open_seconds`` up to
+    ``half_open_max_calls`` probe calls are let through: a successful probe
+    closes the circuit, a failed one opens it again.
+
+    Exceptions listed in ``excluded_exceptions`` (e.g. "transaction not found")
+    mean the dependency answered; they are re-raised but count as successes.
+    """
+
+    def __init__(self, name: str, failure_rate_threshold: float = 0.5, minimum_calls: int = 5,
+                 window_seconds: float = 60, open_seconds: float = 30, half_open_max_calls: int = 1,
+                 excluded_exceptions: Tuple[type, ...] = ()):
+        self.name = name
+        self.excluded_exceptions = excluded_exceptions
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._rejected = 0
+        self._times_opened = 0
+
+        metrics.register_collector('circuit_breakers', name, self.stats)
+
+    @classmethod
+    def from_env(cls, name: str, excluded_exceptions: Tuple[type, ...] = ()) -> 'CircuitBreaker':
+        """Build a breaker configured by CIRCUIT_<NAME>_* environment variables."""
+        prefix = f"CIRCUIT_{name.upper()}_"
+        return cls(
+            name,
+            failure_rate_threshold=float(os.getenv(prefix + 'FAILURE_RATE', 0.5)),
+            minimum_calls=int(os.getenv(prefix + 'MINIMUM_CALLS', 5)),
+            window_seconds=float(os.getenv(prefix + 'WINDOW_SECONDS', 60)),
+            open_seconds=float(os.getenv(prefix + 'OPEN_SECONDS', 30)),
+            half_open_max_calls=int(os.getenv(prefix + 'HALF_OPEN_CALLS', 1)),
+            excluded_exceptions=excluded_exceptions,
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state
+
+    def _refresh_state(self, now: float) -> None:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_in_flight = 0
+            logging.info(f"Circuit '{self.name}' half-open, probing")
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _open(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self._times_opened += 1
+        logging.warning(f"Circuit '{self.name}' opened")
+
+    def _before_call(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._refresh_state(now)
+            if self._state == OPEN:
+                self._rejected += 1
+                raise CircuitOpenError(self.name, self.open_seconds - (now - self._opened_at))
+            if self._state == HALF_OPEN:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._half_open_in_flight += 1
+
+    def _record(self, success: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if success:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logging.info(f"Circuit '{self.name}' closed")
+                else:
+                    self._open(now)
+                return
+            if self._state == OPEN:
+                return
+            self._outcomes.append((now, success))
+            self._trim(now)
+            total = len(self._outcomes)
+            if total >= self.minimum_calls:
+                failures = sum(1 for _, ok in self._outcomes if not ok)
+                if failures / total >= self.failure_rate_threshold:
+                    self._open(now)
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call func through the breaker; exceptions count as failures and are re-raised."""
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except self.excluded_exceptions:
+            self._record(True)
+            raise
+        except Exception:
+            self._record(False)
+            raise
+        self._record(True)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._refresh_state(now)
+            self._trim(now)
+            total = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                'state': self._state,
+                'window_calls': total,
+                'window_failures': failures,
+                'failure_rate': failures / total if total else 0.0,
+                'rejected_calls': self._rejected,
+                'times_opened': self._times_opened,
+            }
@@ -2,6 +2,8 @@ from .db_setup import get_db_connection
 import logging
 import base64
 import pymysql
+from .ledger import pending_balances
+from .money import Money, to_fraction
 
 def encode_base64(data):
     """Encode bytes data to base64 string."""
@@ -196,6 +198,13 @@ def get_all_user_details():
                 if not cursor.nextset():
                     break
 
+            # Balances are snapshots; add each wallet's not yet compacted ledger entries
+            pending = pending_balances(cursor, [u['tnc_wallet_id'] for u in user_details if u['tnc_wallet_id']])
+            for user in user_details:
+                if user['tnc_wallet_id'] in pending:
+                    balance = to_fraction(user['tnc_wallet_balance'] or 0) + pending[user['tnc_wallet_id']].to_fraction()
+                    user['tnc_wallet_balance'] = str(Money.from_fraction(balance, 'TNC'))
+
             # Now user_details is a list of dictionaries that you can return, print, or process further
             return user_details
 
@@ -0,0 +1,67 @@
+from .db_setup import get_db_connection
+import pymysql
+import logging
+
+# Tables and indexes owned by the Python services. Stored procedures and the
+# original tables are managed in the database itself; everything here is
+# idempotent so `python -m app.db_schema` can be re-run on every deploy.
+SCHEMA_STATEMENTS = []
+
+# Columns the services write to in tables managed by the database itself,
+# checked by apply_schema() so a drifted table fails the deploy, not a request
+REQUIRED_COLUMNS = {}
+
+# MySQL errors meaning "already applied": table/column/index/partitioning exists
+_ALREADY_APPLIED = {1050, 1060, 1061, 1068, 1091, 1505, 1517}
+
+
+def register_schema(*statements):
+    """Register DDL statements to be applied by apply_schema()."""
+    SCHEMA_STATEMENTS.extend(statements)
+
+
+def require_columns(table, *columns):
+    """Register columns of a database-managed table that the services rely on."""
+    REQUIRED_COLUMNS.setdefault(table, set()).update(columns)
+
+
+def check_required_columns(cursor):
+    """Raise if a registered table lacks any of its required columns."""
+    missing = []
+    for table, columns in sorted(REQUIRED_COLUMNS.items()):
+        cursor.execute("""
+            SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,))
+        existing = {row['COLUMN_NAME'] for row in cursor.fetchall()}
+        missing.extend(f"{table}.{column}" for column in sorted(columns - existing))
+    if missing:
+        raise RuntimeError(f"Database is missing required columns: {', '.join(missing)}")
+
+
+def apply_schema():
+    """Apply every registered statement, skipping the ones already in place."""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            for statement in SCHEMA_STATEMENTS:
+                try:
+                    cursor.execute(statement)
+                except pymysql.MySQLError as e:
+                    if e.args and e.args[0] in _ALREADY_APPLIED:
+                        logging.debug(f"Schema statement already applied: {e}")
+                        continue
+                    raise
+            check_required_columns(cursor)
+        connection.commit()
+        logging.info(f"Applied {len(SCHEMA_STATEMENTS)} schema statements.")
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    import os
+    # Importing the API registers every module's tables without starting services
+    os.environ['RUN_BACKGROUND_SERVICES'] = '0'
+    from . import api  # noqa: F401
+    apply_schema()
@@ -0,0 +1,309 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from . import metrics
+
+ETH_RPC_BATCH_WINDOW = float(os.getenv('ETH_RPC_BATCH_WINDOW_MS', 5)) / 1000
+ETH_RPC_MAX_BATCH = int(os.getenv('ETH_RPC_MAX_BATCH', 100))
+USDT_TRANSFER_SELECTOR = '0xa9059cbb'
+ETH_RPC_HEDGE_PERCENTILE = float(os.getenv('ETH_RPC_HEDGE_PERCENTILE', 95))
+ETH_RPC_HEDGE_MIN_MS = float(os.getenv('ETH_RPC_HEDGE_MIN_MS', 50))
+ETH_RPC_EWMA_ALPHA = float(os.getenv('ETH_RPC_EWMA_ALPHA', 0.2))
+ETH_RPC_COOLDOWN_SECONDS = float(os.getenv('ETH_RPC_COOLDOWN_SECONDS', 30))
+
+RpcCall = Tuple[str, Sequence[Any]]
+
+
+class JsonRpcError(Exception):
+    """Error object returned by the node for a single call."""
+
+    def __init__(self, method: str, error: Dict[str, Any]):
+        super().__init__(f"{method}: {error.get('message', error)}")
+        self.method = method
+        self.code = error.get('code')
+
+
+def hex_to_int(value: Optional[str]) -> Optional[int]:
+    return int(value, 16) if value else None
+
+
+def decode_usdt_transfer(input_data: str) -> Optional[Tuple[str, int]]:
+    """Return (recipient, raw amount) for ERC-20 transfer(address,uint256) calldata."""
+    if not input_data or not input_data.startswith(USDT_TRANSFER_SELECTOR) or len(input_data) < 138:
+        return None
+    # 4-byte selector, then the 32-byte padded recipient and the 32-byte amount
+    return '0x' + input_data[34:74], int(input_data[74:138], 16)
+
+
+def build_batch_payload(calls: Sequence[RpcCall]) -> List[Dict[str, Any]]:
+    return [{"jsonrpc": "2.0", "id": i, "method": method, "params": list(params)}
+            for i, (method, params) in enumerate(calls)]
+
+
+def parse_batch_reply(calls: Sequence[RpcCall], replies: Any) -> List[Any]:
+    """Match batch replies to calls by id; failed calls are returned as JsonRpcError."""
+    if not isinstance(replies, list):
+        error = replies.get('error', {}) if isinstance(replies, dict) else {}
+        raise JsonRpcError('batch', error or {'message': 'Invalid JSON-RPC batch reply'})
+    by_id = {reply.get('id'): reply for reply in replies}
+    results = []
+    for i, (method, _) in enumerate(calls):
+        reply = by_id.get(i)
+        if reply is None:
+            results.append(JsonRpcError(method, {'message': 'Missing reply in batch'}))
+        elif 'error' in reply:
+            results.append(JsonRpcError(method, reply['error']))
+        else:
+            results.append(reply.get('result'))
+    return results
+
+
+class EthRpcClient:
+    """Minimal JSON-RPC client that sends every request as a batch."""
+
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    @property
+    def batch_timeout(self) -> float:
+        """Longest batch() can take: connecting and reading are each bounded by timeout."""
+        return self.timeout * 2
+
+    def batch(self, calls: Sequence[RpcCall]) -> List[Any]:
+        response = self.session.post(self.url, json=build_batch_payload(calls), timeout=self.timeout)
+        response.raise_for_status()
+        return parse_batch_reply(calls, response.json())
+
+    def call(self, method: str, *params) -> Any:
+        result = self.batch([(method, params)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class EndpointHealth:
+    """Latency and error statistics for one RPC endpoint."""
+
+    def __init__(self, client: EthRpcClient, alpha: float = ETH_RPC_EWMA_ALPHA):
+        self.client = client
+        self.alpha = alpha
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.hedged = 0
+        self.latencies: Deque[float] = deque(maxlen=200)
+        self.lock = threading.Lock()
+
+    def record(self, latency: Optional[float], ok: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.error_ewma = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_ewma
+            if ok:
+                self.consecutive_errors = 0
+                self.latencies.append(latency)
+                if self.latency_ewma is None:
+                    self.latency_ewma = latency
+                else:
+                    self.latency_ewma = self.alpha * latency + (1 - self.alpha) * self.latency_ewma
+            else:
+                self.consecutive_errors += 1
+                if self.consecutive_errors >= 3:
+                    # Back off exponentially from an endpoint that keeps failing
+                    backoff = ETH_RPC_COOLDOWN_SECONDS * 2 ** min(self.consecutive_errors - 3, 4)
+                    self.cooldown_until = time.monotonic() + backoff
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self) -> float:
+        # Unmeasured endpoints get tried early; errors weigh heavily
+        latency = self.latency_ewma if self.latency_ewma is not None else 0.0
+        return latency * (1 + 10 * self.error_ewma) + self.error_ewma
+
+    def hedge_delay(self, percentile: float = ETH_RPC_HEDGE_PERCENTILE) -> float:
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < 20:
+            return max(ETH_RPC_HEDGE_MIN_MS / 1000, self.client.timeout / 4)
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return max(ETH_RPC_HEDGE_MIN_MS / 1000, samples[index])
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'latency_ewma_ms': round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+                'error_rate_ewma': round(self.error_ewma, 3),
+                'healthy': self.healthy(time.monotonic()),
+                'requests': self.requests,
+                'hedged_requests': self.hedged,
+            }
+
+
+class MultiEndpointClient:
+    """JSON-RPC client spreading reads over several endpoints.
+
+    Each batch goes to the healthy endpoint with the best latency/error score.
+    If it has not answered after that endpoint's latency percentile, the same
+    batch is hedged to the next best endpoint and the first answer wins. Failed
+    endpoints are retried on the next one and cooled down after repeated errors.
+    """
+
+    def __init__(self, urls: Sequence[str], timeout: float = 5, hedge: bool = True):
+        if not urls:
+            raise ValueError("At least one RPC endpoint is required")
+        self.timeout = timeout
+        self.hedge = hedge and len(urls) > 1
+        self.endpoints = [EndpointHealth(EthRpcClient(url, timeout=timeout)) for url in urls]
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(urls)), thread_name_prefix='eth-rpc')
+        for i, endpoint in enumerate(self.endpoints):
+            metrics.register_collector('eth_endpoints', f"endpoint_{i}", endpoint.stats)
+
+    @classmethod
+    def from_env(cls, default_url: Optional[str], timeout: float = 5) -> 'MultiEndpointClient':
+        """Build from the comma-separated ETH_RPC_URLS, falling back to default_url."""
+        urls = [u.strip() for u in os.getenv('ETH_RPC_URLS', '').split(',') if u.strip()]
+        return cls(urls or [default_url], timeout=timeout)
+
+    @property
+    def batch_timeout(self) -> float:
+        """Longest batch() can take when failing over through every endpoint.
+
+        Each endpoint is tried at most once. A round waits for the hedge delay
+        (no longer than one request) and then for the primary and its hedge,
+        each allowed ``timeout * 2`` like a single request.
+        """
+        return len(self.endpoints) * 6 * self.timeout
+
+    def _ranked(self) -> List[EndpointHealth]:
+        now = time.monotonic()
+        healthy = [e for e in self.endpoints if e.healthy(now)]
+        if healthy:
+            return sorted(healthy, key=lambda e: e.score())
+        # Everything is cooling down: try whichever recovers first
+        return sorted(self.endpoints, key=lambda e: e.cooldown_until)
+
+    def _send(self, endpoint: EndpointHealth, calls: Sequence[RpcCall]) -> List[Any]:
+        started = time.monotonic()
+        try:
+            results = endpoint.client.batch(calls)
+        except Exception:
+            endpoint.record(None, False)
+            raise
+        endpoint.record(time.monotonic() - started, True)
+        return results
+
+    def batch(self, calls: Sequence[RpcCall]) -> List[Any]:
+        ranked = self._ranked()
+        last_error: Optional[Exception] = None
+        while ranked:
+            primary = ranked.pop(0)
+            futures = {self._executor.submit(self._send, primary, calls): primary}
+            if self.hedge and ranked:
+                done, _ = wait(futures, timeout=primary.hedge_delay())
+                if not done:
+                    backup = ranked.pop(0)
+                    backup.hedged += 1
+                    futures[self._executor.submit(self._send, backup, calls)] = backup
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=self.timeout * 2, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    last_error = future.exception()
+            logging.warning(f"RPC endpoint failed, failing over: {last_error}")
+        raise last_error or TimeoutError("No RPC endpoint answered")
+
+    def call(self, method: str, *params) -> Any:
+        result = self.batch([(method, params)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class RpcBatcher:
+    """Coalesce calls made by concurrent threads of this worker into shared batches.
+
+    The first caller waits ``window`` seconds for others to join, then sends
+    everyone's calls (identical calls only once) in a single JSON-RPC batch.
+    """
+
+    def __init__(self, client, window: float = ETH_RPC_BATCH_WINDOW,
+                 max_batch: int = ETH_RPC_MAX_BATCH):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[RpcCall, Future]] = []
+        self._flush_scheduled = False
+
+    def execute(self, calls: Sequence[RpcCall]) -> List[Any]:
+        """Run calls in the next shared batch; per-call errors are returned, not raised."""
+        futures = []
+        leader = False
+        with self._lock:
+            for method, params in calls:
+                future: Future = Future()
+                self._pending.append(((method, tuple(params)), future))
+                futures.append(future)
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                leader = True
+            elif len(self._pending) >= self.max_batch:
+                leader = True
+        if leader:
+            if self.window and len(self._pending) < self.max_batch:
+                time.sleep(self.window)
+            self._flush()
+        # _flush resolves every future; the bound only guards against a leader that never returns
+        timeout = self.window + self.client.batch_timeout
+        return [future.result(timeout=timeout) for future in futures]
+
+    def _flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._flush_scheduled = False
+        if not pending:
+            return
+        unique_calls: List[RpcCall] = []
+        index: Dict[RpcCall, int] = {}
+        for call, _ in pending:
+            if call not in index:
+                index[call] = len(unique_calls)
+                unique_calls.append(call)
+        try:
+            results = self.client.batch(unique_calls)
+        except Exception as e:
+            logging.error(f"JSON-RPC batch of {len(unique_calls)} calls failed: {e}")
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for call, future in pending:
+            future.set_result(results[index[call]])
+
+
+def get_transaction_bundle(batcher: RpcBatcher, tx_hash: str) -> Tuple[Optional[Dict[str, Any]],
+                                                                        Optional[Dict[str, Any]], int]:
+    """Fetch the transaction, its receipt and the latest block number in one round trip."""
+    transaction, receipt, block_number = batcher.execute([
+        ('eth_getTransactionByHash', (tx_hash,)),
+        ('eth_getTransactionReceipt', (tx_hash,)),
+        ('eth_blockNumber', ()),
+    ])
+    for result in (transaction, receipt, block_number):
+        if isinstance(result, Exception):
+            raise result
+    return transaction, receipt, hex_to_int(block_number)
@@ -1,6 +1,22 @@
 from .db_setup import get_db_connection
+from .db_schema import require_columns
 from pymysql import MySQLError
 from datetime import datetime
+from .money import Money
+from .ledger import append_entries, get_wallet_id, lock_balances
+from .promo_cache import invalidate_promo_code, promo_filter, promo_metadata, remember_promo_code
+from typing import Any, Dict, List, Tuple
+import hashlib
+import os
+import uuid
+
+TRANSFER_BATCH_MAX_ITEMS = int(os.getenv('TRANSFER_BATCH_MAX_ITEMS', 5000))
+TRANSFER_BATCH_CHUNK_SIZE = int(os.getenv('TRANSFER_BATCH_CHUNK_SIZE', 500))
+
+# Transfer rows are written here instead of through the transfer_tanacoin procedure
+TRANSFER_COLUMNS = ('sender_id', 'recipient_tnc_wallet_id', 'amount', 'status', 'transaction_hash',
+                    'transaction_date')
+require_columns('transactions', *TRANSFER_COLUMNS)
 
 # Function to call the 'ManageTanacoinSupply' procedure
 def manage_tanacoin_supply(action, amount):
@@ -57,19 +73,23 @@ def get_tanacoin_rate():
         print("Error: Tanacoin rate not found")
         return None
 
-def transfer_tanacoin(sender_id, recipient_tnc_wallet_id, amount):
+def transfer_tanacoin(sender_id, recipient_tnc_wallet_id, amount: Money):
     print(f"Initiating transfer: Sender ID = {sender_id}, recipient_tnc_wallet_id = {recipient_tnc_wallet_id}, Amount = {amount}")  # Print the function's inputs
     connection = get_db_connection()
     
     try:
-        print("Connecting to the database...")  # Indicating the database connection attempt
-        with connection.cursor() as cursor:
-            print(f"Calling stored procedure 'transfer_tanacoin' with sender_id={sender_id}, recipient_tnc_wallet_id={recipient_tnc_wallet_id}, amount={amount}")  # Print the stored procedure parameters
-            cursor.callproc('transfer_tanacoin', (sender_id, recipient_tnc_wallet_id, amount))
-            result = cursor.fetchone()
-            connection.commit()
-            print(f"Transaction successful. Transaction hash: {result}")  # Print the transaction hash returned by the procedure
-            return {"message": "Transaction effectuée avec succès", "transaction_hash": result}, 200
+        sender_wallet_id = _sender_wallet_id(connection, sender_id)
+        if not sender_wallet_id:
+            return {"message": "Sender wallet not found"}, 404
+        # Same ledger path as batch transfers: debit and credit entries plus the transfer row
+        result = _apply_transfer_chunk(connection, sender_id, sender_wallet_id,
+                                       [(recipient_tnc_wallet_id, amount)], 0)[0]
+        if result["status"] != "ok":
+            connection.rollback()
+            return {"message": result["message"]}, 400
+        connection.commit()
+        print(f"Transaction successful. Transaction hash: {result['transaction_hash']}")  # Print the transaction hash
+        return {"message": "Transaction effectuée avec succès", "transaction_hash": result["transaction_hash"]}, 200
 
     except MySQLError as e:
         print(f"MySQL error occurred: {e}")  # Print MySQL-specific error message
@@ -80,6 +100,108 @@ def transfer_tanacoin(sender_id, recipient_tnc_wallet_id, amount):
         print("Closing database connection...")  # Indicating database connection closure
         connection.close()
 
+def parse_batch_transfers(items) -> Tuple[List[Tuple[str, Money]], List[Dict[str, Any]]]:
+    """Validate a list of {recipient_tnc_wallet_id, amount} items; returns (transfers, errors)."""
+    if not isinstance(items, list) or not items:
+        return [], [{"index": None, "message": "transfers must be a non-empty list"}]
+    if len(items) > TRANSFER_BATCH_MAX_ITEMS:
+        return [], [{"index": None, "message": f"At most {TRANSFER_BATCH_MAX_ITEMS} transfers per batch"}]
+    transfers, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            recipient = str(item['recipient_tnc_wallet_id']).strip()
+            amount = Money.parse(item['amount'], 'TNC')
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({"index": index, "message": f"Invalid transfer: {e}"})
+            continue
+        if not recipient or amount.units <= 0:
+            errors.append({"index": index, "message": "Recipient and a positive amount are required"})
+            continue
+        transfers.append((recipient, amount))
+    return transfers, errors
+
+
+def _apply_transfer_chunk(connection, sender_id, sender_wallet_id, chunk, offset) -> List[Dict[str, Any]]:
+    """Apply one chunk inside the caller's transaction and return per-item results."""
+    with connection.cursor() as cursor:
+        # Only the sender is locked: recipients are credited through ledger inserts
+        available = lock_balances(cursor, [sender_wallet_id])[sender_wallet_id]
+        recipients = sorted({recipient for recipient, _ in chunk})
+        placeholders = ', '.join(['%s'] * len(recipients))
+        cursor.execute(f"SELECT tnc_wallet_id FROM tnc_wallets WHERE tnc_wallet_id IN ({placeholders})", recipients)
+        existing = {row['tnc_wallet_id'] for row in cursor.fetchall()}
+
+        results, applied, entries = [], [], []
+        debit = Money.zero('TNC')
+        for index, (recipient, amount) in enumerate(chunk, start=offset):
+            result = {"index": index, "recipient_tnc_wallet_id": recipient, "amount": str(amount)}
+            if recipient == sender_wallet_id:
+                result.update(status="error", message="Cannot transfer to your own wallet")
+            elif recipient not in existing:
+                result.update(status="error", message="Recipient wallet not found")
+            elif amount > available - debit:
+                result.update(status="error", message="Insufficient balance")
+            else:
+                debit += amount
+                transaction_hash = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+                result.update(status="ok", transaction_hash=transaction_hash)
+                applied.append((sender_id, recipient, amount.to_decimal(), 'completed', transaction_hash))
+                entries.append((sender_wallet_id, -amount, 'transfer_out', transaction_hash))
+                entries.append((recipient, amount, 'transfer_in', transaction_hash))
+            results.append(result)
+
+        if applied:
+            append_entries(cursor, entries)
+            cursor.executemany(f"""
+                INSERT INTO transactions ({', '.join(TRANSFER_COLUMNS)})
+                VALUES (%s, %s, %s, %s, %s, NOW())
+            """, applied)
+        return results
+
+
+def _sender_wallet_id(connection, sender_id):
+    with connection.cursor() as cursor:
+        return get_wallet_id(cursor, sender_id)
+
+
+def batch_transfer_tanacoin(sender_id, transfers: List[Tuple[str, Money]],
+                            chunk_size: int = TRANSFER_BATCH_CHUNK_SIZE) -> Tuple[Dict[str, Any], int]:
+    """Send many transfers from one sender, committing once per chunk.
+
+    Items that fail (unknown wallet, insufficient balance) are reported and
+    skipped; a database error rolls back only the chunk it happened in.
+    """
+    chunk_size = max(1, min(chunk_size, TRANSFER_BATCH_MAX_ITEMS))
+    connection = get_db_connection()
+    results: List[Dict[str, Any]] = []
+    try:
+        sender_wallet_id = _sender_wallet_id(connection, sender_id)
+        if not sender_wallet_id:
+            return {"message": "Sender wallet not found"}, 404
+
+        for offset in range(0, len(transfers), chunk_size):
+            chunk = transfers[offset:offset + chunk_size]
+            try:
+                results.extend(_apply_transfer_chunk(connection, sender_id, sender_wallet_id, chunk, offset))
+                connection.commit()
+            except MySQLError as e:
+                connection.rollback()
+                print(f"Batch transfer chunk at {offset} failed: {e}")
+                results.extend({"index": index, "recipient_tnc_wallet_id": recipient, "amount": str(amount),
+                                "status": "error", "message": f"MySQL error occurred: {e}."}
+                               for index, (recipient, amount) in enumerate(chunk, start=offset))
+    finally:
+        connection.close()
+
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    return {
+        "message": f"{succeeded} of {len(transfers)} transfers completed",
+        "succeeded": succeeded,
+        "failed": len(transfers) - succeeded,
+        "results": results,
+    }, 200
+
+
 def update_tanacoin_balance(transaction_amount):
     try:
         # Establish a database connection
@@ -103,10 +225,53 @@ def update_tanacoin_balance(transaction_amount):
         # Close the connection
         if connection:
             connection.close()
+def _promo_status(row, user_id):
+    """Format a promo row for user_id, re-checking what may have changed since it was cached."""
+    result = dict(row)
+    now = datetime.now()
+    if (result.get('spender_id') is not None
+            or (isinstance(result.get('end_date'), datetime) and result['end_date'] < now)
+            or (isinstance(result.get('start_date'), datetime) and result['start_date'] > now)):
+        return {'status': 'invalid', 'message': 'Promo code is either expired or not found.'}
+
+    # Check if the creator is trying to use the promo code
+    if result.get('creator_id') == user_id:
+        return {'status': 'error', 'message': 'Le créateur du code promo ne peut pas l\'utiliser.'}
+
+    # If the promo code is valid, format and return the result
+    result['added_tnc_percentage'] = str(result.get('added_tnc_percentage', '0.00'))  # Convert Decimal to string
+
+    # Handle datetime fields
+    if isinstance(result.get('start_date'), datetime):
+        result['start_date'] = result['start_date'].strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        result['start_date'] = None
+
+    if isinstance(result.get('end_date'), datetime):
+        result['end_date'] = result['end_date'].strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        result['end_date'] = None
+
+    # Ensure 'creator_id' and 'spender_id' are properly returned
+    result['creator_id'] = result.get('creator_id')
+    result['spender_id'] = result.get('spender_id')
+
+    return result
+
+
 # Function to check promo code status
 def check_promocode_status(promo_code, user_id):
+    # Codes that were never created are rejected without touching the database
+    if not promo_code or not promo_filter.might_exist(promo_code):
+        return {'status': 'invalid', 'message': 'Promo code is either expired or not found.'}
+
+    cached = promo_metadata.get(promo_code)
+    if cached is not None:
+        return _promo_status(cached, user_id)
+
     # Establish the connection to the database
     connection = get_db_connection()
+    cursor = None
 
     try:
         # Create a cursor to interact with the database
@@ -122,29 +287,9 @@ def check_promocode_status(promo_code, user_id):
         if result is None:
             return {'status': 'invalid', 'message': 'Promo code is either expired or not found.'}
 
-        # Check if the creator is trying to use the promo code
-        if result.get('creator_id') == user_id:
-            return {'status': 'error', 'message': 'Le créateur du code promo ne peut pas l\'utiliser.'}
-
-        # If the promo code is valid, format and return the result
-        result['added_tnc_percentage'] = str(result.get('added_tnc_percentage', '0.00'))  # Convert Decimal to string
-
-        # Handle datetime fields
-        if isinstance(result.get('start_date'), datetime):
-            result['start_date'] = result['start_date'].strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            result['start_date'] = None
-
-        if isinstance(result.get('end_date'), datetime):
-            result['end_date'] = result['end_date'].strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            result['end_date'] = None
-
-        # Ensure 'creator_id' and 'spender_id' are properly returned
-        result['creator_id'] = result.get('creator_id')
-        result['spender_id'] = result.get('spender_id')
-
-        return result
+        if result.get('status', 'valid') == 'valid':
+            promo_metadata.set(promo_code, result)
+        return _promo_status(result, user_id)
 
     except MySQLError as err:
         return {'status': 'error', 'message': f'Database error: {err}'}
@@ -157,18 +302,26 @@ def check_promocode_status(promo_code, user_id):
             connection.close()
 
 def create_promo_code(promo_code, added_tnc_percentage, start_date, end_date, creator_id):
+    """Create one promo code; returns (created, error message)."""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
+            # Archived codes are out of the procedure's duplicate check, so reject them here
+            cursor.execute("SELECT 1 FROM promo_codes_archive WHERE code = %s", (promo_code,))
+            if cursor.fetchone():
+                return False, f"Promo code '{promo_code}' already exists"
             # Call the updated stored procedure
             cursor.callproc('create_promo_code', (promo_code, added_tnc_percentage, start_date, end_date, creator_id))
             
             # Commit the transaction to the database
             connection.commit()
-
+            remember_promo_code(promo_code)
             print(f"Promo code '{promo_code}' crée avec succée!")
-    except Exception as e:
+            return True, None
+    except MySQLError as e:
+        connection.rollback()
         print(f"Error lors de la création du code promo: {str(e)}")
+        return False, str(e)
     finally:
         connection.close()
 
@@ -182,6 +335,7 @@ def update_spender_id(p_code, p_spender_id):
             
             # Commit the transaction to the database
             connection.commit()
+            invalidate_promo_code(p_code)
 
             # Check if any rows were updated (you can also check the row count)
             if cursor.rowcount > 0:
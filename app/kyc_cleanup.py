@@ -0,0 +1,122 @@
+"""Sweep KYC uploads from signups that were never completed.
+
+``temp_kyc_documents`` rows older than KYC_TEMP_MAX_AGE_HOURS are deleted in
+bounded batches, one short transaction each, with a pause between batches so
+the sweep never competes with live uploads for long. Rows backed by a blob
+just release their reference, and the blob collector frees the bytes once
+nothing else uses them. Files from before content addressing are unlinked
+here. Staged upload parts abandoned by a crashed worker are removed as well.
+"""
+import logging
+import os
+import time
+from typing import Dict
+
+import pymysql
+
+from . import metrics
+from .background import register_periodic
+from .db_schema import register_schema
+from .db_setup import get_db_connection
+from .kyc_handler import KYC_STAGING_FOLDER
+from .kyc_storage import KYC_UPLOAD_FOLDER, release_blob
+
+KYC_TEMP_MAX_AGE_HOURS = float(os.getenv('KYC_TEMP_MAX_AGE_HOURS', 72))
+KYC_TEMP_SWEEP_INTERVAL = float(os.getenv('KYC_TEMP_SWEEP_INTERVAL_SECONDS', 1800))
+KYC_TEMP_SWEEP_BATCH = int(os.getenv('KYC_TEMP_SWEEP_BATCH', 200))
+KYC_TEMP_SWEEP_MAX_BATCHES = int(os.getenv('KYC_TEMP_SWEEP_MAX_BATCHES', 50))
+KYC_TEMP_SWEEP_PAUSE = float(os.getenv('KYC_TEMP_SWEEP_PAUSE_SECONDS', 0.2))
+
+LEGACY_TEMP_FOLDER = os.path.realpath(os.path.join(KYC_UPLOAD_FOLDER, 'temp'))
+
+register_schema("CREATE INDEX idx_temp_kyc_updated_at ON temp_kyc_documents (updated_at)")
+
+
+def _unlink(path: str) -> int:
+    """Remove a file and return its size, 0 when it is already gone."""
+    try:
+        size = os.path.getsize(path)
+        os.unlink(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def _sweep_batch(connection) -> Dict[str, int]:
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT temp_user_id, document_type, file_path, file_sha256 FROM temp_kyc_documents
+            WHERE updated_at < NOW() - INTERVAL %s SECOND
+            ORDER BY updated_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (int(KYC_TEMP_MAX_AGE_HOURS * 3600), KYC_TEMP_SWEEP_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            connection.rollback()
+            return {'rows': 0, 'bytes': 0}
+        legacy_files = []
+        for row in rows:
+            if row['file_sha256']:
+                release_blob(cursor, row['file_sha256'])
+            elif row['file_path'] and os.path.realpath(row['file_path']).startswith(LEGACY_TEMP_FOLDER + os.sep):
+                legacy_files.append(row['file_path'])
+        # temp_kyc_documents has no id column; (temp_user_id, document_type) is its unique key
+        keys = [value for row in rows for value in (row['temp_user_id'], row['document_type'])]
+        cursor.execute(f"""
+            DELETE FROM temp_kyc_documents
+            WHERE (temp_user_id, document_type) IN ({', '.join(['(%s, %s)'] * len(rows))})
+        """, keys)
+    connection.commit()
+    # Only unlink once the rows are gone, so a failed batch never leaves rows without files
+    return {'rows': len(rows), 'bytes': sum(_unlink(path) for path in legacy_files)}
+
+
+def _sweep_staging() -> int:
+    """Delete staged parts older than the cutoff; live uploads finish in seconds."""
+    cutoff = time.time() - KYC_TEMP_MAX_AGE_HOURS * 3600
+    reclaimed = 0
+    try:
+        entries = list(os.scandir(KYC_STAGING_FOLDER))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.name.endswith('.part') and entry.stat().st_mtime < cutoff:
+                reclaimed += _unlink(entry.path)
+        except FileNotFoundError:
+            continue
+    return reclaimed
+
+
+def sweep_temp_kyc_documents() -> Dict[str, int]:
+    """Remove abandoned temporary KYC uploads; returns rows deleted and bytes reclaimed."""
+    started = time.monotonic()
+    swept = {'rows': 0, 'bytes': 0}
+    connection = get_db_connection()
+    try:
+        for _ in range(KYC_TEMP_SWEEP_MAX_BATCHES):
+            batch = _sweep_batch(connection)
+            swept['rows'] += batch['rows']
+            swept['bytes'] += batch['bytes']
+            if batch['rows'] < KYC_TEMP_SWEEP_BATCH:
+                break
+            # Leave room for foreground uploads between batches
+            time.sleep(KYC_TEMP_SWEEP_PAUSE)
+    except pymysql.MySQLError:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    swept['bytes'] += _sweep_staging()
+
+    metrics.inc('kyc_temp_documents_swept', swept['rows'])
+    metrics.inc('kyc_temp_bytes_reclaimed', swept['bytes'])
+    metrics.set_gauge('kyc_temp_sweep_last_seconds', round(time.monotonic() - started, 3))
+    if swept['rows'] or swept['bytes']:
+        logging.info(f"Swept {swept['rows']} stale temporary KYC documents, {swept['bytes']} bytes reclaimed "
+                     f"(blob-backed documents are reclaimed by the blob collector)")
+    return swept
+
+
+register_periodic('kyc-temp-sweeper', KYC_TEMP_SWEEP_INTERVAL, sweep_temp_kyc_documents)
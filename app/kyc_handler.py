@@ -1,182 +1,408 @@
 from .db_setup import get_db_connection
+from .db_schema import register_schema
+from .cache import LRUCache
+from . import metrics
+from .kyc_storage import KYC_UPLOAD_FOLDER, release_blob, store_blob, track_orphan_blob
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from datetime import datetime
+import base64
+import binascii
+import hashlib
 import pymysql
 import logging
 import os
-import uuid
+import shutil
+import tempfile
+
+# Staging lives inside the upload folder so the final move is a same-filesystem rename
+KYC_STAGING_FOLDER = os.path.join(KYC_UPLOAD_FOLDER, '.incoming')
+KYC_MAX_UPLOAD_BYTES = int(os.getenv('KYC_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+# Room for the other form fields and multipart boundaries on top of the file itself
+KYC_MAX_REQUEST_BYTES = KYC_MAX_UPLOAD_BYTES + 64 * 1024
+KYC_UPLOAD_CHUNK_SIZE = 64 * 1024
+KYC_REVIEW_PAGE_SIZE = int(os.getenv('KYC_REVIEW_PAGE_SIZE', 50))
+KYC_REVIEW_PAGE_MAX = 500
+KYC_BULK_VERIFY_MAX = int(os.getenv('KYC_BULK_VERIFY_MAX', 500))
+KYC_REVIEW_STATUSES = ('approved', 'rejected')
+# Onboarding polls the status endpoint, a few seconds of staleness is fine
+KYC_STATUS_CACHE_SECONDS = float(os.getenv('KYC_STATUS_CACHE_SECONDS', 5))
+
+register_schema(
+    "ALTER TABLE kyc_documents ADD COLUMN file_sha256 CHAR(64) NULL",
+    "ALTER TABLE temp_kyc_documents ADD COLUMN file_sha256 CHAR(64) NULL",
+    "CREATE INDEX idx_temp_kyc_temp_user ON temp_kyc_documents (temp_user_id)",
+    "CREATE INDEX idx_kyc_documents_user_type ON kyc_documents (user_id, document_type)",
+    "CREATE INDEX idx_kyc_documents_review ON kyc_documents (status, updated_at, id)",
+)
+
+# Document rows per ('account', user_id) or ('temp', temp_user_id)
+kyc_status_cache = LRUCache(maxsize=int(os.getenv('KYC_STATUS_CACHE_SIZE', 10000)), ttl=KYC_STATUS_CACHE_SECONDS)
+metrics.register_collector('caches', 'kyc_status', kyc_status_cache.stats)
+
+
+def invalidate_kyc_status(user_id=None, temp_user_id=None):
+    """Drop cached documents after they change in this process"""
+    if user_id is not None:
+        kyc_status_cache.pop(('account', str(user_id)))
+    if temp_user_id:
+        kyc_status_cache.pop(('temp', temp_user_id))
+
+
+def _encode_review_cursor(row):
+    return base64.urlsafe_b64encode(f"{row['updated_at'].isoformat()}|{row['id']}".encode()).decode()
+
+
+def _decode_review_cursor(cursor_token):
+    try:
+        updated_at, document_id = base64.urlsafe_b64decode(cursor_token.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(updated_at), int(document_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def parse_review_decisions(items):
+    """Validate a list of {id, status, rejection_reason} items; returns (decisions, errors)"""
+    if not isinstance(items, list) or not items:
+        return [], [{"index": None, "message": "decisions must be a non-empty list"}]
+    if len(items) > KYC_BULK_VERIFY_MAX:
+        return [], [{"index": None, "message": f"At most {KYC_BULK_VERIFY_MAX} decisions per request"}]
+    decisions, errors, seen = [], [], set()
+    for index, item in enumerate(items):
+        try:
+            document_id = int(item['id'])
+            status = item['status']
+            rejection_reason = item.get('rejection_reason')
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({"index": index, "message": f"Invalid decision: {e}"})
+            continue
+        if status not in KYC_REVIEW_STATUSES:
+            errors.append({"index": index, "message": f"status must be one of {', '.join(KYC_REVIEW_STATUSES)}"})
+            continue
+        if document_id in seen:
+            errors.append({"index": index, "message": f"Duplicate decision for document {document_id}"})
+            continue
+        seen.add(document_id)
+        decisions.append({'id': document_id, 'status': status,
+                          'rejection_reason': rejection_reason if status == 'rejected' else None})
+    return decisions, errors
+
+
+class KYCUploadFile:
+    """Staging file for one uploaded part, hashed and size-checked chunk by chunk as it is written."""
+
+    def __init__(self, folder=KYC_STAGING_FOLDER, max_bytes=KYC_MAX_UPLOAD_BYTES):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self._persisted = False
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(f"KYC documents are limited to {self.max_bytes} bytes")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def persist(self, destination):
+        """Flush the staged bytes to disk and atomically rename them to `destination`."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.path, destination)
+        self._persisted = True
+
+    def close(self):
+        """Close the file; a part that was never persisted is deleted."""
+        if not self._file.closed:
+            self._file.close()
+        if not self._persisted:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class KYCUploadRequest(Request):
+    """Flask request class that streams KYC upload parts into KYCUploadFile.
+
+    Werkzeug hands the parser's fixed-size chunks straight to the stream
+    returned here, so the document is hashed and capped as it arrives and is
+    never held in memory or copied a second time.
+    """
+    kyc_upload_endpoints = {'upload_kyc'}
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in self.kyc_upload_endpoints:
+            return KYCUploadFile()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 
 class KYCService:
     def __init__(self, db_connection):
         self.db = db_connection
         self.allowed_extensions = {'png', 'jpg', 'jpeg', 'pdf'}
-        self.upload_folder = os.path.join(os.path.dirname(__file__), '..', 'Uploads', 'kyc_documents')
+        self.upload_folder = KYC_UPLOAD_FOLDER
         os.makedirs(self.upload_folder, exist_ok=True)
         self.valid_document_types = ['id_front', 'id_back', 'selfie', 'proof_of_address', 'passport', 'other']
 
     def allowed_file(self, filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.allowed_extensions
 
-    async def save_document(self, file, user_id, document_type):
-        """Save KYC document and return file path"""
+    def _staged_upload(self, file):
+        """Return the upload as a KYCUploadFile, streaming it into one if it was parsed elsewhere."""
+        if isinstance(file.stream, KYCUploadFile):
+            return file.stream
+        staged = KYCUploadFile()
+        try:
+            shutil.copyfileobj(file.stream, staged, KYC_UPLOAD_CHUNK_SIZE)
+        except Exception:
+            staged.close()
+            raise
+        return staged
+
+    def save_document(self, cursor, file, document_type):
+        """Store the KYC document as a content-addressed blob and return (file path, SHA-256, error)"""
         if not file or not self.allowed_file(file.filename):
-            return None, f"Invalid file type. Allowed types: {', '.join(self.allowed_extensions)}"
+            return None, None, f"Invalid file type. Allowed types: {', '.join(self.allowed_extensions)}"
 
         if document_type not in self.valid_document_types:
-            return None, "Invalid document type"
-
-        # Create appropriate folder based on whether user_id is provided
-        if user_id == 'temp':
-            # For temporary uploads before user creation
-            save_folder = os.path.join(self.upload_folder, 'temp')
-        else:
-            # For user-specific uploads
-            save_folder = os.path.join(self.upload_folder, str(user_id))
-            
-        os.makedirs(save_folder, exist_ok=True)
-
-        # Generate unique filename
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{document_type}_{uuid.uuid4().hex}.{ext}"
-        filepath = os.path.join(save_folder, filename)
+            return None, None, "Invalid document type"
 
         try:
-            file.save(filepath)
-            return filepath, None
-        except Exception as e:
-            return None, f"Error saving file: {str(e)}"
+            staged = self._staged_upload(file)
+        except RequestEntityTooLarge as e:
+            return None, None, e.description
+        try:
+            if staged.size == 0:
+                return None, None, "Uploaded file is empty"
+            # Identical uploads share one blob, so a re-upload only adds a reference
+            return store_blob(cursor, staged), staged.sha256, None
+        finally:
+            staged.close()
 
-    async def upload_kyc_document(self, user_id, document_type, file):
+    def upload_kyc_document(self, user_id, document_type, file):
         """Handle KYC document submission"""
-        # Save the document
         is_temp = user_id is None or isinstance(user_id, str) and user_id.startswith('temp_')
-        filepath, error = await self.save_document(file, 'temp' if is_temp else user_id, document_type)
-        if error:
-            return False, error
-
-        # Record in database
+        file_sha256 = None
         try:
             with self.db.cursor() as cursor:
+                # Save the document
+                filepath, file_sha256, error = self.save_document(cursor, file, document_type)
+                if error:
+                    self.db.rollback()
+                    return False, error
+
+                # Record in database
                 if is_temp:
                     # For temporary users, store in a separate table or with a NULL user_id
+                    cursor.execute('''
+                        SELECT file_sha256 FROM temp_kyc_documents
+                        WHERE temp_user_id = %s AND document_type = %s
+                        FOR UPDATE
+                    ''', (user_id, document_type))
+                    previous = cursor.fetchone()
                     cursor.execute('''
                         INSERT INTO temp_kyc_documents 
-                        (temp_user_id, document_type, file_path, status, created_at, updated_at)
-                        VALUES (%s, %s, %s, 'pending', NOW(), NOW())
+                        (temp_user_id, document_type, file_path, file_sha256, status, created_at, updated_at)
+                        VALUES (%s, %s, %s, %s, 'pending', NOW(), NOW())
                         ON DUPLICATE KEY UPDATE
                             file_path = VALUES(file_path),
+                            file_sha256 = VALUES(file_sha256),
                             status = 'pending',
                             updated_at = NOW()
-                    ''', (user_id, document_type, filepath))
+                    ''', (user_id, document_type, filepath, file_sha256))
                 else:
                     # For registered users, store in the regular kyc_documents table
                     cursor.execute('''
-                        SELECT id FROM kyc_documents 
+                        SELECT id, file_sha256 FROM kyc_documents 
                         WHERE user_id = %s AND document_type = %s
+                        FOR UPDATE
                     ''', (user_id, document_type))
-                    
-                    if cursor.fetchone():
+                    previous = cursor.fetchone()
+
+                    if previous:
                         # Update existing document
                         cursor.execute('''
                             UPDATE kyc_documents 
-                            SET file_path = %s, 
+                            SET file_path = %s,
+                                file_sha256 = %s,
                                 status = 'pending',
                                 rejection_reason = NULL,
                                 verified_by = NULL,
                                 verified_at = NULL,
                                 updated_at = NOW()
                             WHERE user_id = %s AND document_type = %s
-                        ''', (filepath, user_id, document_type))
+                        ''', (filepath, file_sha256, user_id, document_type))
                     else:
                         cursor.execute('''
                             INSERT INTO kyc_documents 
-                            (user_id, document_type, file_path, status, created_at, updated_at)
-                            VALUES (%s, %s, %s, 'pending', NOW(), NOW())
-                        ''', (user_id, document_type, filepath))
-                
+                            (user_id, document_type, file_path, file_sha256, status, created_at, updated_at)
+                            VALUES (%s, %s, %s, %s, 'pending', NOW(), NOW())
+                        ''', (user_id, document_type, filepath, file_sha256))
+
+                # The replaced document's blob loses its reference after the new one gained it
+                if previous:
+                    release_blob(cursor, previous['file_sha256'])
+
                 self.db.commit()
+                if is_temp:
+                    invalidate_kyc_status(temp_user_id=user_id)
+                else:
+                    invalidate_kyc_status(user_id=user_id)
                 return True, "Document uploaded successfully"
                 
         except Exception as e:
             self.db.rollback()
+            if file_sha256:
+                track_orphan_blob(self.db, file_sha256)
             logging.error(f"Error in upload_kyc_document: {str(e)}")
             return False, f"Database error: {str(e)}"
 
-    async def get_kyc_status(self, user_id):
-        """Get the current KYC status for a user"""
+    def _fetch_documents(self, keys):
+        """Load the documents for several (source, owner) keys in one UNION round trip"""
+        parts, params = [], []
+        for source, owner in keys:
+            if source == 'account':
+                parts.append('''
+                    SELECT 'account' AS source, %s AS owner, document_type, status, created_at, updated_at
+                    FROM kyc_documents WHERE user_id = %s
+                ''')
+            else:
+                parts.append('''
+                    SELECT 'temp' AS source, %s AS owner, document_type, status, created_at, updated_at
+                    FROM temp_kyc_documents WHERE temp_user_id = %s
+                ''')
+            params.extend((owner, owner))
+        documents = {key: [] for key in keys}
+        with self.db.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute(' UNION ALL '.join(parts), params)
+            for row in cursor.fetchall():
+                key = (row.pop('source'), str(row.pop('owner')))
+                documents[key].append(row)
+        for key, rows in documents.items():
+            kyc_status_cache.set(key, rows)
+        return documents
+
+    def get_kyc_status(self, user_id=None, temp_user_id=None):
+        """Get the current KYC status for a user, a temporary signup, or both"""
         try:
-            with self.db.cursor(pymysql.cursors.DictCursor) as cursor:
-                cursor.execute('''
-                    SELECT document_type, status, created_at, updated_at
-                    FROM kyc_documents 
-                    WHERE user_id = %s
-                ''', (user_id,))
-                documents = cursor.fetchall()
-                
-                if not documents:
-                    # Check for temporary documents if no regular documents found
-                    cursor.execute('''
-                        SELECT document_type, status, created_at, updated_at
-                        FROM temp_kyc_documents 
-                        WHERE temp_user_id = %s
-                    ''', (f"temp_{user_id}",))
-                    temp_documents = cursor.fetchall()
-                    
-                    if temp_documents:
-                        return {
-                            'status': 'in_progress',
-                            'message': 'Documents uploaded but not yet linked to your account',
-                            'documents': temp_documents
-                        }
-                    
+            account_key = ('account', str(user_id)) if user_id is not None else None
+            temp_keys = []
+            if temp_user_id:
+                temp_keys.append(('temp', temp_user_id))
+            if user_id is not None and ('temp', f"temp_{user_id}") not in temp_keys:
+                temp_keys.append(('temp', f"temp_{user_id}"))
+            keys = ([account_key] if account_key else []) + temp_keys
+
+            documents = {key: kyc_status_cache.get(key) for key in keys}
+            missing = [key for key, rows in documents.items() if rows is None]
+            if missing:
+                documents.update(self._fetch_documents(missing))
+
+            account_documents = documents.get(account_key) if account_key else None
+            if not account_documents:
+                temp_documents = next((documents[key] for key in temp_keys if documents[key]), None)
+                if temp_documents:
                     return {
-                        'status': 'not_started',
-                        'message': 'No KYC documents submitted',
-                        'documents': []
+                        'status': 'in_progress',
+                        'message': 'Documents uploaded but not yet linked to your account',
+                        'documents': temp_documents
                     }
-                
-                # Determine overall status
-                statuses = [doc['status'] for doc in documents]
-                if 'rejected' in statuses:
-                    status = 'rejected'
-                elif 'pending' in statuses:
-                    status = 'pending'
-                elif all(s == 'approved' for s in statuses):
-                    status = 'approved'
-                else:
-                    status = 'in_progress'
-                
+
                 return {
-                    'status': status,
-                    'documents': documents
+                    'status': 'not_started',
+                    'message': 'No KYC documents submitted',
+                    'documents': []
                 }
-                
+
+            # Determine overall status
+            statuses = [doc['status'] for doc in account_documents]
+            if 'rejected' in statuses:
+                status = 'rejected'
+            elif 'pending' in statuses:
+                status = 'pending'
+            elif all(s == 'approved' for s in statuses):
+                status = 'approved'
+            else:
+                status = 'in_progress'
+
+            return {
+                'status': status,
+                'documents': account_documents
+            }
+
         except Exception as e:
             logging.error(f"Error in get_kyc_status: {str(e)}")
             return {'error': str(e)}
 
-    async def link_temp_documents(self, temp_user_id, new_user_id):
+    def link_temp_documents(self, temp_user_id, new_user_id):
         """Link temporary KYC documents to a new user ID after registration"""
         try:
             with self.db.cursor() as cursor:
-                # Move files from temp to user directory
-                temp_dir = os.path.join(self.upload_folder, 'temp')
-                user_dir = os.path.join(self.upload_folder, str(new_user_id))
-                os.makedirs(user_dir, exist_ok=True)
-                
-                # Move all files from temp to user directory
-                for filename in os.listdir(temp_dir):
-                    if filename.startswith(temp_user_id + '_'):
-                        old_path = os.path.join(temp_dir, filename)
-                        new_filename = filename.replace(temp_user_id + '_', '')
-                        new_path = os.path.join(user_dir, new_filename)
-                        os.rename(old_path, new_path)
-                
-                # Update database records
+                # Only this temp user's rows, found through idx_temp_kyc_temp_user
                 cursor.execute('''
-                    UPDATE kyc_documents 
-                    SET user_id = %s, updated_at = NOW()
-                    WHERE user_id = %s
-                ''', (new_user_id, temp_user_id))
-                
+                    SELECT document_type, file_path, file_sha256, status
+                    FROM temp_kyc_documents
+                    WHERE temp_user_id = %s
+                    FOR UPDATE
+                ''', (temp_user_id,))
+                temp_documents = cursor.fetchall()
+                if not temp_documents:
+                    self.db.rollback()
+                    return True, "No temporary KYC documents to link"
+
+                # Files are content-addressed blobs, so the rows move and the blob
+                # references move with them; nothing is renamed on disk
+                for document in temp_documents:
+                    cursor.execute('''
+                        SELECT id, file_sha256 FROM kyc_documents
+                        WHERE user_id = %s AND document_type = %s
+                        FOR UPDATE
+                    ''', (new_user_id, document['document_type']))
+                    existing = cursor.fetchone()
+                    if existing:
+                        cursor.execute('''
+                            UPDATE kyc_documents
+                            SET file_path = %s,
+                                file_sha256 = %s,
+                                status = 'pending',
+                                rejection_reason = NULL,
+                                verified_by = NULL,
+                                verified_at = NULL,
+                                updated_at = NOW()
+                            WHERE id = %s
+                        ''', (document['file_path'], document['file_sha256'], existing['id']))
+                        release_blob(cursor, existing['file_sha256'])
+                    else:
+                        cursor.execute('''
+                            INSERT INTO kyc_documents
+                            (user_id, document_type, file_path, file_sha256, status, created_at, updated_at)
+                            VALUES (%s, %s, %s, %s, 'pending', NOW(), NOW())
+                        ''', (new_user_id, document['document_type'], document['file_path'],
+                              document['file_sha256']))
+
                 # Clean up temp records
                 cursor.execute('''
                     DELETE FROM temp_kyc_documents 
@@ -184,6 +410,7 @@ class KYCService:
                 ''', (temp_user_id,))
                 
                 self.db.commit()
+                invalidate_kyc_status(user_id=new_user_id, temp_user_id=temp_user_id)
                 return True, "KYC documents successfully linked to your account"
                 
         except Exception as e:
@@ -191,7 +418,22 @@ class KYCService:
             logging.error(f"Error in link_temp_documents: {str(e)}")
             return False, f"Failed to link KYC documents: {str(e)}"
 
-    async def verify_document(self, user_id, document_type, status, verified_by, rejection_reason=None):
+    def _recompute_id_verified(self, cursor, user_ids):
+        """Mark users whose documents are all approved as ID-verified, in one grouped query"""
+        if not user_ids:
+            return
+        cursor.execute(f'''
+            UPDATE user_profiles p
+            JOIN (
+                SELECT user_id FROM kyc_documents
+                WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})
+                GROUP BY user_id
+                HAVING SUM(status != 'approved') = 0
+            ) verified ON verified.user_id = p.user_id
+            SET p.id_verified = TRUE
+        ''', list(user_ids))
+
+    def verify_document(self, user_id, document_type, status, verified_by, rejection_reason=None):
         """Admin function to verify a document"""
         try:
             with self.db.cursor() as cursor:
@@ -207,21 +449,10 @@ class KYCService:
                 
                 # Update user's ID verification status if all required documents are approved
                 if status == 'approved':
-                    cursor.execute('''
-                        SELECT COUNT(*) as pending_count 
-                        FROM kyc_documents 
-                        WHERE user_id = %s AND status != 'approved'
-                    ''', (user_id,))
-                    
-                    result = cursor.fetchone()
-                    if result and result['pending_count'] == 0:
-                        cursor.execute('''
-                            UPDATE user_profiles 
-                            SET id_verified = TRUE 
-                            WHERE user_id = %s
-                        ''', (user_id,))
+                    self._recompute_id_verified(cursor, [user_id])
                 
                 self.db.commit()
+                invalidate_kyc_status(user_id=user_id)
                 return True, "Document verification updated"
                 
         except Exception as e:
@@ -229,12 +460,76 @@ class KYCService:
             logging.error(f"Error in verify_document: {str(e)}")
             return False, f"Error updating document status: {str(e)}"
 
+    def get_review_queue(self, limit=KYC_REVIEW_PAGE_SIZE, cursor_token=None):
+        """Pending documents, longest-waiting first; returns (documents, next_cursor)
+
+        Raises ValueError for a malformed cursor.
+        """
+        limit = max(1, min(limit, KYC_REVIEW_PAGE_MAX))
+        keyset, params = "", []
+        if cursor_token:
+            updated_at, document_id = _decode_review_cursor(cursor_token)
+            keyset = "AND (updated_at > %s OR (updated_at = %s AND id > %s))"
+            params += [updated_at, updated_at, document_id]
+        with self.db.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute(f'''
+                SELECT id, user_id, document_type, file_path, file_sha256, created_at, updated_at
+                FROM kyc_documents
+                WHERE status = 'pending' {keyset}
+                ORDER BY updated_at, id
+                LIMIT %s
+            ''', params + [limit + 1])
+            rows = cursor.fetchall()
+        page = rows[:limit]
+        next_cursor = _encode_review_cursor(page[-1]) if len(rows) > limit else None
+        return page, next_cursor
+
+    def verify_documents(self, decisions, verified_by):
+        """Apply many review decisions in one transaction; returns (success, message, updated ids)"""
+        document_ids = [decision['id'] for decision in decisions]
+        try:
+            with self.db.cursor() as cursor:
+                cursor.execute(f'''
+                    SELECT id, user_id FROM kyc_documents
+                    WHERE id IN ({', '.join(['%s'] * len(document_ids))})
+                    FOR UPDATE
+                ''', document_ids)
+                owners = {row['id']: row['user_id'] for row in cursor.fetchall()}
+                unknown = [document_id for document_id in document_ids if document_id not in owners]
+                if unknown:
+                    self.db.rollback()
+                    return False, f"Unknown document ids: {unknown}", []
+
+                cursor.executemany('''
+                    UPDATE kyc_documents
+                    SET status = %s,
+                        verified_by = %s,
+                        verified_at = NOW(),
+                        rejection_reason = %s,
+                        updated_at = NOW()
+                    WHERE id = %s
+                ''', [(decision['status'], verified_by, decision['rejection_reason'], decision['id'])
+                      for decision in decisions])
+
+                user_ids = sorted(set(owners.values()))
+                self._recompute_id_verified(cursor, user_ids)
+                self.db.commit()
+            for user_id in user_ids:
+                invalidate_kyc_status(user_id=user_id)
+            return True, f"{len(decisions)} documents updated", document_ids
+
+        except Exception as e:
+            self.db.rollback()
+            logging.error(f"Error in verify_documents: {str(e)}")
+            return False, f"Error updating document status: {str(e)}", []
+
+
 def upload_kyc_document(user_id, document_type, file):
     """Upload KYC document for verification"""
     connection = get_db_connection()
     try:
         kyc_service = KYCService(connection)
-        success, message = asyncio.run(kyc_service.upload_kyc_document(user_id, document_type, file))
+        success, message = kyc_service.upload_kyc_document(user_id, document_type, file)
         return success, message
     except Exception as e:
         logging.error(f"Error in upload_kyc_document: {str(e)}")
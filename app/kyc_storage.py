@@ -0,0 +1,145 @@
+"""Content-addressed storage for KYC documents.
+
+Each distinct document is stored once under ``blobs/<aa>/<bb>/<sha256>``
+and tracked in ``kyc_blobs`` with a count of the ``kyc_documents`` and
+``temp_kyc_documents`` rows pointing at it. Re-uploading the same scan
+only bumps that count. Blobs that reach zero references are deleted by a
+periodic collector once they have been unreferenced for a grace period.
+
+A blob row is locked by the upsert that references it, and the collector
+unlinks files while it still holds the row locks. An upload racing the
+collector therefore either keeps the blob alive or writes the file again.
+"""
+import logging
+import os
+import time
+from typing import Optional
+
+import pymysql
+
+from . import metrics
+from .background import register_periodic
+from .db_schema import register_schema
+from .db_setup import get_db_connection
+
+KYC_UPLOAD_FOLDER = os.getenv('KYC_UPLOAD_FOLDER',
+                              os.path.join(os.path.dirname(__file__), '..', 'Uploads', 'kyc_documents'))
+KYC_BLOB_FOLDER = os.path.join(KYC_UPLOAD_FOLDER, 'blobs')
+KYC_BLOB_GC_INTERVAL = float(os.getenv('KYC_BLOB_GC_INTERVAL_SECONDS', 900))
+KYC_BLOB_GC_GRACE = int(os.getenv('KYC_BLOB_GC_GRACE_SECONDS', 3600))
+KYC_BLOB_GC_BATCH = int(os.getenv('KYC_BLOB_GC_BATCH', 500))
+
+register_schema("""
+    CREATE TABLE IF NOT EXISTS kyc_blobs (
+        sha256 CHAR(64) PRIMARY KEY,
+        file_path VARCHAR(512) NOT NULL,
+        size BIGINT NOT NULL,
+        ref_count INT NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        unreferenced_at DATETIME NULL,
+        KEY idx_kyc_blobs_unreferenced (ref_count, unreferenced_at)
+    )
+""")
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(KYC_BLOB_FOLDER, sha256[:2], sha256[2:4], sha256)
+
+
+def store_blob(cursor, staged) -> str:
+    """Reference the blob for a staged upload on the caller's transaction; returns its path.
+
+    The staged file is moved into place only when no blob with that content
+    exists yet, otherwise it is discarded.
+    """
+    path = blob_path(staged.sha256)
+    cursor.execute("""
+        INSERT INTO kyc_blobs (sha256, file_path, size, ref_count)
+        VALUES (%s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE ref_count = ref_count + 1, unreferenced_at = NULL
+    """, (staged.sha256, path, staged.size))
+    if os.path.exists(path):
+        staged.close()
+        metrics.inc('kyc_blob_dedup_hits')
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staged.persist(path)
+        metrics.inc('kyc_blobs_written')
+    return path
+
+
+def release_blob(cursor, sha256: Optional[str]) -> None:
+    """Drop one reference on the caller's transaction (no-op for pre-blob documents)."""
+    if not sha256:
+        return
+    # MySQL applies SET assignments left to right, so the IF sees the decremented count
+    cursor.execute("""
+        UPDATE kyc_blobs
+        SET ref_count = ref_count - 1,
+            unreferenced_at = IF(ref_count = 0, NOW(), NULL)
+        WHERE sha256 = %s AND ref_count > 0
+    """, (sha256,))
+
+
+def track_orphan_blob(connection, sha256: str) -> None:
+    """After a rolled-back upload, make sure a freshly written blob is known to the collector."""
+    path = blob_path(sha256)
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT IGNORE INTO kyc_blobs (sha256, file_path, size, ref_count, unreferenced_at)
+                VALUES (%s, %s, %s, 0, NOW())
+            """, (sha256, path, size))
+        connection.commit()
+    except pymysql.MySQLError as e:
+        logging.error(f"Could not record orphaned KYC blob {sha256}: {e}")
+
+
+def collect_kyc_blobs(limit: int = KYC_BLOB_GC_BATCH) -> int:
+    """Delete blobs unreferenced for longer than KYC_BLOB_GC_GRACE; returns blobs removed."""
+    started = time.monotonic()
+    reclaimed = 0
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT sha256, file_path, size FROM kyc_blobs
+                WHERE ref_count = 0 AND unreferenced_at < NOW() - INTERVAL %s SECOND
+                ORDER BY unreferenced_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (KYC_BLOB_GC_GRACE, limit))
+            blobs = cursor.fetchall()
+            if not blobs:
+                connection.rollback()
+                return 0
+            for blob in blobs:
+                try:
+                    os.unlink(blob['file_path'])
+                    reclaimed += blob['size']
+                except FileNotFoundError:
+                    pass
+            hashes = [blob['sha256'] for blob in blobs]
+            cursor.execute(f"""
+                DELETE FROM kyc_blobs
+                WHERE ref_count = 0 AND sha256 IN ({', '.join(['%s'] * len(hashes))})
+            """, hashes)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    metrics.inc('kyc_blobs_collected', len(blobs))
+    metrics.inc('kyc_blob_bytes_reclaimed', reclaimed)
+    metrics.set_gauge('kyc_blob_gc_last_seconds', round(time.monotonic() - started, 3))
+    logging.info(f"Collected {len(blobs)} unreferenced KYC blobs, {reclaimed} bytes reclaimed")
+    return len(blobs)
+
+
+register_periodic('kyc-blob-gc', KYC_BLOB_GC_INTERVAL, collect_kyc_blobs)
@@ -0,0 +1,174 @@
+"""Append-only Tanacoin ledger.
+
+Credits and debits are inserted into ``tnc_ledger`` instead of updating
+``tnc_wallets.balance`` in place, so a popular wallet no longer serialises
+every transfer and bonus on its row lock. ``tnc_wallets.balance`` becomes a
+snapshot: a wallet's balance is the snapshot plus its uncompacted entries,
+and a background compactor periodically folds those entries into it.
+
+Only debits lock the wallet row (to keep overdraft checks exact); credits
+are plain inserts.
+
+Balance readers: debits use lock_balances() and get_all_user_details() adds
+pending_balances(), so both are exact. Readers that go straight to
+``tnc_wallets.balance`` lag by at most one compaction interval and are
+accepted as stale: the ``GetUserDetails`` procedure behind
+user_management.retrieve_user_data() (not served by any route) and ad-hoc
+SQL or dashboards. ``GetTanacoininfo`` reports the coin supply, not wallets.
+New code that shows a wallet balance must add pending_balances().
+"""
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import metrics
+from .background import register_periodic
+from .db_schema import register_schema
+from .db_setup import get_db_connection
+from .money import Money, to_fraction
+
+LEDGER_COMPACT_INTERVAL = float(os.getenv('LEDGER_COMPACT_INTERVAL_SECONDS', 10))
+LEDGER_COMPACT_WALLETS = int(os.getenv('LEDGER_COMPACT_WALLETS', 200))
+LEDGER_COMPACT_BATCH = int(os.getenv('LEDGER_COMPACT_BATCH', 5000))
+
+# (tnc_wallet_id, signed amount, entry_type, reference)
+LedgerEntry = Tuple[str, Money, str, Optional[str]]
+
+register_schema("""
+    CREATE TABLE IF NOT EXISTS tnc_ledger (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        tnc_wallet_id VARCHAR(64) NOT NULL,
+        amount DECIMAL(30, 8) NOT NULL,
+        entry_type VARCHAR(20) NOT NULL,
+        reference VARCHAR(100) NULL,
+        compacted TINYINT(1) NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_tnc_ledger_tail (tnc_wallet_id, compacted, id),
+        KEY idx_tnc_ledger_pending (compacted, tnc_wallet_id)
+    )
+""")
+
+
+def _tnc(value) -> Money:
+    """TNC amount read from a DECIMAL column, whatever its scale."""
+    return Money.from_fraction(to_fraction(value or 0), 'TNC')
+
+
+def append_entries(cursor, entries: Iterable[LedgerEntry]) -> int:
+    """Insert ledger entries in one multi-row statement on the caller's transaction."""
+    rows = [(wallet_id, amount.to_decimal(), entry_type, reference)
+            for wallet_id, amount, entry_type, reference in entries]
+    if rows:
+        cursor.executemany("""
+            INSERT INTO tnc_ledger (tnc_wallet_id, amount, entry_type, reference)
+            VALUES (%s, %s, %s, %s)
+        """, rows)
+    return len(rows)
+
+
+def lock_balances(cursor, wallet_ids: Iterable[str]) -> Dict[str, Money]:
+    """Lock wallets (in id order) and return their current balances for a debit.
+
+    Holding the wallet row lock excludes other debits and the compactor, so
+    snapshot + tail cannot change under the overdraft check. Wallets that do
+    not exist are missing from the result.
+    """
+    wallet_ids = sorted(set(wallet_ids))
+    if not wallet_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(wallet_ids))
+    cursor.execute(f"""
+        SELECT tnc_wallet_id, balance FROM tnc_wallets
+        WHERE tnc_wallet_id IN ({placeholders})
+        ORDER BY tnc_wallet_id
+        FOR UPDATE
+    """, wallet_ids)
+    balances = {row['tnc_wallet_id']: _tnc(row['balance']) for row in cursor.fetchall()}
+    # Locking read: sees every committed entry even if this transaction read the ledger earlier
+    cursor.execute(f"""
+        SELECT tnc_wallet_id, SUM(amount) AS pending FROM tnc_ledger
+        WHERE tnc_wallet_id IN ({placeholders}) AND compacted = 0
+        GROUP BY tnc_wallet_id
+        LOCK IN SHARE MODE
+    """, wallet_ids)
+    for row in cursor.fetchall():
+        if row['tnc_wallet_id'] in balances:
+            balances[row['tnc_wallet_id']] += _tnc(row['pending'])
+    return balances
+
+
+def pending_balances(cursor, wallet_ids: Iterable[str]) -> Dict[str, Money]:
+    """Uncompacted tail per wallet, for displaying balances without locking."""
+    wallet_ids = list(set(wallet_ids))
+    if not wallet_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(wallet_ids))
+    cursor.execute(f"""
+        SELECT tnc_wallet_id, SUM(amount) AS pending FROM tnc_ledger
+        WHERE tnc_wallet_id IN ({placeholders}) AND compacted = 0
+        GROUP BY tnc_wallet_id
+    """, wallet_ids)
+    return {row['tnc_wallet_id']: _tnc(row['pending']) for row in cursor.fetchall()}
+
+
+def get_wallet_id(cursor, user_id: int) -> Optional[str]:
+    cursor.execute("SELECT tnc_wallet_id FROM tnc_wallets WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    return row['tnc_wallet_id'] if row else None
+
+
+def _compact_wallet(connection, wallet_id: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT balance FROM tnc_wallets WHERE tnc_wallet_id = %s FOR UPDATE", (wallet_id,))
+        if not cursor.fetchone():
+            connection.rollback()
+            logging.warning(f"Ledger entries for unknown wallet {wallet_id} left uncompacted")
+            return 0
+        cursor.execute("""
+            SELECT id, amount FROM tnc_ledger
+            WHERE tnc_wallet_id = %s AND compacted = 0
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE
+        """, (wallet_id, LEDGER_COMPACT_BATCH))
+        entries = cursor.fetchall()
+        if not entries:
+            connection.rollback()
+            return 0
+        total = sum((_tnc(entry['amount']) for entry in entries), Money.zero('TNC'))
+        # Only the entries summed above are marked, never rows inserted meanwhile
+        ids = [entry['id'] for entry in entries]
+        cursor.execute("UPDATE tnc_wallets SET balance = balance + %s WHERE tnc_wallet_id = %s",
+                       (total.to_decimal(), wallet_id))
+        cursor.execute(f"UPDATE tnc_ledger SET compacted = 1 WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+    connection.commit()
+    return len(ids)
+
+
+def compact_ledger(max_wallets: int = LEDGER_COMPACT_WALLETS) -> int:
+    """Fold uncompacted entries into the wallet snapshots, one short transaction per wallet."""
+    connection = get_db_connection()
+    compacted = 0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT tnc_wallet_id FROM tnc_ledger
+                WHERE compacted = 0
+                LIMIT %s
+            """, (max_wallets,))
+            wallet_ids: List[str] = sorted(row['tnc_wallet_id'] for row in cursor.fetchall())
+        connection.commit()
+        for wallet_id in wallet_ids:
+            try:
+                compacted += _compact_wallet(connection, wallet_id)
+            except Exception as e:
+                connection.rollback()
+                logging.error(f"Compacting ledger of wallet {wallet_id} failed: {e}")
+    finally:
+        connection.close()
+    metrics.inc('ledger_entries_compacted', compacted)
+    metrics.set_gauge('ledger_wallets_compacted_last_run', len(wallet_ids))
+    return compacted
+
+
+register_periodic('ledger-compactor', LEDGER_COMPACT_INTERVAL, compact_ledger)
@@ -0,0 +1,45 @@
+import threading
+from typing import Any, Callable, Dict
+
+# Process-local metrics registry exposed through /api/metrics
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_collectors: Dict[str, Dict[str, Callable[[], Dict[str, Any]]]] = {}
+
+
+def _key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    label_str = ','.join(f'{k}={labels[k]}' for k in sorted(labels))
+    return f'{name}{{{label_str}}}'
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Increment a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge to the given value."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def register_collector(section: str, name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+    """Register a callable whose output is reported under snapshot()[section][name]."""
+    with _lock:
+        _collectors.setdefault(section, {})[name] = collector
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return a point-in-time copy of every counter, gauge and collector."""
+    with _lock:
+        data: Dict[str, Any] = {'counters': dict(_counters), 'gauges': dict(_gauges)}
+        collectors = {section: dict(entries) for section, entries in _collectors.items()}
+    for section, entries in collectors.items():
+        data[section] = {name: collector() for name, collector in entries.items()}
+    return data
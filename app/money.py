@@ -0,0 +1,144 @@
+"""Fixed-point amounts stored as integer minor units of their currency.
+
+Amounts are parsed once at the edge (request JSON, chain values, SQL rows)
+and stay integers until they are written back out. Exchange rates are exact
+``Fraction`` objects, and every conversion rounds down to a whole minor unit.
+"""
+from decimal import Decimal, InvalidOperation
+from fractions import Fraction
+from typing import Any, Union
+
+DECIMALS = {
+    'ETH': 18,   # wei
+    'BTC': 8,    # satoshi
+    'USDT': 6,
+    'TNC': 8,
+    'EUR': 2,
+}
+
+Number = Union[int, Fraction]
+
+# Bounds on decimal input, checked before anything expensive: '1e10000000'
+# would otherwise build a ten-million-digit integer
+MAX_DIGITS = 60
+MAX_EXPONENT = 40
+
+
+def to_fraction(value: Any) -> Fraction:
+    """Exact Fraction for a Decimal, int, Fraction or numeric string (floats via their repr)."""
+    if isinstance(value, (int, Fraction)):
+        return Fraction(value)
+    try:
+        number = value if isinstance(value, Decimal) else Decimal(str(value))
+    except (InvalidOperation, ValueError) as e:
+        raise ValueError(f"Invalid number: {value!r}") from e
+    if not number.is_finite():
+        raise ValueError(f"Invalid number: {value!r}")
+    if number and (len(number.as_tuple().digits) > MAX_DIGITS or abs(number.adjusted()) > MAX_EXPONENT):
+        raise ValueError(f"Number out of range: {value!r}")
+    return Fraction(number)
+
+
+class Money:
+    """An amount of `currency` held as an integer count of minor units."""
+
+    __slots__ = ('units', 'currency')
+
+    def __init__(self, units: int, currency: str):
+        if currency not in DECIMALS:
+            raise ValueError(f"Unsupported currency: {currency}")
+        self.units = int(units)
+        self.currency = currency
+
+    @classmethod
+    def parse(cls, value: Any, currency: str) -> 'Money':
+        """Parse a major-unit amount; more decimals than the currency has are rejected."""
+        exact = to_fraction(value) * 10 ** DECIMALS[currency]
+        if exact.denominator != 1:
+            raise ValueError(f"{value!r} has more than {DECIMALS[currency]} decimals for {currency}")
+        return cls(exact.numerator, currency)
+
+    @classmethod
+    def from_fraction(cls, value: Fraction, currency: str) -> 'Money':
+        """Nearest representable amount for an exact major-unit value (e.g. a rate)."""
+        return cls(round(value * 10 ** DECIMALS[currency]), currency)
+
+    @classmethod
+    def zero(cls, currency: str) -> 'Money':
+        return cls(0, currency)
+
+    @property
+    def decimals(self) -> int:
+        return DECIMALS[self.currency]
+
+    def to_decimal(self) -> Decimal:
+        """Exact Decimal, used as the SQL parameter for DECIMAL columns."""
+        return Decimal(self.units).scaleb(-self.decimals)
+
+    def to_fraction(self) -> Fraction:
+        return Fraction(self.units, 10 ** self.decimals)
+
+    def exchange(self, rate: Fraction, currency: str) -> 'Money':
+        """Convert at `rate` units of `currency` per one unit of this currency, rounding down."""
+        numerator = self.units * rate.numerator * 10 ** DECIMALS[currency]
+        denominator = rate.denominator * 10 ** self.decimals
+        return Money(numerator // denominator, currency)
+
+    def scale(self, factor: Number) -> 'Money':
+        """Multiply by an exact factor, rounding down to a whole minor unit."""
+        factor = Fraction(factor)
+        return Money(self.units * factor.numerator // factor.denominator, self.currency)
+
+    def add_percentage(self, percentage: Any) -> 'Money':
+        """This amount plus `percentage` percent of it (promo bonuses)."""
+        return self.scale(1 + to_fraction(percentage) / 100)
+
+    def _check(self, other: 'Money') -> None:
+        if not isinstance(other, Money) or other.currency != self.currency:
+            raise TypeError(f"Cannot combine {self.currency} with {other!r}")
+
+    def __add__(self, other: 'Money') -> 'Money':
+        self._check(other)
+        return Money(self.units + other.units, self.currency)
+
+    def __sub__(self, other: 'Money') -> 'Money':
+        self._check(other)
+        return Money(self.units - other.units, self.currency)
+
+    def __neg__(self) -> 'Money':
+        return Money(-self.units, self.currency)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Money) and other.currency == self.currency and other.units == self.units
+
+    def __lt__(self, other: 'Money') -> bool:
+        self._check(other)
+        return self.units < other.units
+
+    def __le__(self, other: 'Money') -> bool:
+        self._check(other)
+        return self.units <= other.units
+
+    def __gt__(self, other: 'Money') -> bool:
+        self._check(other)
+        return self.units > other.units
+
+    def __ge__(self, other: 'Money') -> bool:
+        self._check(other)
+        return self.units >= other.units
+
+    def __hash__(self) -> int:
+        return hash((self.units, self.currency))
+
+    def __bool__(self) -> bool:
+        return self.units != 0
+
+    def __str__(self) -> str:
+        sign = '-' if self.units < 0 else ''
+        whole, fraction = divmod(abs(self.units), 10 ** self.decimals)
+        if not self.decimals:
+            return f"{sign}{whole}"
+        return f"{sign}{whole}.{fraction:0{self.decimals}d}"
+
+    def __repr__(self) -> str:
+        return f"Money('{self}', '{self.currency}')"
@@ -0,0 +1,243 @@
+from .db_setup import get_db_connection
+from .db_schema import register_schema
+from .background import register_service
+from .wallet_communications import TERMINAL_PAYMENT_ERRORS, check_payment
+from .cache import LRUCache
+from . import metrics
+from typing import Any, Dict, Optional
+import json
+import logging
+import os
+import random
+import threading
+
+PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', 4))
+PAYMENT_JOB_POLL_SECONDS = float(os.getenv('PAYMENT_JOB_POLL_SECONDS', 2))
+PAYMENT_JOB_LEASE_SECONDS = int(os.getenv('PAYMENT_JOB_LEASE_SECONDS', 120))
+PAYMENT_JOB_MAX_ATTEMPTS = int(os.getenv('PAYMENT_JOB_MAX_ATTEMPTS', 60))
+PAYMENT_JOB_BACKOFF_BASE = float(os.getenv('PAYMENT_JOB_BACKOFF_BASE_SECONDS', 15))
+PAYMENT_JOB_BACKOFF_MAX = float(os.getenv('PAYMENT_JOB_BACKOFF_MAX_SECONDS', 600))
+
+SUPPORTED_PAYMENT_METHODS = ('ETH', 'USDT', 'BTC')
+
+# Finished jobs never change again, so repeat polls are answered from memory
+finished_jobs = LRUCache(maxsize=int(os.getenv('PAYMENT_JOB_CACHE_SIZE', 10000)))
+metrics.register_collector('caches', 'finished_jobs', finished_jobs.stats)
+
+register_schema("""
+    CREATE TABLE IF NOT EXISTS payment_verification_jobs (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        tx_hash VARCHAR(100) NOT NULL,
+        payment_method VARCHAR(10) NOT NULL,
+        promo_code VARCHAR(32) NULL,
+        status ENUM('queued', 'running', 'completed', 'failed') NOT NULL DEFAULT 'queued',
+        attempts INT NOT NULL DEFAULT 0,
+        next_run_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        locked_until DATETIME NULL,
+        result TEXT NULL,
+        last_error TEXT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_payment_jobs_tx_user (tx_hash, user_id),
+        KEY idx_payment_jobs_due (status, next_run_at)
+    )
+""", """
+    ALTER TABLE payment_verification_jobs
+        ADD UNIQUE KEY uq_payment_jobs_tx_user (tx_hash, user_id),
+        DROP INDEX uq_payment_jobs_tx_hash
+""")
+
+_JOB_COLUMNS = """
+    id, user_id, tx_hash, payment_method, status, attempts, result, last_error, created_at, updated_at
+"""
+
+
+def enqueue_verification_job(user_id: int, tx_hash: str, payment_method: str,
+                             promo_code: Optional[str] = None) -> Dict[str, Any]:
+    """Queue a payment verification for user_id and return the public view of its job.
+
+    Each user has one job per tx hash. Re-submitting returns that job as it
+    stands, except a failed job, which is queued again from scratch. Anyone
+    may submit a hash: the worker only credits the payment to the account
+    owning the sending wallet, and fails the job of any other submitter.
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            # Assignments apply left to right, so status must be reset last
+            cursor.execute("""
+                INSERT INTO payment_verification_jobs (user_id, tx_hash, payment_method, promo_code)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    id = LAST_INSERT_ID(id),
+                    payment_method = IF(status = 'failed', VALUES(payment_method), payment_method),
+                    promo_code = IF(status = 'failed', VALUES(promo_code), promo_code),
+                    attempts = IF(status = 'failed', 0, attempts),
+                    result = IF(status = 'failed', NULL, result),
+                    last_error = IF(status = 'failed', NULL, last_error),
+                    next_run_at = IF(status = 'failed', NOW(), next_run_at),
+                    status = IF(status = 'failed', 'queued', status)
+            """, (user_id, tx_hash, payment_method, promo_code))
+            cursor.execute(f"SELECT {_JOB_COLUMNS} FROM payment_verification_jobs WHERE id = %s",
+                           (cursor.lastrowid,))
+            job = _load_job(cursor.fetchone())
+        connection.commit()
+    finally:
+        connection.close()
+    if job['status'] not in ('completed', 'failed'):
+        # Drop a failed outcome remembered before the resubmit
+        finished_jobs.pop(('job', job['job_id']))
+        finished_jobs.pop(('tx', job['tx_hash'], user_id))
+    return _public_view(job)
+
+
+def get_finished_job(user_id: int, job_id: Optional[int] = None,
+                     tx_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Return a completed or failed job from memory, by id or tx hash."""
+    job = finished_jobs.get(('job', job_id) if job_id is not None else ('tx', tx_hash, user_id))
+    if job and job['user_id'] == user_id:
+        return _public_view(job)
+    return None
+
+
+def _public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in job.items() if key != 'user_id'}
+
+
+def _remember_finished(job: Dict[str, Any]) -> None:
+    finished_jobs.set(('job', job['job_id']), job)
+    finished_jobs.set(('tx', job['tx_hash'], job['user_id']), job)
+
+
+def _load_job(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Decode a job row, remembering it once it reached a final state."""
+    row['job_id'] = row.pop('id')
+    row['result'] = json.loads(row['result']) if row['result'] else None
+    if row['status'] in ('completed', 'failed'):
+        _remember_finished(row)
+    return row
+
+
+def get_job(job_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    """Return the public view of a job owned by user_id."""
+    cached = get_finished_job(user_id, job_id=job_id)
+    if cached:
+        return cached
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {_JOB_COLUMNS} FROM payment_verification_jobs WHERE id = %s AND user_id = %s",
+                           (job_id, user_id))
+            job = cursor.fetchone()
+    finally:
+        connection.close()
+    if not job:
+        return None
+    return _public_view(_load_job(job))
+
+
+def _claim_job() -> Optional[Dict[str, Any]]:
+    """Lease the oldest due job, including jobs whose worker lease expired."""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, user_id, tx_hash, payment_method, promo_code, attempts
+                FROM payment_verification_jobs
+                WHERE (status = 'queued' AND next_run_at <= NOW())
+                   OR (status = 'running' AND locked_until < NOW())
+                ORDER BY next_run_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            """)
+            job = cursor.fetchone()
+            if job:
+                cursor.execute("""
+                    UPDATE payment_verification_jobs
+                    SET status = 'running', attempts = attempts + 1,
+                        locked_until = NOW() + INTERVAL %s SECOND
+                    WHERE id = %s
+                """, (PAYMENT_JOB_LEASE_SECONDS, job['id']))
+                job['attempts'] += 1
+            connection.commit()
+            return job
+    finally:
+        connection.close()
+
+
+def _finish_job(job_id: int, status: str, result: Dict[str, Any], error: Optional[str] = None) -> None:
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE payment_verification_jobs
+                SET status = %s, result = %s, last_error = %s, locked_until = NULL
+                WHERE id = %s
+            """, (status, json.dumps(result, default=str), error, job_id))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _retry_job(job_id: int, attempts: int, result: Dict[str, Any], retry_after: Optional[float] = None) -> None:
+    """Put the job back in the queue with exponential backoff and jitter."""
+    delay = min(PAYMENT_JOB_BACKOFF_BASE * 2 ** (attempts - 1), PAYMENT_JOB_BACKOFF_MAX)
+    delay = max(delay, retry_after or 0) * random.uniform(0.8, 1.2)
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE payment_verification_jobs
+                SET status = 'queued', result = %s, last_error = %s, locked_until = NULL,
+                    next_run_at = NOW() + INTERVAL %s SECOND
+                WHERE id = %s
+            """, (json.dumps(result, default=str), result.get('message'), int(delay), job_id))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def verify_payment(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the chain lookup, then credit and redeem the promo code in one transaction."""
+    return check_payment(job['tx_hash'], job['payment_method'], job.get('promo_code'), job['user_id'])
+
+
+def process_job(job: Dict[str, Any]) -> None:
+    try:
+        result = verify_payment(job)
+    except Exception as e:
+        logging.error(f"Payment job {job['id']} raised: {e}")
+        result = {"status": "error", "message": str(e)}
+
+    status = result.get("status")
+    if status == "confirmed":
+        _finish_job(job['id'], 'completed', result)
+    elif status == "failed":
+        _finish_job(job['id'], 'failed', result, "Transaction failed on chain")
+    elif result.get("message") in TERMINAL_PAYMENT_ERRORS:
+        # Retrying cannot change who sent the payment or where it went
+        _finish_job(job['id'], 'failed', result, result["message"])
+    elif job['attempts'] >= PAYMENT_JOB_MAX_ATTEMPTS:
+        _finish_job(job['id'], 'failed', result, result.get('message', 'Gave up waiting for confirmations'))
+    else:
+        # pending, unavailable or a transient error (e.g. tx not propagated yet)
+        _retry_job(job['id'], job['attempts'], result, result.get('retry_after'))
+    logging.info(f"Payment job {job['id']} ({job['tx_hash']}) attempt {job['attempts']}: {status}")
+
+
+def _worker_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            job = _claim_job()
+        except Exception as e:
+            logging.error(f"Could not claim payment job: {e}")
+            job = None
+        if job:
+            process_job(job)
+        else:
+            stop.wait(PAYMENT_JOB_POLL_SECONDS)
+
+
+for _worker in range(PAYMENT_WORKERS):
+    register_service(f'payment-worker-{_worker}', _worker_loop)
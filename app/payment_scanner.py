@@ -0,0 +1,333 @@
+"""Block scanner that credits incoming ETH and USDT payments without a client poll.
+
+It follows the chain head (minus the required confirmations). For every block
+range it pulls USDT ``Transfer`` logs addressed to RECEIVER_USDT_ADDRESS with
+``eth_getLogs``, and native ETH transfers to RECEIVER_ADDRESS from the range's
+blocks. Matches are credited through store_transaction_in_db. Progress is
+checkpointed in the database, and the range size adapts to how the node copes.
+
+A hash that a buyer has submitted for verification is left to that job, which
+carries the buyer's promo code. The scanner parks it in
+``payment_scanner_deferred`` and credits it once the job has closed, for
+instance because it was submitted by someone other than the sender.
+
+Scanning is opt-in: nothing runs unless PAYMENT_SCANNER_ENABLED=1. The scanner
+then runs with the app's background services, and ``python -m app.payment_scanner``
+can be added to the Procfile to give it a process of its own.
+
+    PAYMENT_SCANNER_ENABLED=1 python -m app.payment_scanner                # follow the chain forever
+    PAYMENT_SCANNER_ENABLED=1 python -m app.payment_scanner --rpc-url http://127.0.0.1:8545 --once
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from . import metrics
+from .background import register_service
+from .db_schema import register_schema
+from .db_setup import get_db_connection
+from .eth_rpc import EthRpcClient, JsonRpcError, MultiEndpointClient, hex_to_int
+from .money import Money
+from .wallet_communications import (INFURA_PROJECT_ID, PROVIDER_TIMEOUT, RECEIVER_ADDRESS, RECEIVER_USDT_ADDRESS,
+                                    REQUIRED_ETH_CONFIRMATIONS, USDT_CONTRACT_ADDRESS,
+                                    NO_LINKED_USER, get_tanacoin_rates_in_crypto, store_transaction_in_db)
+
+ETH_SCANNER_RPC_URL = os.getenv('ETH_SCANNER_RPC_URL')
+PAYMENT_SCANNER_ENABLED = os.getenv('PAYMENT_SCANNER_ENABLED', '0') == '1'
+SCANNER_START_BLOCK = os.getenv('SCANNER_START_BLOCK')
+SCANNER_POLL_SECONDS = float(os.getenv('SCANNER_POLL_SECONDS', 12))
+SCANNER_MIN_BATCH = int(os.getenv('SCANNER_MIN_BATCH', 1))
+SCANNER_MAX_BATCH = int(os.getenv('SCANNER_MAX_BATCH', 500))
+SCANNER_NAME = 'eth_payments'
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+register_schema("""
+    CREATE TABLE IF NOT EXISTS payment_scanner_checkpoints (
+        scanner VARCHAR(50) PRIMARY KEY,
+        last_block BIGINT NOT NULL,
+        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS payment_scanner_deferred (
+        tx_hash VARCHAR(100) PRIMARY KEY,
+        currency VARCHAR(10) NOT NULL,
+        sender VARCHAR(100) NOT NULL,
+        units DECIMAL(65, 0) NOT NULL,
+        block_number BIGINT NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+""")
+
+# Verification jobs that may still credit their hash
+_OPEN_JOB = "status IN ('queued', 'running')"
+
+
+def _topic_address(address: str) -> str:
+    return '0x' + address.lower().replace('0x', '').rjust(64, '0')
+
+
+def load_checkpoint() -> Optional[int]:
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT last_block FROM payment_scanner_checkpoints WHERE scanner = %s", (SCANNER_NAME,))
+            row = cursor.fetchone()
+            return row['last_block'] if row else None
+    finally:
+        connection.close()
+
+
+def save_checkpoint(block_number: int) -> None:
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO payment_scanner_checkpoints (scanner, last_block) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE last_block = VALUES(last_block)
+            """, (SCANNER_NAME, block_number))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def open_job_hashes(tx_hashes: Iterable[str]) -> Set[str]:
+    """The hashes among tx_hashes that a buyer submitted and whose verification job is still open."""
+    tx_hashes = list(tx_hashes)
+    if not tx_hashes:
+        return set()
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT DISTINCT tx_hash FROM payment_verification_jobs
+                WHERE tx_hash IN ({', '.join(['%s'] * len(tx_hashes))}) AND {_OPEN_JOB}
+            """, tx_hashes)
+            return {row['tx_hash'] for row in cursor.fetchall()}
+    finally:
+        connection.close()
+
+
+def defer_payments(payments: List[Dict[str, Any]]) -> None:
+    if not payments:
+        return
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.executemany("""
+                INSERT IGNORE INTO payment_scanner_deferred (tx_hash, currency, sender, units, block_number)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(p['tx_hash'], p['currency'], p['from'], p['value'].units, p['block_number']) for p in payments])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def ready_deferred_payments() -> List[Dict[str, Any]]:
+    """Deferred payments whose verification jobs have all closed."""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT tx_hash, currency, sender, units, block_number FROM payment_scanner_deferred d
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM payment_verification_jobs j WHERE j.tx_hash = d.tx_hash AND j.{_OPEN_JOB}
+                )
+                ORDER BY block_number
+            """)
+            return [{'tx_hash': row['tx_hash'], 'currency': row['currency'], 'from': row['sender'],
+                     'value': Money(int(row['units']), row['currency']), 'block_number': row['block_number']}
+                    for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def drop_deferred(tx_hash: str) -> None:
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM payment_scanner_deferred WHERE tx_hash = %s", (tx_hash,))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class PaymentScanner:
+    def __init__(self, client, min_batch: int = SCANNER_MIN_BATCH, max_batch: int = SCANNER_MAX_BATCH,
+                 confirmations: int = REQUIRED_ETH_CONFIRMATIONS):
+        self.client = client
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.batch_size = min_batch
+        self.confirmations = confirmations
+
+    def _check(self, results: List[Any]) -> List[Any]:
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def find_usdt_payments(self, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        if not RECEIVER_USDT_ADDRESS:
+            return []
+        logs = self.client.call('eth_getLogs', {
+            'fromBlock': hex(from_block),
+            'toBlock': hex(to_block),
+            'address': USDT_CONTRACT_ADDRESS,
+            'topics': [TRANSFER_TOPIC, None, _topic_address(RECEIVER_USDT_ADDRESS)],
+        })
+        payments = []
+        for log in logs:
+            if log.get('removed'):
+                continue
+            payments.append({
+                'tx_hash': log['transactionHash'],
+                'currency': 'USDT',
+                'from': '0x' + log['topics'][1][-40:],
+                'value': Money(hex_to_int(log['data']) or 0, 'USDT'),
+                'block_number': hex_to_int(log['blockNumber']),
+            })
+        return payments
+
+    def find_eth_payments(self, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        if not RECEIVER_ADDRESS:
+            return []
+        blocks = self._check(self.client.batch(
+            [('eth_getBlockByNumber', (hex(n), True)) for n in range(from_block, to_block + 1)]))
+        candidates = [
+            tx for block in blocks if block for tx in block['transactions']
+            if tx.get('to') and tx['to'].lower() == RECEIVER_ADDRESS.lower() and hex_to_int(tx['value'])
+        ]
+        if not candidates:
+            return []
+        # Only successful transfers count; fetch the receipts of the matches in one batch
+        receipts = self._check(self.client.batch(
+            [('eth_getTransactionReceipt', (tx['hash'],)) for tx in candidates]))
+        return [{
+            'tx_hash': tx['hash'],
+            'currency': 'ETH',
+            'from': tx['from'],
+            'value': Money(hex_to_int(tx['value']), 'ETH'),
+            'block_number': hex_to_int(tx['blockNumber']),
+        } for tx, receipt in zip(candidates, receipts) if receipt and hex_to_int(receipt['status']) == 1]
+
+    def credit(self, payment: Dict[str, Any]) -> bool:
+        """Credit one payment; False when no account is linked to the sender.
+
+        Any other failure raises, so the range is not checkpointed and is
+        scanned again (already credited payments are skipped on the retry).
+        """
+        tanacoin_rate_eur, tanacoin_rate_eth, tanacoin_rate_usdt, _ = get_tanacoin_rates_in_crypto()
+        rate = tanacoin_rate_eth if payment['currency'] == 'ETH' else tanacoin_rate_usdt
+        if not rate:
+            raise RuntimeError("Tanacoin rate not available")
+        tanacoin_purchased = payment['value'].exchange(1 / rate, 'TNC')
+        stored, message, _ = store_transaction_in_db(payment['tx_hash'], payment['value'], payment['currency'],
+                                                     payment['from'], tanacoin_purchased)
+        logging.info(f"Scanner credit {payment['tx_hash']} ({payment['value']} {payment['currency']}): {message}")
+        metrics.inc('scanner_payments_seen', currency=payment['currency'])
+        if stored:
+            metrics.inc('scanner_payments_credited', currency=payment['currency'])
+        elif message != NO_LINKED_USER:
+            raise RuntimeError(f"Crediting {payment['tx_hash']} failed: {message}")
+        return stored
+
+    def credit_deferred(self) -> int:
+        """Credit deferred payments whose jobs have closed; already credited ones are just dropped."""
+        settled = 0
+        for payment in ready_deferred_payments():
+            self.credit(payment)
+            drop_deferred(payment['tx_hash'])
+            settled += 1
+        return settled
+
+    def scan_once(self, checkpoint: Optional[int]) -> Optional[int]:
+        """Scan the next block range; return the new checkpoint (unchanged when caught up)."""
+        head = hex_to_int(self.client.call('eth_blockNumber'))
+        safe_head = head - self.confirmations + 1
+        if checkpoint is None:
+            checkpoint = int(SCANNER_START_BLOCK) - 1 if SCANNER_START_BLOCK else safe_head - 1
+        from_block = checkpoint + 1
+        if from_block > safe_head:
+            return checkpoint
+        to_block = min(from_block + self.batch_size - 1, safe_head)
+
+        started = time.monotonic()
+        try:
+            payments = self.find_usdt_payments(from_block, to_block) + self.find_eth_payments(from_block, to_block)
+        except (JsonRpcError, OSError, ValueError) as e:
+            # Too many logs or an overloaded node: retry the same range with a smaller window
+            self.batch_size = max(self.min_batch, self.batch_size // 2)
+            logging.warning(f"Scanning blocks {from_block}-{to_block} failed ({e}); batch size now {self.batch_size}")
+            if to_block == from_block:
+                raise
+            return checkpoint
+
+        # Deferred before crediting the rest, so a failed credit never loses them with the range
+        submitted = open_job_hashes(payment['tx_hash'] for payment in payments)
+        defer_payments([payment for payment in payments if payment['tx_hash'] in submitted])
+        for payment in sorted(payments, key=lambda p: p['block_number']):
+            if payment['tx_hash'] not in submitted:
+                self.credit(payment)
+        save_checkpoint(to_block)
+        metrics.inc('scanner_payments_deferred', len(submitted))
+
+        if time.monotonic() - started < PROVIDER_TIMEOUT / 2:
+            self.batch_size = min(self.max_batch, max(self.batch_size + 1, int(self.batch_size * 1.5)))
+        metrics.set_gauge('scanner_last_block', to_block)
+        metrics.set_gauge('scanner_lag_blocks', safe_head - to_block)
+        metrics.set_gauge('scanner_batch_size', self.batch_size)
+        return to_block
+
+    def run(self, stop: threading.Event, once: bool = False) -> None:
+        checkpoint = load_checkpoint()
+        while not stop.is_set():
+            try:
+                self.credit_deferred()
+                new_checkpoint = self.scan_once(checkpoint)
+            except Exception as e:
+                logging.error(f"Payment scanner error: {e}")
+                stop.wait(SCANNER_POLL_SECONDS)
+                continue
+            caught_up = new_checkpoint == checkpoint
+            checkpoint = new_checkpoint
+            if once and caught_up:
+                return
+            if caught_up:
+                stop.wait(SCANNER_POLL_SECONDS)
+
+
+def _scanner_client(rpc_url: Optional[str] = ETH_SCANNER_RPC_URL):
+    """A dedicated endpoint when one is configured, otherwise the shared endpoint pool."""
+    if rpc_url:
+        return EthRpcClient(rpc_url, timeout=PROVIDER_TIMEOUT)
+    return MultiEndpointClient.from_env(INFURA_PROJECT_ID, timeout=PROVIDER_TIMEOUT)
+
+
+def _scanner_service(stop: threading.Event) -> None:
+    PaymentScanner(_scanner_client()).run(stop)
+
+
+if PAYMENT_SCANNER_ENABLED:
+    register_service('payment-scanner', _scanner_service)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Scan new blocks for incoming ETH and USDT payments.")
+    parser.add_argument('--rpc-url', default=ETH_SCANNER_RPC_URL, help="JSON-RPC endpoint, e.g. a local node")
+    parser.add_argument('--confirmations', type=int, default=REQUIRED_ETH_CONFIRMATIONS)
+    parser.add_argument('--once', action='store_true', help="stop once the scanner has caught up")
+    args = parser.parse_args(argv)
+    if not PAYMENT_SCANNER_ENABLED:
+        parser.exit(1, "Payment scanner is disabled; set PAYMENT_SCANNER_ENABLED=1 to run it.\n")
+
+    scanner = PaymentScanner(_scanner_client(args.rpc_url), confirmations=args.confirmations)
+    scanner.run(threading.Event(), once=args.once)
+
+
+if __name__ == '__main__':
+    main()
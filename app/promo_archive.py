@@ -0,0 +1,156 @@
+"""Move expired, never-redeemed promo codes out of the hot ``promo_codes`` table.
+
+A periodic sweeper copies them into ``promo_codes_archive`` (keeping their
+``id``) and deletes them, in bounded batches with one short transaction each.
+Redeemed codes stay in ``promo_codes``: the spent-code reports and user data
+procedures join on them there. Where the server
+supports it, the archive is range-partitioned by month of ``end_date`` so old
+campaigns can be dropped a partition at a time; the sweeper keeps the next
+few monthly partitions in place.
+"""
+import logging
+import os
+import time
+from datetime import date
+from typing import List
+
+import pymysql
+
+from . import metrics
+from .background import register_periodic
+from .db_schema import register_schema
+from .db_setup import get_db_connection
+from .promo_cache import invalidate_promo_code
+
+PROMO_SWEEP_INTERVAL = float(os.getenv('PROMO_SWEEP_INTERVAL_SECONDS', 300))
+PROMO_SWEEP_BATCH = int(os.getenv('PROMO_SWEEP_BATCH', 1000))
+PROMO_SWEEP_MAX_BATCHES = int(os.getenv('PROMO_SWEEP_MAX_BATCHES', 50))
+PROMO_SWEEP_PAUSE = float(os.getenv('PROMO_SWEEP_PAUSE_SECONDS', 0.05))
+PROMO_ARCHIVE_MONTHS_AHEAD = 3
+_partitioning_unsupported = False
+
+PROMO_COLUMNS = "id, code, added_tnc_percentage, start_date, end_date, creator_id, spender_id, created_at"
+
+# The partition key has to be part of every unique key, hence (id, end_date)
+register_schema(
+    """
+    CREATE TABLE IF NOT EXISTS promo_codes_archive (
+        id BIGINT AUTO_INCREMENT,
+        code VARCHAR(32) NOT NULL,
+        added_tnc_percentage DECIMAL(5, 2) NOT NULL,
+        start_date DATETIME NOT NULL,
+        end_date DATETIME NOT NULL,
+        creator_id INT NOT NULL,
+        spender_id INT NULL,
+        created_at DATETIME NULL,
+        archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, end_date),
+        KEY idx_promo_archive_code (code),
+        KEY idx_promo_archive_creator (creator_id, created_at, code)
+    )
+    """,
+    "CREATE INDEX idx_promo_codes_end_date ON promo_codes (end_date)",
+    "CREATE INDEX idx_promo_codes_creator_page ON promo_codes (creator_id, created_at, code)",
+)
+
+
+def _month_start(year: int, month: int) -> date:
+    return date(year + (month - 1) // 12, (month - 1) % 12 + 1, 1)
+
+
+def ensure_archive_partitions(connection) -> bool:
+    """Partition the archive by month of end_date and keep upcoming months split out.
+
+    Returns False when the server does not support partitioning; the archive
+    then simply stays a regular table and later sweeps no longer try.
+    """
+    global _partitioning_unsupported
+    if _partitioning_unsupported:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT PARTITION_NAME FROM INFORMATION_SCHEMA.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'promo_codes_archive'
+              AND PARTITION_NAME IS NOT NULL
+        """)
+        existing = {row['PARTITION_NAME'] for row in cursor.fetchall()}
+        try:
+            if not existing:
+                cursor.execute("""
+                    ALTER TABLE promo_codes_archive
+                    PARTITION BY RANGE (TO_DAYS(end_date)) (PARTITION p_future VALUES LESS THAN MAXVALUE)
+                """)
+                existing = {'p_future'}
+            today = date.today()
+            for offset in range(PROMO_ARCHIVE_MONTHS_AHEAD + 1):
+                start = _month_start(today.year, today.month + offset)
+                name = f"p{start:%Y%m}"
+                if name in existing:
+                    continue
+                upper = _month_start(start.year, start.month + 1)
+                cursor.execute(f"""
+                    ALTER TABLE promo_codes_archive REORGANIZE PARTITION p_future INTO (
+                        PARTITION {name} VALUES LESS THAN (TO_DAYS('{upper.isoformat()}')),
+                        PARTITION p_future VALUES LESS THAN MAXVALUE
+                    )
+                """)
+                existing.add(name)
+        except pymysql.MySQLError as e:
+            logging.warning(f"Promo archive partitioning unavailable, keeping a plain table: {e}")
+            _partitioning_unsupported = True
+            return False
+    return True
+
+
+def _sweep_batch(connection) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {PROMO_COLUMNS} FROM promo_codes
+            WHERE end_date < NOW() AND spender_id IS NULL
+            ORDER BY end_date
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (PROMO_SWEEP_BATCH,))
+        rows = cursor.fetchall()
+        if not rows:
+            connection.rollback()
+            return 0
+        codes: List[str] = [row['code'] for row in rows]
+        cursor.executemany(f"""
+            INSERT INTO promo_codes_archive ({PROMO_COLUMNS})
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, [tuple(row[column] for column in PROMO_COLUMNS.split(', ')) for row in rows])
+        cursor.execute(f"DELETE FROM promo_codes WHERE code IN ({', '.join(['%s'] * len(codes))})", codes)
+    connection.commit()
+    for code in codes:
+        invalidate_promo_code(code)
+    return len(codes)
+
+
+def sweep_promo_codes() -> int:
+    """Archive expired unredeemed codes, at most PROMO_SWEEP_MAX_BATCHES batches per run."""
+    started = time.monotonic()
+    connection = get_db_connection()
+    archived = 0
+    try:
+        ensure_archive_partitions(connection)
+        for _ in range(PROMO_SWEEP_MAX_BATCHES):
+            moved = _sweep_batch(connection)
+            archived += moved
+            if moved < PROMO_SWEEP_BATCH:
+                break
+            # Leave room for foreground writes between batches
+            time.sleep(PROMO_SWEEP_PAUSE)
+    except pymysql.MySQLError:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    metrics.inc('promo_codes_archived', archived)
+    metrics.set_gauge('promo_sweep_last_seconds', round(time.monotonic() - started, 3))
+    if archived:
+        logging.info(f"Archived {archived} expired promo codes")
+    return archived
+
+
+register_periodic('promo-expiry-sweeper', PROMO_SWEEP_INTERVAL, sweep_promo_codes)
@@ -0,0 +1,148 @@
+"""Bulk promo code generation for campaigns.
+
+Codes are drawn from the OS CSPRNG, de-duplicated within the batch and
+against existing codes, then inserted with multi-row INSERTs, one chunk per
+transaction. Archived codes count as taken. A chunk that still hits a duplicate (a concurrent generator) is
+rolled back and redrawn.
+
+    python -m app.promo_bulk --count 100000 --creator-id 1 --percentage 10 --days 90 > codes.txt
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pymysql
+
+from .db_setup import get_db_connection
+from .promo_cache import remember_promo_code
+from .self_utils import PROMO_CODE_LENGTH, random_promo_code
+
+PROMO_BULK_MAX = int(os.getenv('PROMO_BULK_MAX', 200000))
+PROMO_BULK_CHUNK_SIZE = int(os.getenv('PROMO_BULK_CHUNK_SIZE', 2000))
+PROMO_BULK_MAX_RETRIES = 5
+DUPLICATE_ENTRY = 1062
+
+
+def _draw(count: int, length: int, taken: Set[str]) -> List[str]:
+    codes: Set[str] = set()
+    while len(codes) < count:
+        code = random_promo_code(length)
+        if code not in taken:
+            codes.add(code)
+    return list(codes)
+
+
+def _existing(cursor, codes: List[str]) -> Set[str]:
+    """Codes already issued, archived ones included (the archive has no unique key to catch them)."""
+    placeholders = ', '.join(['%s'] * len(codes))
+    cursor.execute(f"""
+        SELECT code FROM promo_codes WHERE code IN ({placeholders})
+        UNION
+        SELECT code FROM promo_codes_archive WHERE code IN ({placeholders})
+    """, codes + codes)
+    return {row['code'] for row in cursor.fetchall()}
+
+
+def _insert_chunk(connection, count: int, length: int, taken: Set[str], added_tnc_percentage, start_date,
+                  end_date, creator_id) -> List[str]:
+    for _ in range(PROMO_BULK_MAX_RETRIES):
+        codes = _draw(count, length, taken)
+        try:
+            with connection.cursor() as cursor:
+                collisions = _existing(cursor, codes)
+                while collisions:
+                    taken.update(collisions)
+                    codes = [code for code in codes if code not in collisions]
+                    replacements = _draw(count - len(codes), length, taken | set(codes))
+                    collisions = _existing(cursor, replacements)
+                    codes += replacements
+                # pymysql sends executemany INSERTs as a single multi-row statement
+                cursor.executemany("""
+                    INSERT INTO promo_codes (code, added_tnc_percentage, start_date, end_date, creator_id, created_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW())
+                """, [(code, added_tnc_percentage, start_date, end_date, creator_id) for code in codes])
+            connection.commit()
+            taken.update(codes)
+            return codes
+        except pymysql.IntegrityError as e:
+            connection.rollback()
+            if e.args and e.args[0] == DUPLICATE_ENTRY:
+                logging.warning("Promo code chunk collided with a concurrent insert, redrawing")
+                continue
+            raise
+    raise RuntimeError("Could not generate collision-free promo codes, consider a longer code length")
+
+
+def create_promo_codes_bulk(count: int, added_tnc_percentage, start_date: datetime, end_date: datetime,
+                            creator_id: int, length: int = PROMO_CODE_LENGTH,
+                            chunk_size: int = PROMO_BULK_CHUNK_SIZE) -> Tuple[List[str], Optional[str]]:
+    """Create `count` unique codes; returns (created codes, error)."""
+    created: List[str] = []
+    taken: Set[str] = set()
+    connection = get_db_connection()
+    try:
+        while len(created) < count:
+            chunk = min(chunk_size, count - len(created))
+            codes = _insert_chunk(connection, chunk, length, taken, added_tnc_percentage, start_date, end_date,
+                                  creator_id)
+            created.extend(codes)
+            for code in codes:
+                remember_promo_code(code)
+    except (pymysql.MySQLError, RuntimeError) as e:
+        logging.error(f"Bulk promo generation stopped after {len(created)} codes: {e}")
+        return created, str(e)
+    finally:
+        connection.close()
+    logging.info(f"Created {len(created)} promo codes for creator {creator_id}")
+    return created, None
+
+
+def parse_bulk_request(data: Dict[str, Any], default_creator_id: int) -> Dict[str, Any]:
+    """Validate a bulk request body into create_promo_codes_bulk keyword arguments."""
+    try:
+        count = int(data.get('count', 0))
+        percentage = float(data.get('added_tnc_percentage', 10))
+        length = int(data.get('length', PROMO_CODE_LENGTH))
+        start_date = datetime.fromisoformat(data['start_date']) if data.get('start_date') else datetime.now()
+        end_date = (datetime.fromisoformat(data['end_date']) if data.get('end_date')
+                    else start_date + timedelta(days=int(data.get('days', 365))))
+        creator_id = int(data.get('creator_id', default_creator_id))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid bulk promo request: {e}")
+    if not 0 < count <= PROMO_BULK_MAX:
+        raise ValueError(f"count must be between 1 and {PROMO_BULK_MAX}")
+    if not 0 < percentage <= 100:
+        raise ValueError("added_tnc_percentage must be between 0 and 100")
+    if not 6 <= length <= 32:
+        raise ValueError("length must be between 6 and 32")
+    if end_date <= start_date:
+        raise ValueError("end_date must be after start_date")
+    return {'count': count, 'added_tnc_percentage': percentage, 'start_date': start_date,
+            'end_date': end_date, 'creator_id': creator_id, 'length': length}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate promo codes for a campaign.")
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--creator-id', type=int, required=True)
+    parser.add_argument('--percentage', type=float, default=10)
+    parser.add_argument('--days', type=int, default=365, help="validity from now, in days")
+    parser.add_argument('--length', type=int, default=PROMO_CODE_LENGTH)
+    args = parser.parse_args(argv)
+
+    try:
+        campaign = parse_bulk_request({'count': args.count, 'added_tnc_percentage': args.percentage,
+                                       'days': args.days, 'length': args.length}, args.creator_id)
+    except ValueError as e:
+        parser.error(str(e))
+    codes, error = create_promo_codes_bulk(**campaign)
+    sys.stdout.write(''.join(f"{code}\n" for code in codes))
+    if error:
+        sys.exit(f"Stopped after {len(codes)} codes: {error}")
+
+
+if __name__ == '__main__':
+    main()
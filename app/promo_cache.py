@@ -0,0 +1,190 @@
+"""In-memory promo code lookups: a Bloom filter of existing codes plus a TTL metadata cache.
+
+The filter answers "this code was never created" without touching the
+database. It is loaded in the background on first use, then kept current by
+an incremental sync on ``created_at`` at most every PROMO_BLOOM_SYNC_SECONDS
+and by codes created in this process. Until it is loaded every lookup falls
+through to the database. A code created by another worker is seen here
+after the next sync.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+import pymysql
+from bitarray import bitarray
+
+from . import metrics
+from .cache import LRUCache
+from .db_schema import register_schema
+from .db_setup import get_db_connection
+
+PROMO_BLOOM_CAPACITY = int(os.getenv('PROMO_BLOOM_CAPACITY', 1_000_000))
+PROMO_BLOOM_ERROR_RATE = float(os.getenv('PROMO_BLOOM_ERROR_RATE', 0.001))
+PROMO_BLOOM_SYNC_SECONDS = float(os.getenv('PROMO_BLOOM_SYNC_SECONDS', 5))
+PROMO_BLOOM_REBUILD_SECONDS = float(os.getenv('PROMO_BLOOM_REBUILD_SECONDS', 3600))
+PROMO_CACHE_TTL = float(os.getenv('PROMO_CACHE_TTL_SECONDS', 30))
+PROMO_CACHE_SIZE = int(os.getenv('PROMO_CACHE_SIZE', 10000))
+
+register_schema("CREATE INDEX idx_promo_codes_created_at ON promo_codes (created_at)")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bitarray(self.size)
+        self.bits.setall(0)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position] = 1
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position] for position in self._positions(item))
+
+
+class PromoCodeFilter:
+    def __init__(self):
+        self._filter: Optional[BloomFilter] = None
+        self._loading = False
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced_until: Optional[datetime] = None
+        self._last_sync = 0.0
+        self._loaded_at = 0.0
+        self._load_attempted = 0.0
+        self.rejected = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def _load(self) -> None:
+        """Build a fresh filter from every code, then swap it in."""
+        bloom = BloomFilter(PROMO_BLOOM_CAPACITY, PROMO_BLOOM_ERROR_RATE)
+        connection = get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT NOW() AS now")
+                started_at = cursor.fetchone()['now']
+            # Stream the codes instead of materialising the whole table client-side
+            with connection.cursor(pymysql.cursors.SSDictCursor) as cursor:
+                cursor.execute("SELECT code FROM promo_codes")
+                for row in cursor:
+                    bloom.add(row['code'])
+        finally:
+            connection.close()
+        with self._lock:
+            self._filter = bloom
+            self._synced_until = started_at
+            self._loaded_at = self._last_sync = time.monotonic()
+        if bloom.count > PROMO_BLOOM_CAPACITY:
+            logging.warning(f"Promo Bloom filter holds {bloom.count} codes, above PROMO_BLOOM_CAPACITY")
+        logging.info(f"Promo Bloom filter loaded with {bloom.count} codes")
+
+    def _load_in_background(self) -> None:
+        def run():
+            try:
+                self._load()
+            except Exception as e:
+                logging.error(f"Loading promo Bloom filter failed: {e}")
+            finally:
+                self._loading = False
+        with self._lock:
+            # One load at a time, and no hammering while the database is unreachable
+            if self._loading or time.monotonic() - self._load_attempted < PROMO_BLOOM_SYNC_SECONDS:
+                return
+            self._loading = True
+            self._load_attempted = time.monotonic()
+        threading.Thread(target=run, name='promo-bloom-load', daemon=True).start()
+
+    def _sync(self) -> None:
+        """Add codes created since the last sync (with overlap, re-adding is harmless)."""
+        connection = get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT NOW() AS now")
+                now = cursor.fetchone()['now']
+                cursor.execute("SELECT code FROM promo_codes WHERE created_at >= %s",
+                               (self._synced_until - timedelta(seconds=PROMO_BLOOM_SYNC_SECONDS),))
+                codes = [row['code'] for row in cursor.fetchall()]
+        finally:
+            connection.close()
+        with self._lock:
+            for code in codes:
+                self._filter.add(code)
+            self._synced_until = now
+            self._last_sync = time.monotonic()
+
+    def refresh(self) -> None:
+        """Load, rebuild or sync as due; cheap when nothing is due."""
+        now = time.monotonic()
+        if not self.ready or now - self._loaded_at > PROMO_BLOOM_REBUILD_SECONDS:
+            # Rebuilds also drop codes that were archived or deleted
+            self._load_in_background()
+            if not self.ready:
+                return
+        if now - self._last_sync > PROMO_BLOOM_SYNC_SECONDS and self._sync_lock.acquire(blocking=False):
+            try:
+                self._sync()
+            except Exception as e:
+                logging.error(f"Syncing promo Bloom filter failed: {e}")
+            finally:
+                self._sync_lock.release()
+
+    def might_exist(self, code: str) -> bool:
+        self.refresh()
+        with self._lock:
+            if self._filter is None:
+                return True
+            present = code in self._filter
+        if not present:
+            self.rejected += 1
+        return present
+
+    def add(self, code: str) -> None:
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(code)
+
+    def stats(self) -> Dict[str, Any]:
+        bloom = self._filter
+        return {
+            'ready': bloom is not None,
+            'codes': bloom.count if bloom else 0,
+            'bits': bloom.size if bloom else 0,
+            'hashes': bloom.hashes if bloom else 0,
+            'rejected_lookups': self.rejected,
+        }
+
+
+promo_filter = PromoCodeFilter()
+promo_metadata = LRUCache(maxsize=PROMO_CACHE_SIZE, ttl=PROMO_CACHE_TTL)
+metrics.register_collector('caches', 'promo_bloom', promo_filter.stats)
+metrics.register_collector('caches', 'promo_metadata', promo_metadata.stats)
+
+
+def remember_promo_code(code: str) -> None:
+    """Make a newly created code visible to this process' filter immediately."""
+    promo_filter.add(code)
+
+
+def invalidate_promo_code(code: str) -> None:
+    """Drop cached metadata once a code is redeemed (or otherwise changed)."""
+    promo_metadata.pop(code)
@@ -1,4 +1,5 @@
 import random
+import secrets
 import string
 import re 
 from dotenv import load_dotenv
@@ -46,9 +47,18 @@ def generate_token(user_id, is_superuser, role):
         'exp': datetime.utcnow() + timedelta(hours=1)
     }
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+PROMO_CODE_ALPHABET = string.ascii_uppercase + string.digits
+PROMO_CODE_LENGTH = int(os.getenv('PROMO_CODE_LENGTH', 8))
+
+
+def random_promo_code(length=PROMO_CODE_LENGTH) -> str:
+    """Draw a promo code from the OS CSPRNG so codes cannot be predicted."""
+    return ''.join(secrets.choice(PROMO_CODE_ALPHABET) for _ in range(length))
+
+
 def generate_promo_code():
 
-    promo_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+    promo_code = random_promo_code()
     added_tnc_percentage = 10.00
     start_date = datetime.now()
     end_date = start_date + timedelta(days=365)
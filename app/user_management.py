@@ -2,14 +2,23 @@ from typing import Dict, Optional, Union, Tuple, List, Any
 from werkzeug.security import generate_password_hash, check_password_hash
 from .db_setup import get_db_connection
 from .self_utils import generate_token
+from .db_schema import register_schema
+from .cache import LRUCache
+from . import metrics
+from .money import Money, to_fraction
+from .bonus_accruals import accrue_bonus
+from eth_account import Account
+from eth_account.messages import encode_defunct
 import pymysql
 import logging
 import os
+import secrets
 import uuid
+import base64
 import re
 from dotenv import load_dotenv
 from datetime import datetime
-from decimal import Decimal
+from fractions import Fraction
 
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,10 +29,202 @@ load_dotenv()
 # Define path for default profile picture
 DEFAULT_PICTURE_PATH = os.path.join(os.path.dirname(__file__), 'static', 'images', 'default_profile_picture_.png')
 
+PROMO_PAGE_SIZE = int(os.getenv('PROMO_PAGE_SIZE', 50))
+PROMO_PAGE_MAX = 500
+
+# Wallet addresses are stored lower-cased so lookups hit the unique index directly
+register_schema("""
+    CREATE TABLE IF NOT EXISTS user_wallets (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        wallet_address VARCHAR(100) NOT NULL,
+        chain_id VARCHAR(20) NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_user_wallets_address (wallet_address),
+        KEY idx_user_wallets_user (user_id)
+    )
+""")
+
+# One outstanding sign-in nonce per address; a wallet is only linked or logged
+# in with after its owner signs the nonce message (EIP-191 personal_sign)
+WALLET_NONCE_TTL = int(os.getenv('WALLET_NONCE_TTL_SECONDS', 300))
+register_schema("""
+    CREATE TABLE IF NOT EXISTS wallet_nonces (
+        wallet_address VARCHAR(100) PRIMARY KEY,
+        nonce CHAR(32) NOT NULL,
+        expires_at DATETIME NOT NULL
+    )
+""")
+
+# Only positive hits are cached: a wallet linked in another worker must not be masked
+wallet_owner_cache = LRUCache(maxsize=int(os.getenv('WALLET_OWNER_CACHE_SIZE', 50000)))
+metrics.register_collector('caches', 'wallet_owner', wallet_owner_cache.stats)
+
+
+
+def normalize_wallet_address(wallet_address: str) -> str:
+    """Canonical form used for storage and lookups (checksum casing is ignored)."""
+    return wallet_address.strip().lower()
+
+
+def get_user_id_by_wallet_address(wallet_address: str) -> Optional[int]:
+    """Resolve the user owning a wallet address, from cache or one indexed lookup.
+
+    Database errors propagate, so callers can tell "not linked" from "lookup failed".
+    """
+    if not wallet_address:
+        return None
+    address = normalize_wallet_address(wallet_address)
+    user_id = wallet_owner_cache.get(address)
+    if user_id is not None:
+        return user_id
+    connection = None
+    try:
+        connection = get_db_connection()
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute("SELECT user_id FROM user_wallets WHERE wallet_address = %s", (address,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        wallet_owner_cache.set(address, row["user_id"])
+        return row["user_id"]
+    finally:
+        if connection:
+            connection.close()
+
 
+def wallet_proof_message(wallet_address: str, nonce: str) -> str:
+    """The exact text the wallet owner signs to prove control of the address."""
+    return f"Sign this message to connect {wallet_address} to Tanacoin.\nNonce: {nonce}"
 
-def register_user(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
-    """Register a new user with the provided data."""
+
+def issue_wallet_nonce(wallet_address: str) -> Optional[str]:
+    """Store a fresh single-use nonce for the address and return the message to sign."""
+    address = normalize_wallet_address(wallet_address)
+    nonce = secrets.token_hex(16)
+    connection = None
+    try:
+        connection = get_db_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                REPLACE INTO wallet_nonces (wallet_address, nonce, expires_at)
+                VALUES (%s, %s, NOW() + INTERVAL %s SECOND)
+            """, (address, nonce, WALLET_NONCE_TTL))
+        connection.commit()
+        return wallet_proof_message(address, nonce)
+    except pymysql.MySQLError as e:
+        logging.error(f"Error issuing wallet nonce: {e}")
+        return None
+    finally:
+        if connection:
+            connection.close()
+
+
+def verify_wallet_signature(wallet_address: str, signature: str) -> bool:
+    """Check that `signature` signs the address' current nonce message; the nonce is consumed either way."""
+    if not wallet_address or not signature:
+        return False
+    address = normalize_wallet_address(wallet_address)
+    connection = None
+    try:
+        connection = get_db_connection()
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute("""
+                SELECT nonce FROM wallet_nonces
+                WHERE wallet_address = %s AND expires_at > NOW()
+                FOR UPDATE
+            """, (address,))
+            row = cursor.fetchone()
+            cursor.execute("DELETE FROM wallet_nonces WHERE wallet_address = %s", (address,))
+        connection.commit()
+    except pymysql.MySQLError as e:
+        logging.error(f"Error checking wallet nonce: {e}")
+        return False
+    finally:
+        if connection:
+            connection.close()
+    if not row:
+        return False
+    try:
+        signer = Account.recover_message(encode_defunct(text=wallet_proof_message(address, row["nonce"])),
+                                         signature=signature)
+    except Exception as e:
+        logging.info(f"Rejected wallet signature for {address}: {e}")
+        return False
+    return normalize_wallet_address(signer) == address
+
+
+def link_wallet_address(user_id: int, wallet_address: str, chain_id: Optional[str] = None,
+                        connection=None) -> Tuple[bool, str]:
+    """Link a wallet address to a user; pass a connection to join the caller's transaction.
+
+    Callers must have proven ownership with verify_wallet_signature first.
+    """
+    address = normalize_wallet_address(wallet_address)
+    own_connection = connection is None
+    try:
+        if own_connection:
+            connection = get_db_connection()
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute("SELECT user_id FROM user_wallets WHERE wallet_address = %s", (address,))
+            row = cursor.fetchone()
+            if row and row["user_id"] != user_id:
+                return False, "Wallet address is already linked to another account."
+            if not row:
+                cursor.execute(
+                    "INSERT INTO user_wallets (user_id, wallet_address, chain_id) VALUES (%s, %s, %s)",
+                    (user_id, address, chain_id))
+        if own_connection:
+            connection.commit()
+        wallet_owner_cache.pop(address)
+        return True, "Wallet linked successfully."
+    except pymysql.MySQLError as e:
+        if own_connection and connection:
+            connection.rollback()
+        logging.error(f"Error linking wallet: {e}")
+        return False, f"Database error: {e}"
+    finally:
+        if own_connection and connection:
+            connection.close()
+
+
+def get_user_login_details(user_id: int) -> Optional[Dict[str, Any]]:
+    """Fetch the fields returned to the client on login."""
+    connection = None
+    try:
+        connection = get_db_connection()
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute("""
+                SELECT u.id, u.email, u.first_name, u.last_name,
+                       COALESCE(p.id_verified, FALSE) as id_verified,
+                       COALESCE(u.is_superuser, 0) as is_superuser
+                FROM users u
+                LEFT JOIN user_profiles p ON u.id = p.user_id
+                WHERE u.id = %s
+            """, (user_id,))
+            user = cursor.fetchone()
+            if not user:
+                return None
+            return {
+                "user_id": user["id"],
+                "email": user["email"],
+                "first_name": user["first_name"],
+                "last_name": user["last_name"],
+                "id_verified": bool(user["id_verified"]),
+                "is_superuser": bool(user["is_superuser"]),
+                "role": "superuser" if user["is_superuser"] else "user"
+            }
+    except pymysql.MySQLError as e:
+        logging.error(f"Error fetching login details: {e}")
+        return None
+    finally:
+        if connection:
+            connection.close()
+
+
+def register_user(data: Dict[str, Any], verified_wallet_address: Optional[str] = None,
+                  chain_id: Optional[str] = None) -> Tuple[Dict[str, Any], int]:
+    """Register a new user, linking a wallet whose signature the caller has already verified."""
     connection = None
     try:
         with open(DEFAULT_PICTURE_PATH, 'rb') as f:
@@ -78,6 +279,12 @@ def register_user(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
             is_superuser = bool(is_superuser_row["is_superuser"]) if is_superuser_row else False
             role = "superuser" if is_superuser else "user"
 
+            if verified_wallet_address:
+                linked, message = link_wallet_address(user_id, verified_wallet_address, chain_id, connection)
+                if not linked:
+                    connection.rollback()
+                    return {"message": message}, 400
+
             connection.commit()
 
             # KYC document handling can be added here if needed
@@ -155,6 +362,25 @@ def check_credentials(identifier: str, password: str) -> Optional[Dict[str, Any]
         if connection:
             connection.close()
 
+def login_with_wallet(verified_wallet_address: str) -> Tuple[Dict[str, Any], int]:
+    """Log in the owner of a wallet whose signature the caller has already verified."""
+    try:
+        user_id = get_user_id_by_wallet_address(verified_wallet_address)
+        user = get_user_login_details(user_id) if user_id else None
+        if not user:
+            return {"message": "No account linked to this wallet."}, 404
+        token = generate_token(user["user_id"], user["is_superuser"], user["role"])
+        return {
+            "message": "Login successful!",
+            "token": token,
+            "user": user,
+            "is_superuser": user["is_superuser"],
+            "role": user["role"]
+        }, 200
+    except Exception as e:
+        logging.error(f"Wallet login error: {e}")
+        return {"message": "An unexpected error occurred."}, 500
+
 def login_user(**kwargs) -> Tuple[Dict[str, Any], int]:
     """Handle user login with email and password."""
     try:
@@ -308,50 +534,83 @@ def change_password(user_id: int, new_password: str) -> bool:
         if connection:
             connection.close()
 
-def get_promo_codes_by_creator(creator_id: int) -> Optional[List[Dict[str, Any]]]:
-    """Retrieve promo codes created by a specific user."""
+def _encode_promo_cursor(row: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(f"{row['created_at'].isoformat()}|{row['code']}".encode()).decode()
+
+
+def _decode_promo_cursor(cursor_token: str) -> Tuple[datetime, str]:
+    created_at, code = base64.urlsafe_b64decode(cursor_token.encode()).decode().split('|', 1)
+    return datetime.fromisoformat(created_at), code
+
+
+def get_promo_codes_by_creator(creator_id: int, limit: Optional[int] = None,
+                               cursor_token: Optional[str] = None) -> Optional[Tuple[List[Dict[str, Any]], Optional[str]]]:
+    """Retrieve a creator's promo codes, newest first, archived ones included.
+
+    Without a limit or cursor every code is returned. Paging is opt-in: pass a
+    limit (or a cursor, which defaults the limit to PROMO_PAGE_SIZE) to get
+    (codes, next_cursor) and pass next_cursor back for the following page.
+    """
     connection = None
-    cursor = None
+    if limit is None and cursor_token:
+        limit = PROMO_PAGE_SIZE
+    if limit is not None:
+        limit = max(1, min(limit, PROMO_PAGE_MAX))
     try:
+        keyset, params = "", [creator_id]
+        if cursor_token:
+            created_at, code = _decode_promo_cursor(cursor_token)
+            keyset = "AND (created_at < %s OR (created_at = %s AND code < %s))"
+            params += [created_at, created_at, code]
         connection = get_db_connection()
-        cursor = connection.cursor(pymysql.cursors.DictCursor)
-        cursor.callproc('GetPromoCodesByCreator', (creator_id,))
-        result = cursor.fetchall()
-        if not result:
+        rows = []
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            # Same keyset on both tables, then merged; each side reads at most one page
+            for table, archived in (("promo_codes", False), ("promo_codes_archive", True)):
+                cursor.execute(f"""
+                    SELECT code, added_tnc_percentage, start_date, end_date, spender_id, created_at
+                    FROM {table}
+                    WHERE creator_id = %s {keyset}
+                    ORDER BY created_at DESC, code DESC
+                    {"LIMIT %s" if limit is not None else ""}
+                """, params + ([limit + 1] if limit is not None else []))
+                rows += [dict(row, archived=archived) for row in cursor.fetchall()]
+        rows.sort(key=lambda row: (row['created_at'], row['code']), reverse=True)
+        if limit is None:
+            return rows, None
+        page = rows[:limit]
+        next_cursor = _encode_promo_cursor(page[-1]) if len(rows) > limit else None
+        if not page:
             logging.info(f"No promo codes found for creator_id {creator_id}.")
-            return []
-        return result
+        return page, next_cursor
+    except (ValueError, UnicodeDecodeError) as e:
+        logging.error(f"Invalid promo code cursor: {e}")
+        raise ValueError("Invalid cursor")
     except pymysql.MySQLError as e:
         logging.error(f"Error retrieving promo codes: {e}")
         return None
     finally:
-        if cursor:
-            cursor.close()
         if connection:
             connection.close()
 
-def add_bonus_to_creator(tanacoin_purchased: Decimal, added_percentage: Decimal, creator_id: int) -> None:
-    """Add a bonus to the creator's wallet balance based on the promo code usage."""
+def add_bonus_to_creator(tanacoin_purchased: Money, added_percentage: Fraction, creator_id: int,
+                         reference: Optional[str] = None) -> None:
+    """Queue the creator's bonus for a promo code purchase; it is credited on the next flush."""
     connection = None
     cursor = None
     try:
-        tanacoin_value_without_promo = tanacoin_purchased / (1 + added_percentage / Decimal(100))
+        tanacoin_value_without_promo = tanacoin_purchased.scale(1 / (1 + to_fraction(added_percentage) / 100))
         tanacoin_bonus = tanacoin_purchased - tanacoin_value_without_promo
         logging.debug(f"Calculated bonus: {tanacoin_bonus} for creator_id: {creator_id}")
 
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute("""
-            UPDATE tnc_wallets
-            SET balance = balance + %s
-            WHERE user_id = %s
-        """, (float(tanacoin_bonus), creator_id))
-        connection.commit()
-
-        if cursor.rowcount > 0:
-            logging.info(f"Bonus of {tanacoin_bonus} added to creator {creator_id}'s balance.")
+        # Bonuses are coalesced per creator by the accrual flush instead of touching the wallet here
+        if accrue_bonus(cursor, creator_id, tanacoin_bonus, reference):
+            logging.info(f"Bonus of {tanacoin_bonus} queued for creator {creator_id}.")
         else:
-            logging.warning(f"Creator {creator_id} not found or balance update failed.")
+            logging.info(f"Bonus for {reference} was already queued for creator {creator_id}.")
+        connection.commit()
     except pymysql.MySQLError as e:
         if connection:
             connection.rollback()
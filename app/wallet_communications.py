@@ -1,21 +1,97 @@
-from web3 import Web3
 from .db_setup import get_db_connection
 from dotenv import load_dotenv
 import os
 from .handle_token import get_tanacoin_rate
+from .user_management import get_user_id_by_wallet_address
 import requests
-from decimal import Decimal  # Importing Decimal for accurate fixed-point arithmetic
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from .money import Money, to_fraction
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .db_schema import register_schema
+from .cache import LRUCache, SingleFlight
+from . import metrics
+from .background import register_periodic
+from .bonus_accruals import accrue_bonus
+from .ledger import append_entries, get_wallet_id
+from .promo_cache import invalidate_promo_code
+from .btc_providers import BtcRequestScheduler, SchedulerBusy, create_btc_provider
+from .eth_rpc import JsonRpcError, MultiEndpointClient, RpcBatcher, decode_usdt_transfer, get_transaction_bundle, hex_to_int
 
 load_dotenv()
 INFURA_PROJECT_ID = os.getenv('INFURA_PROJECT_ID')
 USDT_CONTRACT_ADDRESS = '0xdac17f958d2ee523a2206206994597c13d831ec7'
-TRANSFER_SIGNATURE = bytes.fromhex('a9059cbb')
 RECEIVER_ADDRESS = os.getenv('RECEIVER_ADDRESS')
 RECEIVER_BTC_ADDRESS=  os.getenv('RECEIVER_BTC_ADDRESS')
 RECEIVER_USDT_ADDRESS=  os.getenv('RECEIVER_USDT_ADDRESS')
 BLOCKCYPHER_API_BASE_URL = "https://api.blockcypher.com/v1/btc/main"
+PROVIDER_TIMEOUT = float(os.getenv('PROVIDER_TIMEOUT_SECONDS', 5))
+REQUIRED_ETH_CONFIRMATIONS = int(os.getenv('REQUIRED_ETH_CONFIRMATIONS', 12))
+REQUIRED_BTC_CONFIRMATIONS = int(os.getenv('REQUIRED_BTC_CONFIRMATIONS', 3))
+RATE_CACHE_SECONDS = float(os.getenv('RATE_CACHE_SECONDS', 30))
+# store_transaction_in_db message for a sender with no linked account (not a transient failure)
+NO_LINKED_USER = "No user found with provided wallet ID."
+# ... and for a payment submitted by someone other than the sender's account owner
+SENDER_NOT_BUYER = "Transaction was not sent from a wallet linked to your account."
+# validate_transaction message for a payment to an address that is not one of ours
+WRONG_RECEIVER = "Invalid Transaction receiver address and expected receiver address do not match"
+# ... and for a transaction that pays nothing to anyone, such as a contract creation
+NOT_A_PAYMENT = "Transaction is not a payment to us."
+# Errors no later lookup can change: verification jobs fail on them instead of retrying
+TERMINAL_PAYMENT_ERRORS = (SENDER_NOT_BUYER, WRONG_RECEIVER, NOT_A_PAYMENT)
+# promo_error when a payment was already credited (e.g. by the block scanner) and the code cannot be added
+PROMO_AFTER_CREDIT = "Promo code not applied: this payment was already credited without it."
 infura_url = INFURA_PROJECT_ID
-web3 = Web3(Web3.HTTPProvider(infura_url))
+# Reads go to the best of ETH_RPC_URLS; concurrent lookups in this worker share batches
+eth_client = MultiEndpointClient.from_env(infura_url, timeout=PROVIDER_TIMEOUT)
+eth_batcher = RpcBatcher(eth_client)
+
+# Every credited tx hash, whichever path (job worker or block scanner) found it, with what it credited
+register_schema("""
+    CREATE TABLE IF NOT EXISTS credited_payments (
+        tx_hash VARCHAR(100) PRIMARY KEY,
+        currency VARCHAR(10) NOT NULL,
+        user_id INT NULL,
+        tanacoin_credited DECIMAL(30, 8) NULL,
+        promo_code VARCHAR(32) NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+""",
+    "ALTER TABLE credited_payments ADD COLUMN user_id INT NULL",
+    "ALTER TABLE credited_payments ADD COLUMN tanacoin_credited DECIMAL(30, 8) NULL",
+    "ALTER TABLE credited_payments ADD COLUMN promo_code VARCHAR(32) NULL",
+)
+
+# One breaker per upstream provider so a degraded dependency fails fast
+coingecko_breaker = CircuitBreaker.from_env('coingecko')
+blockcypher_breaker = CircuitBreaker.from_env('blockcypher')
+infura_breaker = CircuitBreaker.from_env('infura', excluded_exceptions=(JsonRpcError,))
+
+# Single-flight lookups per tx hash and submitter, with confirmed/failed outcomes memoized
+TERMINAL_PAYMENT_STATUSES = ("confirmed", "failed")
+payment_lookups = SingleFlight()
+terminal_payment_results = LRUCache(maxsize=int(os.getenv('PAYMENT_RESULT_CACHE_SIZE', 10000)))
+metrics.register_collector('caches', 'terminal_payment_results', terminal_payment_results.stats)
+
+# Tanacoin rates and the /api/rates quote table, rebuilt together on every refresh
+_rate_quotes = {"rates": None, "table": None, "body": None, "etag": None, "expires_at": 0.0}
+_rate_quotes_lock = threading.Lock()
+rate_refreshes = SingleFlight()
+
+btc_scheduler = BtcRequestScheduler(create_btc_provider(BLOCKCYPHER_API_BASE_URL, PROVIDER_TIMEOUT),
+                                    call_wrapper=blockcypher_breaker.call)
+
+
+def _provider_get(url):
+    """GET an upstream API, treating throttling and server errors as provider failures."""
+    response = requests.get(url, timeout=PROVIDER_TIMEOUT)
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    return response
 
 
 def get_coin_gecko_rates():
@@ -23,16 +99,17 @@ def get_coin_gecko_rates():
         print("Fetching CoinGecko rates for BTC, ETH, and USDT in EUR.")
         
         # Call CoinGecko API for BTC, ETH, and USDT in EUR
-        response = requests.get(
+        response = coingecko_breaker.call(
+            _provider_get,
             'https://api.coingecko.com/api/v3/simple/price?ids=bitcoin,ethereum,tether&vs_currencies=eur'
         )
         response.raise_for_status()  # Raise an error for bad status codes
-        data = response.json()
+        data = response.json(parse_float=Decimal)  # keep the quoted digits exactly
         print('data', data)
         
-        btc_rate_eur = Decimal(data['bitcoin']['eur'])  # data {'bitcoin': {'eur': 90918}, 'ethereum': {'eur': 3253.09}, 'tether': {'eur': 0.957796}}
-        eth_rate_eur = Decimal(data['ethereum']['eur'])  # ETH to EUR rate (convert to Decimal)
-        usdt_rate_eur = Decimal(data['tether']['eur'])  # USDT to EUR rate (convert to Decimal)
+        btc_rate_eur = to_fraction(data['bitcoin']['eur'])  # data {'bitcoin': {'eur': 90918}, 'ethereum': {'eur': 3253.09}, 'tether': {'eur': 0.957796}}
+        eth_rate_eur = to_fraction(data['ethereum']['eur'])  # ETH to EUR rate
+        usdt_rate_eur = to_fraction(data['tether']['eur'])  # USDT to EUR rate
 
         print(f"Fetched rates: BTC = {btc_rate_eur} EUR, ETH = {eth_rate_eur} EUR, USDT = {usdt_rate_eur} EUR")
         
@@ -42,7 +119,7 @@ def get_coin_gecko_rates():
         return None, None, None
 
 
-def get_tanacoin_rates_in_crypto():
+def compute_tanacoin_rates():
     print("Fetching Tanacoin rates in EUR, ETH, USDT, and BTC.")
     
     # Fetch Tanacoin rate in EUR from the database
@@ -53,7 +130,7 @@ def get_tanacoin_rates_in_crypto():
         return None, None, None, None  # Return None if Tanacoin info is not available
     
     try:
-        tanacoin_rate_eur = Decimal(tanacoin_info)  # Convert Tanacoin rate to Decimal
+        tanacoin_rate_eur = to_fraction(tanacoin_info)  # Exact EUR price of one Tanacoin
         print(f"Tanacoin rate in EUR: {tanacoin_rate_eur}")
     except (ValueError, TypeError):
         print("Invalid Tanacoin rate format. Ensure it's a valid number.")
@@ -64,6 +141,8 @@ def get_tanacoin_rates_in_crypto():
          
         btc_rate_eur, eth_rate_eur, usdt_rate_eur = get_coin_gecko_rates()
         print(f"Rates: ETH={eth_rate_eur}, USDT={usdt_rate_eur}, BTC={btc_rate_eur}")
+    except CircuitOpenError:
+        raise
     except Exception as e:
         print(f"Error fetching rates from CoinGecko: {e}")
         return None, None, None, None
@@ -78,28 +157,124 @@ def get_tanacoin_rates_in_crypto():
         return None, None, None, None
 
     # Convert the Tanacoin rate in EUR to ETH, USDT, and BTC
-    tanacoin_rate_eth = tanacoin_rate_eur / Decimal(eth_rate_eur)
-    tanacoin_rate_usdt = tanacoin_rate_eur / Decimal(usdt_rate_eur)
-    tanacoin_rate_btc = tanacoin_rate_eur / Decimal(btc_rate_eur)
+    tanacoin_rate_eth = tanacoin_rate_eur / eth_rate_eur
+    tanacoin_rate_usdt = tanacoin_rate_eur / usdt_rate_eur
+    tanacoin_rate_btc = tanacoin_rate_eur / btc_rate_eur
 
-    print(f"Converted Tanacoin rates: {tanacoin_rate_eth} ETH, {tanacoin_rate_usdt} USDT, {tanacoin_rate_btc} BTC")
+    print(f"Converted Tanacoin rates: {float(tanacoin_rate_eth)} ETH, {float(tanacoin_rate_usdt)} USDT, {float(tanacoin_rate_btc)} BTC")
     
     return tanacoin_rate_eur, tanacoin_rate_eth, tanacoin_rate_usdt, tanacoin_rate_btc
 
+
+def get_active_promo_percentages():
+    """Distinct bonus percentages of promo codes that can still be redeemed."""
+    connection = None
+    try:
+        connection = get_db_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT added_tnc_percentage FROM promo_codes
+                WHERE spender_id IS NULL AND end_date >= NOW()
+            """)
+            return sorted(Decimal(row['added_tnc_percentage']) for row in cursor.fetchall())
+    except Exception as e:
+        print(f"Error fetching promo percentages: {e}")
+        return []
+    finally:
+        if connection:
+            connection.close()
+
+
+def build_quote_table(rates, promo_percentages):
+    """Price of one Tanacoin per currency, plus the effective price with each promo bonus."""
+    currencies = dict(zip(("EUR", "ETH", "USDT", "BTC"), rates))
+    promo = {}
+    for percentage in promo_percentages:
+        factor = 1 + to_fraction(percentage) / 100
+        promo[str(percentage)] = {currency: str(Money.from_fraction(price / factor, currency))
+                                  for currency, price in currencies.items()}
+    return {
+        "computed_at": datetime.now(timezone.utc).isoformat(),
+        "ttl_seconds": RATE_CACHE_SECONDS,
+        "tanacoin_price": {currency: str(Money.from_fraction(price, currency)) for currency, price in currencies.items()},
+        "promo_price": promo,
+    }
+
+
+def refresh_rate_quotes():
+    """Recompute the rates and rebuild the quote table; returns the rates tuple."""
+    rates = compute_tanacoin_rates()
+    if rates[0] is None:
+        return rates
+    table = build_quote_table(rates, get_active_promo_percentages())
+    body = json.dumps(table, sort_keys=True)
+    # Hash the prices only: computed_at changes on every refresh even when nothing else did
+    prices = json.dumps({key: value for key, value in table.items() if key != "computed_at"}, sort_keys=True)
+    with _rate_quotes_lock:
+        _rate_quotes.update(rates=rates, table=table, body=body,
+                            etag=hashlib.sha1(prices.encode()).hexdigest(),
+                            expires_at=time.monotonic() + RATE_CACHE_SECONDS)
+    metrics.inc('rate_quote_refreshes')
+    return rates
+
+
+def get_tanacoin_rates_in_crypto():
+    """(EUR, ETH, USDT, BTC) price of one Tanacoin as exact Fractions, cached for RATE_CACHE_SECONDS.
+
+    Concurrent callers during a refresh share the single upstream fetch.
+    """
+    with _rate_quotes_lock:
+        if _rate_quotes["rates"] and _rate_quotes["expires_at"] > time.monotonic():
+            return _rate_quotes["rates"]
+    return rate_refreshes.do('rates', refresh_rate_quotes)
+
+
+def get_rate_quotes():
+    """Return (json_body, etag, max_age) for the current quote table, or (None, None, 0).
+
+    The etag is the bare digest; the HTTP layer quotes it.
+    """
+    try:
+        get_tanacoin_rates_in_crypto()
+    except CircuitOpenError as e:
+        print(f"Serving last known quotes, rates unavailable: {e}")
+    with _rate_quotes_lock:
+        max_age = max(0, int(_rate_quotes["expires_at"] - time.monotonic()))
+        return _rate_quotes["body"], _rate_quotes["etag"], max_age
+
+
+# Keep the quote table warm so price requests never wait on CoinGecko
+register_periodic('rate-quotes', RATE_CACHE_SECONDS, refresh_rate_quotes)
+
+def provider_unavailable(error):
+    """Status returned while an upstream provider's circuit is open."""
+    return {
+        "status": "unavailable",
+        "message": f"{error.name} is temporarily unavailable, please retry later",
+        "retry_after": max(1, int(error.retry_after)),
+    }
+
 # Updated get_btc_transaction_status function
-def get_btc_transaction_status(tx_hash: str, added_percentage=0):  # Default value is now 0
+def get_btc_transaction_status(tx_hash: str, promo_code=None, buyer_id=None):
     try:
         # Check if it's a BTC transaction first
         if tx_hash:  # Assuming a prefix to distinguish BTC transactions
             btc_tx_hash = tx_hash
-            response = requests.get(f"{BLOCKCYPHER_API_BASE_URL}/txs/{btc_tx_hash}")
-            print(response)
+            # Queued behind the provider quota; concurrent polls of one hash share a lookup
+            tx_data = btc_scheduler.get_transaction(btc_tx_hash)
             
-            if response.status_code == 200:
-                tx_data = response.json()
+            if tx_data:
+                confirmations = tx_data.get("confirmations", 0)
+                if confirmations < REQUIRED_BTC_CONFIRMATIONS:
+                    print(f"BTC transaction has {confirmations}/{REQUIRED_BTC_CONFIRMATIONS} confirmations.")
+                    return {"status": "pending", "confirmations": confirmations}
+
                 from_address = tx_data.get("inputs", [{}])[0].get("addresses", ["Unknown"])[0]
-                to_address = tx_data.get("outputs", [{}])[0].get("addresses", ["Unknown"])[0]
-                btc_value = Decimal(tx_data.get("outputs", [{}])[0].get("value", 0)) / Decimal(10 ** 8)  # Convert satoshis to BTC
+                # Credit the output paying us rather than whichever output comes first (often change)
+                outputs = tx_data.get("outputs") or [{}]
+                output = next((o for o in outputs if RECEIVER_BTC_ADDRESS in (o.get("addresses") or [])), outputs[0])
+                to_address = (output.get("addresses") or ["Unknown"])[0]
+                btc_value = Money(output.get("value", 0), "BTC")  # satoshis
                 
                 # Fetch BTC to Tanacoin rate
                 tanacoin_rate_eur, tanacoin_rate_eth, tanacoin_rate_usdt, tanacoin_rate_btc = get_tanacoin_rates_in_crypto()
@@ -108,43 +283,42 @@ def get_btc_transaction_status(tx_hash: str, added_percentage=0):  # Default val
                     print("Tanacoin rate for BTC not available.")
                     return {"status": "error", "message": "Tanacoin rate for BTC not available"}
 
-                # Calculate Tanacoin purchased based on BTC value
-                tanacoin_purchased = btc_value / tanacoin_rate_btc
-
-                # Convert added_percentage to Decimal to ensure it's compatible with other Decimal operations
-                added_percentage = Decimal(added_percentage)
-
-                # Apply the added percentage if it's greater than 0 (meaning no promo code applied)
-                if added_percentage > 0:  # Only apply if the percentage is greater than 0
-                    tanacoin_purchased = tanacoin_purchased * (1 + added_percentage / Decimal(100))  # Apply promo discount
-
+                # Calculate Tanacoin purchased based on BTC value (the promo bonus is added when crediting)
+                tanacoin_purchased = btc_value.exchange(1 / tanacoin_rate_btc, "TNC")
                 print(f"BTC transaction: {btc_value} BTC, {tanacoin_purchased} Tanacoins purchased.")
                 
                 # Validate the transaction
-                validate_transaction(btc_tx_hash, btc_value, "BTC", tanacoin_purchased, from_address, to_address)
+                credited, message, credit = validate_transaction(btc_tx_hash, btc_value, "BTC", tanacoin_purchased,
+                                                                 from_address, to_address, promo_code, buyer_id)
+                if not credited:
+                    return {"status": "error", "message": message}
                 
                 return {
                     "status": "confirmed",
                     "from": from_address,
                     "to": to_address,
                     "value": btc_value,
-                    "tanacoin_purchased": tanacoin_purchased,
-                    "type": "BTC"
+                    "type": "BTC",
+                    **credit
                 }
             else:
-                print(f"BTC transaction not found or invalid transaction hash. Status code: {response.status_code}")
+                print("BTC transaction not found or invalid transaction hash.")
                 return {"status": "error", "message": "BTC transaction not found or invalid transaction hash"}
+    except (CircuitOpenError, SchedulerBusy) as e:
+        print(f"Skipping BTC lookup: {e}")
+        return provider_unavailable(e)
     except Exception as e:
         print(f"Error fetching transaction status: {str(e)}")
         return {"status": "error", "message": f"Error fetching transaction status: {str(e)}"}
 
 
 
-def get_transaction_status(tx_hash: str, added_percentage=0):  # Default value is now 0
+def get_transaction_status(tx_hash: str, promo_code=None, buyer_id=None):
     print(f"Fetching transaction status for tx_hash: {tx_hash}")
     
     try:
-        transaction = web3.eth.get_transaction(tx_hash)
+        # Transaction, receipt and head block travel in one JSON-RPC batch
+        transaction, receipt, latest_block = infura_breaker.call(get_transaction_bundle, eth_batcher, tx_hash)
         print(transaction)
         if not transaction:
             print("Transaction not found or invalid transaction hash.")
@@ -152,7 +326,20 @@ def get_transaction_status(tx_hash: str, added_percentage=0):  # Default value i
         
         from_address = transaction['from']
         to_address = transaction['to']
-        value = Decimal(web3.from_wei(transaction['value'], 'ether'))  # ETH value in the transaction (convert to Decimal)
+        value = Money(hex_to_int(transaction['value']) or 0, 'ETH')  # ETH value in the transaction, in wei
+
+        # Only credit once the transaction is mined, succeeded and is buried deep enough
+        block_number = hex_to_int(transaction.get('blockNumber'))
+        if block_number is None or not receipt:
+            print("Transaction not mined yet.")
+            return {"status": "pending", "confirmations": 0}
+        if hex_to_int(receipt['status']) != 1:
+            print("Transaction failed.")
+            return {"status": "failed", "from": from_address, "to": to_address, "value": value}
+        confirmations = latest_block - block_number + 1
+        if confirmations < REQUIRED_ETH_CONFIRMATIONS:
+            print(f"Transaction has {confirmations}/{REQUIRED_ETH_CONFIRMATIONS} confirmations.")
+            return {"status": "pending", "confirmations": confirmations}
 
         print(f"Transaction details: from={from_address}, to={to_address}, value={value} ETH")
 
@@ -165,109 +352,237 @@ def get_transaction_status(tx_hash: str, added_percentage=0):  # Default value i
             return {"status": "error", "message": "Tanacoin rate not available"}
         
         # Check if it's a USDT transaction
-        if to_address.lower() != USDT_CONTRACT_ADDRESS.lower():
+        usdt_transfer = None
+        if to_address and to_address.lower() == USDT_CONTRACT_ADDRESS.lower():
             input_data = transaction.get('input', '')
             print('input_data', input_data)
-            if input_data.startswith(TRANSFER_SIGNATURE): 
-                print('CHECKING USDT TRANSACTION')  # Compare directly with hex string
-                currency = 'USDT'
-                # Parse the amount of USDT transferred from the raw transaction data
-                usdt_value = web3.to_int(input_data[-32:])
-                # Amount of USDT transferred (raw data, skip function signature)
-                usdt_value = Decimal(usdt_value) / Decimal(10 ** 6)  # USDT has 6 decimals (convert to Decimal)
-                tanacoin_purchased = usdt_value / tanacoin_rate_usdt  # Calculate how many Tanacoins were bought in USDT
-
-                # Convert added_percentage to Decimal to ensure it's compatible with other Decimal operations
-                added_percentage = Decimal(added_percentage)
-
-                # Apply the added percentage if it's greater than 0 (meaning no promo code applied)
-                if added_percentage > 0:  # Only apply if the percentage is greater than 0
-                    tanacoin_purchased = tanacoin_purchased * (1 + added_percentage / Decimal(100))  # Apply promo discount
-                print(f"USDT transaction: {usdt_value} USDT, {tanacoin_purchased} Tanacoins purchased.")
-                validate_transaction(tx_hash, usdt_value, currency, tanacoin_purchased, from_address, to_address)
-                
-                return {
-                    "status": "confirmed",
-                    "from": from_address,
-                    "to": to_address,
-                    "value": usdt_value,
-                    "tanacoin_purchased": tanacoin_purchased,
-                    "type": "USDT"
-                }
+            usdt_transfer = decode_usdt_transfer(input_data)
+        if usdt_transfer:
+            print('CHECKING USDT TRANSACTION')
+            currency = 'USDT'
+            # The contract is the transaction target, the payee is encoded in the call data
+            usdt_recipient, usdt_units = usdt_transfer
+            usdt_value = Money(usdt_units, 'USDT')  # USDT has 6 decimals
+            tanacoin_purchased = usdt_value.exchange(1 / tanacoin_rate_usdt, 'TNC')  # Calculate how many Tanacoins were bought in USDT
+            print(f"USDT transaction: {usdt_value} USDT, {tanacoin_purchased} Tanacoins purchased.")
+            credited, message, credit = validate_transaction(tx_hash, usdt_value, currency, tanacoin_purchased,
+                                                             from_address, usdt_recipient, promo_code, buyer_id)
+            if not credited:
+                return {"status": "error", "message": message}
+            
+            return {
+                "status": "confirmed",
+                "from": from_address,
+                "to": usdt_recipient,
+                "value": usdt_value,
+                "type": "USDT",
+                **credit
+            }
 
         # Check if it's an ETH transaction
         if to_address:
             currency = 'ETH'
             eth_value = value  # ETH value in the transaction
-            tanacoin_purchased = eth_value / tanacoin_rate_eth 
-            
-            # Convert added_percentage to Decimal to ensure it's compatible with other Decimal operations
-            added_percentage = Decimal(added_percentage)
-
-            # Apply the added percentage if it's greater than 0 (meaning no promo code applied)
-            if added_percentage > 0:  # Only apply if the percentage is greater than 0
-                tanacoin_purchased = tanacoin_purchased * (1 + added_percentage / Decimal(100))  # Apply promo discount
+            tanacoin_purchased = eth_value.exchange(1 / tanacoin_rate_eth, 'TNC')
             print(f"ETH transaction: {eth_value} ETH, {tanacoin_purchased} Tanacoins purchased.")
-            validate_transaction(tx_hash, eth_value, currency, tanacoin_purchased, from_address, to_address)
+            credited, message, credit = validate_transaction(tx_hash, eth_value, currency, tanacoin_purchased,
+                                                             from_address, to_address, promo_code, buyer_id)
+            if not credited:
+                return {"status": "error", "message": message}
             
             return {
                 "status": "confirmed",
                 "from": from_address,
                 "to": to_address,
                 "value": eth_value,
-                "tanacoin_purchased": tanacoin_purchased,
-                "type": "ETH"
+                "type": "ETH",
+                **credit
             }
 
-        # If no specific condition matches, we return pending status
-        receipt = web3.eth.get_transaction_receipt(tx_hash)
-        if receipt:
-            if receipt['status'] == 1:
-                print("Transaction confirmed.")
-                return {"status": "confirmed", "from": from_address, "to": to_address, "value": value}
-            else:
-                print("Transaction failed.")
-                return {"status": "failed", "from": from_address, "to": to_address, "value": value}
-        else:
-            print("Transaction pending.")
-            return {"status": "pending", "from": from_address, "to": to_address, "value": value}
+        # Contract creation: nothing was paid to us, so nothing is credited
+        print("Transaction is a contract creation, not a payment.")
+        return {"status": "error", "message": NOT_A_PAYMENT, "from": from_address, "to": to_address, "value": value}
         
+    except CircuitOpenError as e:
+        print(f"Skipping transaction lookup, circuit open: {e}")
+        return provider_unavailable(e)
     except Exception as e:
         print(f"Error fetching transaction status: {str(e)}")
         return {"status": "error", "message": f"Error fetching transaction status: {str(e)}"}
 
 
-def validate_transaction(tx_hash,value ,currency, tanacoin_purchased: Decimal, sender_address: str, expected_receiver_address: str):
+def check_payment(tx_hash: str, payment_method: str, promo_code=None, buyer_id=None):
+    """Look up a payment once per hash and submitter.
+
+    Concurrent callers for the same tx_hash share one in-flight lookup, and
+    terminal outcomes are memoized so repeat polls never reach the chain
+    providers or store_transaction_in_db again. The outcome depends on
+    whether buyer_id sent the payment, so it is keyed by both.
+    """
+    key = (tx_hash, buyer_id)
+    cached = terminal_payment_results.get(key)
+    if cached is not None:
+        metrics.inc('payment_lookup_memo_hits')
+        return dict(cached)
+
+    def lookup():
+        if payment_method == 'BTC':
+            result = get_btc_transaction_status(tx_hash, promo_code, buyer_id)
+        else:
+            result = get_transaction_status(tx_hash, promo_code, buyer_id)
+        if result.get("status") in TERMINAL_PAYMENT_STATUSES:
+            terminal_payment_results.set(key, result)
+        return result
+
+    return dict(payment_lookups.do(key, lookup))
+
+
+def validate_transaction(tx_hash, value: Money, currency, tanacoin_purchased: Money, sender_address: str,
+                         expected_receiver_address: str, promo_code=None, buyer_id=None):
     try:
-        if expected_receiver_address != RECEIVER_ADDRESS or expected_receiver_address != RECEIVER_BTC_ADDRESS or expected_receiver_address != RECEIVER_USDT_ADDRESS:
+        receivers = {a.lower() for a in (RECEIVER_ADDRESS, RECEIVER_BTC_ADDRESS, RECEIVER_USDT_ADDRESS) if a}
+        if not expected_receiver_address or expected_receiver_address.lower() not in receivers:
             print("ERROR WRONG ADDRESS")
-            return {"status": "error", "message": "Invalid Transaction receiver address and expected receiver address do not match"}
+            return False, WRONG_RECEIVER, None
         else:
-            validate_trx = store_transaction_in_db(tx_hash,value,currency,sender_address, tanacoin_purchased)
-            return validate_trx
+            return store_transaction_in_db(tx_hash, value, currency, sender_address, tanacoin_purchased,
+                                           promo_code=promo_code, buyer_id=buyer_id)
         
     except Exception as e:
         print(f"Error in validate_transaction: {str(e)}")
-        return {"status": "error", "message": f"Error in validation: {str(e)}"}
-
-def store_transaction_in_db(tx_hash, value, currency, sender_address, tanacoin_purchased):
-    connection = None
+        return False, f"Error in validation: {str(e)}", None
+
+
+def redeem_promo_code(cursor, promo_code, buyer_id):
+    """Claim a promo code for buyer_id on the caller's transaction.
+
+    The conditional UPDATE is the claim itself, so two purchases can never
+    both redeem one code. Returns (added_percentage, creator_id, error).
+    """
+    cursor.execute("""
+        UPDATE promo_codes SET spender_id = %s
+        WHERE code = %s AND spender_id IS NULL AND creator_id <> %s
+          AND start_date <= NOW() AND end_date >= NOW()
+    """, (buyer_id, promo_code, buyer_id))
+    claimed = cursor.rowcount == 1
+    invalidate_promo_code(promo_code)
+    cursor.execute("SELECT added_tnc_percentage, creator_id, spender_id FROM promo_codes WHERE code = %s",
+                   (promo_code,))
+    promo = cursor.fetchone()
+    if claimed:
+        return to_fraction(promo['added_tnc_percentage']), promo['creator_id'], None
+    if promo and promo['creator_id'] == buyer_id:
+        return None, None, "Le créateur du code promo ne peut pas l'utiliser."
+    if promo and promo['spender_id'] is not None:
+        return None, None, "Promo code has already been used."
+    return None, None, "Promo code is either expired or not found."
+
+
+def _record_credit(cursor, tx_hash, credit):
+    cursor.execute("""
+        UPDATE credited_payments SET tanacoin_credited = %s, promo_code = %s
+        WHERE tx_hash = %s
+    """, (credit["tanacoin_purchased"].to_decimal(), credit.get("promo_applied"), tx_hash))
+
+
+def _already_credited(cursor, tx_hash, user_id, promo_code):
+    """Return what an already credited hash credited, adding promo_code if it was credited without one.
+
+    The block scanner credits payments without a promo code, so the buyer's
+    own submission can arrive second. The bonus then goes to the buyer's
+    wallet as a ledger entry, the purchase itself being recorded already.
+    Returns (credit, promo_applied).
+    """
+    cursor.execute("""
+        SELECT user_id, tanacoin_credited, promo_code FROM credited_payments
+        WHERE tx_hash = %s
+        FOR UPDATE
+    """, (tx_hash,))
+    previous = cursor.fetchone() or {}
+    credit = {}
+    if previous.get('tanacoin_credited') is not None:
+        credit["tanacoin_purchased"] = Money.from_fraction(to_fraction(previous['tanacoin_credited']), 'TNC')
+    if previous.get('promo_code'):
+        credit["promo_applied"] = previous['promo_code']
+    if not promo_code or promo_code == previous.get('promo_code'):
+        return credit, False
+
+    wallet_id = get_wallet_id(cursor, user_id)
+    if previous.get('promo_code') or previous.get('user_id') != user_id or "tanacoin_purchased" not in credit \
+            or not wallet_id:
+        credit["promo_error"] = PROMO_AFTER_CREDIT
+        return credit, False
+    added_percentage, creator_id, promo_error = redeem_promo_code(cursor, promo_code, user_id)
+    if promo_error:
+        credit["promo_error"] = promo_error
+        return credit, False
+
+    purchased = credit["tanacoin_purchased"]
+    credit["tanacoin_purchased"] = purchased.add_percentage(added_percentage)
+    credit["promo_applied"] = promo_code
+    bonus = credit["tanacoin_purchased"] - purchased
+    append_entries(cursor, [(wallet_id, bonus, 'promo_bonus', tx_hash)])
+    accrue_bonus(cursor, creator_id, bonus, tx_hash)
+    _record_credit(cursor, tx_hash, credit)
+    return credit, True
+
+
+def store_transaction_in_db(tx_hash, value: Money, currency, sender_address, tanacoin_purchased: Money,
+                            promo_code=None, buyer_id=None, connection=None):
+    """Credit a payment, redeeming its promo code and queueing the creator bonus, in one transaction.
+
+    Returns (ok, message, credit) where credit holds the Tanacoin actually
+    credited and the promo outcome. Payments always go to the sender's
+    account; a buyer_id that does not own the sending wallet is refused. Pass a connection to run inside the
+    caller's transaction; it is then neither committed nor closed here.
+    """
+    own_connection = connection is None
     try:
         print("Starting to retrieve user details...")  # Added print statement
-        userdetails = get_user_details_by_wallet_id(sender_address)  
+        user_id = get_user_id_by_wallet_address(sender_address)  # Cached, indexed lookup
         
-        if userdetails:  # Check if the result is not empty
-            user_id = userdetails[0].get("id")  # Access the first dictionary in the list
+        if user_id:
             print(f"User ID: {user_id}")  # Print the user ID
         else:
             print("No user details found.")
-            return False, "No user found with provided wallet ID."
+            return False, NO_LINKED_USER, None
+        if buyer_id is not None and buyer_id != user_id:
+            return False, SENDER_NOT_BUYER, None
         
         crypto_precision = 18
+        credit = {"tanacoin_purchased": tanacoin_purchased}
 
-        connection = get_db_connection()
+        if own_connection:
+            connection = get_db_connection()
 
         with connection.cursor() as cursor:
+            # Claim the hash in the same transaction so a payment is never credited twice
+            cursor.execute("INSERT IGNORE INTO credited_payments (tx_hash, currency, user_id) VALUES (%s, %s, %s)",
+                           (tx_hash, currency, user_id))
+            if cursor.rowcount == 0:
+                print(f"Transaction {tx_hash} was already credited.")
+                credit, promo_applied = _already_credited(cursor, tx_hash, user_id, promo_code)
+                if own_connection:
+                    if promo_applied:
+                        connection.commit()
+                    else:
+                        connection.rollback()
+                if promo_applied:
+                    invalidate_promo_code(promo_code)
+                return True, "Transaction already credited", credit
+
+            if promo_code:
+                added_percentage, creator_id, promo_error = redeem_promo_code(cursor, promo_code, buyer_id or user_id)
+                if promo_error:
+                    # The payment is still credited, only without the promo bonus
+                    credit["promo_error"] = promo_error
+                else:
+                    credit["tanacoin_purchased"] = tanacoin_purchased.add_percentage(added_percentage)
+                    credit["promo_applied"] = promo_code
+                    accrue_bonus(cursor, creator_id, credit["tanacoin_purchased"] - tanacoin_purchased, tx_hash)
+
+            _record_credit(cursor, tx_hash, credit)
+
             # Prepare the stored procedure call
             stored_procedure = """
                 CALL purchase_and_update_tanacoin(
@@ -276,28 +591,35 @@ def store_transaction_in_db(tx_hash, value, currency, sender_address, tanacoin_p
             """
 
             # Execute the stored procedure with the provided parameters
-            cursor.execute(stored_procedure, (user_id, value, currency, crypto_precision, tx_hash, tanacoin_purchased))
-            
-            # Commit the transaction (important for changes to take effect)
-            connection.commit()
+            cursor.execute(stored_procedure, (user_id, value.to_decimal(), currency, crypto_precision, tx_hash,
+                                              credit["tanacoin_purchased"].to_decimal()))
 
             # Fetch the result message from the SELECT statement at the end of the stored procedure
             result = cursor.fetchone()
-            print(result['message'])  # Print success message from the procedure
             
             # Optionally, check if there are specific return values or conditions:
             if result:
+                print(result.get('message'))  # Print success message from the procedure
                 print("Stored procedure executed successfully.")
             else:
                 print("Stored procedure did not return any result.")
+
+        # Commit the whole redemption at once (important for changes to take effect)
+        if own_connection:
+            connection.commit()
+        if promo_code:
+            # Again after commit, so no reader re-caches the pre-redemption row
+            invalidate_promo_code(promo_code)
         
         print("Transaction stored successfully in the database.")  # Added print statement
-        return True, "Transaction stored successfully"
+        return True, "Transaction stored successfully", credit
     
     except Exception as e:
         print(f"Error occurred during transaction storage: {e}")  # More descriptive error print
-        return False, str(e)
+        if own_connection and connection:
+            connection.rollback()
+        return False, str(e), None
     
     finally:
-        if connection:
+        if own_connection and connection:
             connection.close()
@@ -0,0 +1,108 @@
+"""Compare the legacy multi-connection promo redemption with the single-transaction one.
+
+Both paths credit a simulated, already-confirmed payment (no chain lookup)
+against the database configured in the environment, redeeming a freshly
+created promo code each time. It WRITES payments, promo codes and bonus
+accruals, so point it at a staging database.
+
+    python -m benchmarks.bench_promo_redemption --creator-id 1 --buyer-wallet 0xabc... --iterations 200 --yes
+"""
+import argparse
+import statistics
+import time
+import uuid
+from typing import Callable, Dict, List
+
+import pymysql.connections
+
+from app.handle_token import check_promocode_status, create_promo_code, update_spender_id
+from app.money import Money, to_fraction
+from app.self_utils import generate_promo_code
+from app.user_management import add_bonus_to_creator, get_user_id_by_wallet_address
+from app.wallet_communications import store_transaction_in_db
+
+counters = {'connects': 0, 'queries': 0, 'commits': 0}
+
+
+def _count(method_name: str, counter: str) -> None:
+    original = getattr(pymysql.connections.Connection, method_name)
+
+    def wrapper(self, *args, **kwargs):
+        counters[counter] += 1
+        return original(self, *args, **kwargs)
+    setattr(pymysql.connections.Connection, method_name, wrapper)
+
+
+_count('connect', 'connects')
+_count('query', 'queries')
+_count('commit', 'commits')
+
+
+def legacy_redemption(tx_hash: str, promo_code: str, buyer_id: int, sender: str, value: Money,
+                      tanacoin: Money) -> None:
+    """The pre-pipeline sequence: four connections, four commits."""
+    status = check_promocode_status(promo_code, buyer_id)
+    added_percentage = to_fraction(status['added_tnc_percentage'])
+    total = tanacoin.add_percentage(added_percentage)
+    store_transaction_in_db(tx_hash, value, 'ETH', sender, total)
+    update_spender_id(promo_code, buyer_id)
+    add_bonus_to_creator(total, added_percentage, status['creator_id'], tx_hash)
+
+
+def pipeline_redemption(tx_hash: str, promo_code: str, buyer_id: int, sender: str, value: Money,
+                        tanacoin: Money) -> None:
+    ok, message, _ = store_transaction_in_db(tx_hash, value, 'ETH', sender, tanacoin,
+                                             promo_code=promo_code, buyer_id=buyer_id)
+    if not ok:
+        raise RuntimeError(message)
+
+
+def run(name: str, redeem: Callable, iterations: int, creator_id: int, buyer_id: int, sender: str) -> Dict:
+    codes = []
+    for _ in range(iterations):
+        code, percentage, start_date, end_date = generate_promo_code()
+        create_promo_code(code, percentage, start_date, end_date, creator_id)
+        codes.append(code)
+
+    for key in counters:
+        counters[key] = 0
+    latencies: List[float] = []
+    for code in codes:
+        started = time.perf_counter()
+        redeem(f"bench-{uuid.uuid4().hex}", code, buyer_id, sender,
+               Money.parse('0.001', 'ETH'), Money.parse('10', 'TNC'))
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    return {
+        'path': name,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        'connects_per_op': counters['connects'] / iterations,
+        'queries_per_op': counters['queries'] / iterations,
+        'commits_per_op': counters['commits'] / iterations,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark promo redemption paths.")
+    parser.add_argument('--creator-id', type=int, required=True, help="user creating the promo codes")
+    parser.add_argument('--buyer-wallet', required=True, help="wallet address linked to the buying user")
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--yes', action='store_true', help="confirm that the database may be written to")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this benchmark writes to the configured database; pass --yes to run it")
+
+    buyer_id = get_user_id_by_wallet_address(args.buyer_wallet)
+    if not buyer_id:
+        parser.error("no user is linked to --buyer-wallet")
+
+    for name, redeem in (('legacy', legacy_redemption), ('pipeline', pipeline_redemption)):
+        result = run(name, redeem, args.iterations, args.creator_id, buyer_id, args.buyer_wallet)
+        print(' '.join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
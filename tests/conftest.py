@@ -0,0 +1,113 @@
+"""Shared fixtures: the app is imported without background services and
+database access goes through a scripted in-memory connection."""
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+os.environ.setdefault('RUN_BACKGROUND_SERVICES', '0')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key-of-at-least-32-bytes')
+os.environ.setdefault('KYC_UPLOAD_FOLDER', tempfile.mkdtemp(prefix='kyc-tests-'))
+
+import pytest
+
+Response = Union[List[Dict[str, Any]], Dict[str, Any], Callable[[Optional[Sequence[Any]]], Any]]
+
+
+class FakeCursor:
+    """Answers each statement from the first response whose fragment it contains.
+
+    A response is a list of rows, or a dict with ``rows``, ``rowcount`` and
+    ``lastrowid``, or a callable receiving the parameters and returning either.
+    """
+
+    def __init__(self, connection: 'FakeConnection'):
+        self.connection = connection
+        self.rows: List[Dict[str, Any]] = []
+        self.rowcount = 0
+        self.lastrowid: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> int:
+        sql = ' '.join(sql.split())
+        self.connection.executed.append((sql, params))
+        self.rows, self.rowcount = [], 0
+        for fragment, response in self.connection.responses:
+            if fragment in sql:
+                if callable(response):
+                    response = response(params)
+                if isinstance(response, dict):
+                    self.rows = list(response.get('rows', []))
+                    self.rowcount = response.get('rowcount', len(self.rows))
+                    self.lastrowid = response.get('lastrowid', self.lastrowid)
+                else:
+                    self.rows = list(response or [])
+                    self.rowcount = len(self.rows)
+                break
+        return self.rowcount
+
+    def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> int:
+        return self.execute(sql, list(seq_of_params))
+
+    def callproc(self, name: str, args: Sequence[Any] = ()) -> None:
+        self.execute(f"CALL {name}", args)
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    def __init__(self, responses: Sequence[Tuple[str, Response]] = ()):
+        self.responses = list(responses)
+        self.executed: List[Tuple[str, Optional[Sequence[Any]]]] = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self, *args) -> FakeCursor:
+        return FakeCursor(self)
+
+    def begin(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+
+    def close(self) -> None:
+        self.closed = True
+
+    def statements(self, fragment: str) -> List[Tuple[str, Optional[Sequence[Any]]]]:
+        return [(sql, params) for sql, params in self.executed if fragment in sql]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Patch get_db_connection in the given modules; returns the connections handed out."""
+    handed_out: List[FakeConnection] = []
+
+    def install(responses: Sequence[Tuple[str, Response]], *modules) -> List[FakeConnection]:
+        def connect():
+            connection = FakeConnection(responses)
+            handed_out.append(connection)
+            return connection
+        for module in modules:
+            monkeypatch.setattr(module, 'get_db_connection', connect)
+        return handed_out
+    return install
@@ -0,0 +1,82 @@
+from decimal import Decimal
+
+import pymysql
+import pytest
+
+from app import db_schema, handle_token
+from app.handle_token import batch_transfer_tanacoin, parse_batch_transfers
+from app.money import Money
+
+
+def test_parse_batch_transfers_reports_bad_items_by_index():
+    transfers, errors = parse_batch_transfers([
+        {'recipient_tnc_wallet_id': ' W2 ', 'amount': '1.5'},
+        {'recipient_tnc_wallet_id': 'W3'},
+        {'recipient_tnc_wallet_id': 'W4', 'amount': '0'},
+        {'recipient_tnc_wallet_id': 'W5', 'amount': '0.000000001'},
+        'W6',
+    ])
+    assert transfers == [('W2', Money(150_000_000, 'TNC'))]
+    assert [error['index'] for error in errors] == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('items', [[], None, {'recipient_tnc_wallet_id': 'W2'}])
+def test_parse_batch_transfers_requires_a_list(items):
+    assert parse_batch_transfers(items)[0] == []
+
+
+def _wallet_db(fake_db, balance='10', pending='0', fail_insert=False):
+    def insert(params):
+        if fail_insert:
+            raise pymysql.MySQLError("deadlock")
+        return {'rowcount': len(params)}
+    return fake_db([
+        ('FROM tnc_wallets WHERE user_id', [{'tnc_wallet_id': 'W1'}]),
+        ('SELECT tnc_wallet_id, balance', [{'tnc_wallet_id': 'W1', 'balance': balance}]),
+        ('SUM(amount) AS pending', [{'tnc_wallet_id': 'W1', 'pending': pending}]),
+        ('SELECT tnc_wallet_id FROM tnc_wallets WHERE tnc_wallet_id IN',
+         lambda params: [{'tnc_wallet_id': wallet} for wallet in params if wallet != 'W9']),
+        ('INSERT INTO tnc_ledger', insert),
+    ], handle_token)
+
+
+def test_batch_debits_against_snapshot_plus_ledger_tail(fake_db):
+    connections = _wallet_db(fake_db, balance='10', pending='-1')
+    transfers = [('W2', Money.parse('4', 'TNC')), ('W9', Money.parse('1', 'TNC')),
+                 ('W1', Money.parse('1', 'TNC')), ('W3', Money.parse('5', 'TNC')), ('W2', Money.parse('1', 'TNC'))]
+
+    body, status = batch_transfer_tanacoin(1, transfers)
+
+    assert status == 200
+    assert [result['status'] for result in body['results']] == ['ok', 'error', 'error', 'ok', 'error']
+    assert body['results'][4]['message'] == 'Insufficient balance'
+    _, entries = connections[0].statements('INSERT INTO tnc_ledger')[0]
+    assert [(wallet, str(amount), kind) for wallet, amount, kind, _ in entries] == [
+        ('W1', '-4.00000000', 'transfer_out'), ('W2', '4.00000000', 'transfer_in'),
+        ('W1', '-5.00000000', 'transfer_out'), ('W3', '5.00000000', 'transfer_in'),
+    ]
+    [(transfer_sql, rows)] = connections[0].statements('INSERT INTO transactions')
+    assert 'transaction_hash, transaction_date)' in transfer_sql and 'NOW()' in transfer_sql
+    assert [row[:4] for row in rows] == [(1, 'W2', Decimal('4.00000000'), 'completed'),
+                                         (1, 'W3', Decimal('5.00000000'), 'completed')]
+    assert connections[0].commits == 1 and connections[0].closed
+
+
+def test_failed_chunk_is_rolled_back_and_reported(fake_db):
+    connections = _wallet_db(fake_db, fail_insert=True)
+    transfers = [('W2', Money.parse('1', 'TNC'))] * 3
+
+    body, _ = batch_transfer_tanacoin(1, transfers, chunk_size=2)
+
+    assert body['succeeded'] == 0 and body['failed'] == 3
+    assert all('deadlock' in result['message'] for result in body['results'])
+    assert connections[0].rollbacks == 2 and connections[0].commits == 0
+
+
+def test_batch_without_a_sender_wallet(fake_db):
+    fake_db([], handle_token)
+    assert batch_transfer_tanacoin(1, [('W2', Money(1, 'TNC'))])[1] == 404
+
+
+def test_transfer_columns_are_checked_on_deploy():
+    assert set(handle_token.TRANSFER_COLUMNS) <= db_schema.REQUIRED_COLUMNS['transactions']
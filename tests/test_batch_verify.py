@@ -0,0 +1,127 @@
+import asyncio
+
+import jwt
+import pytest
+import requests
+
+from app import api, batch_verify
+from app.batch_verify import BatchVerifier, parse_items, summarize_eth_transaction
+from app.circuit_breaker import CircuitBreaker
+
+
+def test_parse_items_skips_blanks_and_duplicates():
+    items = parse_items(['0xa', '', '0xb, btc', '0xa,ETH', ' ,USDT'], default_method='usdt')
+    assert items == [
+        {'tx_hash': '0xa', 'payment_method': 'USDT'},
+        {'tx_hash': '0xb', 'payment_method': 'BTC'},
+    ]
+
+
+def test_summarize_eth_transaction_statuses():
+    transaction = {'blockNumber': hex(100), 'to': '0xdead', 'from': '0xfeed', 'value': hex(10 ** 18), 'input': '0x'}
+
+    assert summarize_eth_transaction('0x1', None, None, 0) == {'tx_hash': '0x1', 'status': 'not_found'}
+    pending = summarize_eth_transaction('0x1', {**transaction, 'blockNumber': None}, None, 0)
+    assert pending['status'] == 'pending' and pending['value'] == '1.000000000000000000'
+    assert summarize_eth_transaction('0x1', transaction, {'status': '0x0'}, 200)['status'] == 'failed'
+    confirmed = summarize_eth_transaction('0x1', transaction, {'status': '0x1'}, 200)
+    assert confirmed['status'] == 'confirmed' and confirmed['confirmations'] == 101
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, 'iter_verify_ndjson', lambda items, **options: iter([f"{len(items)} {options}\n"]))
+    token = jwt.encode({'user_id': 1, 'is_superuser': True}, api.SECRET_KEY, algorithm='HS256')
+    client = api.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return client
+
+
+@pytest.mark.parametrize('body', [
+    [1],
+    {'tx_hashes': ['0xa'], 'concurrency': 'ten'},
+    {'tx_hashes': ['0xa'], 'concurrency': 2.5},
+    {'tx_hashes': [1]},
+    {'tx_hashes': '0xa'},
+    {'transactions': ['0xa']},
+    {'transactions': [{'tx_hash': 5}]},
+    {'tx_hashes': ['0xa'], 'payment_method': 'DOGE'},
+    {},
+])
+def test_verify_batch_rejects_malformed_bodies(client, body):
+    response = client.post('/api/transactions/verify-batch', json=body)
+    assert response.status_code == 400
+
+
+def test_verify_batch_clamps_concurrency(client):
+    response = client.post('/api/transactions/verify-batch',
+                           json={'tx_hashes': ['0xa'], 'transactions': [{'tx_hash': '0xb', 'payment_method': 'btc'}],
+                                 'concurrency': 500})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == "2 {'concurrency': 100}\n"
+
+
+def test_verify_batch_is_admin_only(client):
+    token = jwt.encode({'user_id': 2}, api.SECRET_KEY, algorithm='HS256')
+    response = client.post('/api/transactions/verify-batch', json={'tx_hashes': ['0xa']},
+                           headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 403
+
+
+def test_iter_verify_ndjson_reports_worker_errors(monkeypatch):
+    async def boom(items, emit, **options):
+        emit({'tx_hash': '0xa', 'status': 'not_found'})
+        raise RuntimeError("provider exploded")
+    monkeypatch.setattr(batch_verify, '_run', boom)
+
+    lines = list(batch_verify.iter_verify_ndjson([{'tx_hash': '0xa', 'payment_method': 'ETH'}]))
+
+    assert lines == ['{"tx_hash": "0xa", "status": "not_found"}\n',
+                     '{"status": "error", "message": "provider exploded"}\n']
+
+
+class PoolClient:
+    """Stands in for the shared MultiEndpointClient."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.batches = []
+
+    def batch(self, calls):
+        self.batches.append(calls)
+        if self.error:
+            raise self.error
+        return [hex(200)] + [None if method.endswith('Receipt') else
+                             {'blockNumber': hex(100), 'to': '0xdead', 'from': '0xfeed', 'value': '0x1'}
+                             for method, _ in calls[1:]]
+
+
+def _verify(client, hashes, batch_size=2):
+    async def run():
+        verifier = BatchVerifier(client=client, batch_size=batch_size, eth_rps=1000)
+        return [line async for line in verifier.verify([{'tx_hash': h, 'payment_method': 'ETH'} for h in hashes])]
+    return asyncio.run(run())
+
+
+def test_eth_batches_go_through_the_endpoint_pool_and_breaker(monkeypatch):
+    monkeypatch.setattr(batch_verify, 'infura_breaker', CircuitBreaker('test'))
+    client = PoolClient()
+
+    lines = _verify(client, ['0x1', '0x2', '0x3'])
+
+    assert sorted(line['tx_hash'] for line in lines) == ['0x1', '0x2', '0x3']
+    assert {line['status'] for line in lines} == {'pending'}
+    assert sorted(len(calls) for calls in client.batches) == [3, 5]
+    assert batch_verify.infura_breaker.stats()['window_calls'] == 2
+
+
+def test_pool_failures_and_an_open_breaker_become_error_lines(monkeypatch):
+    breaker = CircuitBreaker('test', minimum_calls=1)
+    monkeypatch.setattr(batch_verify, 'infura_breaker', breaker)
+    client = PoolClient(requests.ConnectionError("all endpoints down"))
+
+    first = _verify(client, ['0x1'])
+    second = _verify(client, ['0x2'])
+
+    assert first == [{'tx_hash': '0x1', 'status': 'error', 'message': 'all endpoints down'}]
+    assert second[0]['status'] == 'error' and len(client.batches) == 1
@@ -0,0 +1,46 @@
+from decimal import Decimal
+
+from app import bonus_accruals
+from app.bonus_accruals import accrue_bonus, flush_bonus_accruals
+from app.money import Money
+from conftest import FakeConnection
+
+
+def test_repeated_reference_is_queued_once():
+    connection = FakeConnection([('INSERT IGNORE INTO creator_bonus_accruals',
+                                  lambda params: {'rowcount': 0 if params[2] == 'tx-seen' else 1})])
+    cursor = connection.cursor()
+    assert accrue_bonus(cursor, 3, Money.parse('1.25', 'TNC'), 'tx-new')
+    assert not accrue_bonus(cursor, 3, Money.parse('1.25', 'TNC'), 'tx-seen')
+    assert connection.executed[0][1] == (3, Decimal('1.25000000'), 'tx-new')
+
+
+def test_flush_credits_each_creator_once(fake_db):
+    connections = fake_db([
+        ('FROM creator_bonus_accruals', [
+            {'id': 1, 'creator_id': 7, 'amount': Decimal('1.5')},
+            {'id': 2, 'creator_id': 8, 'amount': Decimal('2')},
+            {'id': 3, 'creator_id': 7, 'amount': Decimal('0.5')},
+            {'id': 4, 'creator_id': 9, 'amount': Decimal('4')},
+        ]),
+        ('SELECT user_id, tnc_wallet_id', [{'user_id': 7, 'tnc_wallet_id': 'W7'},
+                                           {'user_id': 8, 'tnc_wallet_id': 'W8'}]),
+    ], bonus_accruals)
+
+    assert flush_bonus_accruals() == 3
+
+    connection = connections[0]
+    assert 'SKIP LOCKED' in connection.executed[0][0]
+    [(_, entries)] = connection.statements('INSERT INTO tnc_ledger')
+    assert entries == [('W7', Decimal('2.00000000'), 'promo_bonus', 'accruals:1-3'),
+                       ('W8', Decimal('2.00000000'), 'promo_bonus', 'accruals:2-2')]
+    # Creator 9 has no wallet yet: its accrual stays pending
+    [(_, flushed)] = connection.statements('SET flushed_at = NOW()')
+    assert flushed == [1, 3, 2]
+    assert connection.commits == 1 and connection.closed
+
+
+def test_flush_with_nothing_pending(fake_db):
+    connections = fake_db([], bonus_accruals)
+    assert flush_bonus_accruals() == 0
+    assert connections[0].rollbacks == 1 and connections[0].commits == 0
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from app import batch_verify
+from app.btc_providers import (BtcProvider, BtcRateLimited, BtcRequestScheduler, LocalBtcProvider,
+                               SchedulerBusy)
+
+
+class GatedProvider(LocalBtcProvider):
+    """Serves fixtures only once the test opens the gate; counts provider calls."""
+
+    def __init__(self, transactions):
+        super().__init__(transactions, fixtures_path=None)
+        self.gate = threading.Event()
+        self.calls = []
+
+    def get_transaction(self, tx_hash):
+        self.calls.append(tx_hash)
+        self.gate.wait(5)
+        return super().get_transaction(tx_hash)
+
+
+def test_provider_must_implement_get_transaction():
+    with pytest.raises(TypeError):
+        BtcProvider()
+
+    class Partial(BtcProvider):
+        pass
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_concurrent_lookups_of_one_hash_share_a_provider_call():
+    provider = GatedProvider({'aa': {'confirmations': 3}})
+    scheduler = BtcRequestScheduler(provider, per_second=100, per_hour=360000)
+
+    futures = [scheduler.submit('aa') for _ in range(3)]
+    assert futures[0] is futures[1] is futures[2]
+    provider.gate.set()
+
+    assert futures[0].result(timeout=5) == {'confirmations': 3}
+    assert provider.calls == ['aa']
+    assert scheduler.get_transaction('missing') is None
+
+
+def test_queued_lookup_past_the_wait_budget_reports_busy():
+    provider = GatedProvider({})
+    scheduler = BtcRequestScheduler(provider, per_second=100, per_hour=360000)
+    with pytest.raises(SchedulerBusy):
+        scheduler.get_transaction('aa', timeout=0.05)
+    provider.gate.set()
+
+
+def test_throttled_provider_pauses_the_scheduler():
+    class Throttled(BtcProvider):
+        name = 'throttled'
+
+        def get_transaction(self, tx_hash):
+            raise BtcRateLimited(30)
+
+    scheduler = BtcRequestScheduler(Throttled(), per_second=100, per_hour=360000)
+    with pytest.raises(SchedulerBusy) as busy:
+        scheduler.get_transaction('aa', timeout=0.2)
+    assert busy.value.retry_after > 25
+    assert scheduler.stats()['paused_for'] > 25
+
+
+def test_hourly_bucket_is_clamped_by_the_provider_remaining_quota():
+    class Reporting(LocalBtcProvider):
+        def remaining_quota(self):
+            return 0
+
+    scheduler = BtcRequestScheduler(Reporting({}, fixtures_path=None), per_second=100, per_hour=360000)
+    assert scheduler._reserve() > 0
+
+
+@pytest.mark.parametrize('env, shares', [
+    ({'WEB_CONCURRENCY': '4'}, 4),
+    ({'WEB_CONCURRENCY': '4', 'BTC_QUOTA_SHARES': '5'}, 5),
+])
+def test_account_quota_is_split_between_workers(env, shares):
+    # The split is read at import time, so check it in a fresh interpreter
+    script = ("from app.btc_providers import BTC_QUOTA_SHARES, BtcRequestScheduler, LocalBtcProvider;"
+              "s = BtcRequestScheduler(LocalBtcProvider({}, fixtures_path=None));"
+              "print(BTC_QUOTA_SHARES, s._second.rate, s._hour.rate * 3600)")
+    env = {**os.environ, 'BTC_QUOTA_PER_SECOND': '10', 'BTC_QUOTA_PER_HOUR': '1000', **env}
+    output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+    count, per_second, per_hour = output.stdout.split()
+    assert int(count) == shares
+    assert float(per_second) == pytest.approx(10 / shares)
+    assert float(per_hour) == pytest.approx(1000 / shares)
+
+
+def test_batch_verification_goes_through_the_scheduler(monkeypatch):
+    provider = GatedProvider({'aa': {'confirmations': 9, 'outputs': [{'addresses': ['bc1x'], 'value': 5}]}})
+    provider.gate.set()
+    monkeypatch.setattr(batch_verify, 'btc_scheduler', BtcRequestScheduler(provider, per_second=100, per_hour=360000))
+
+    async def run():
+        verifier = batch_verify.BatchVerifier()
+        return [line async for line in verifier.verify([{'tx_hash': 'aa', 'payment_method': 'BTC'},
+                                                         {'tx_hash': 'bb', 'payment_method': 'BTC'}])]
+
+    lines = sorted(asyncio.run(run()), key=lambda line: line['tx_hash'])
+    assert lines[0]['status'] == 'confirmed' and lines[0]['value_units'] == 5
+    assert lines[1] == {'tx_hash': 'bb', 'status': 'not_found'}
+    assert sorted(provider.calls) == ['aa', 'bb']
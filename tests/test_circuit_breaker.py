@@ -0,0 +1,72 @@
+import pytest
+
+from app import circuit_breaker
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+
+def _fail():
+    raise ConnectionError("down")
+
+
+def _trip(breaker, calls):
+    for _ in range(calls):
+        with pytest.raises(ConnectionError):
+            breaker.call(_fail)
+
+
+def test_opens_once_failure_rate_reached(clock):
+    breaker = CircuitBreaker('test-open', minimum_calls=4, failure_rate_threshold=0.5)
+    breaker.call(lambda: 'ok')
+    breaker.call(lambda: 'ok')
+    _trip(breaker, 1)
+    assert breaker.state == CLOSED
+    _trip(breaker, 1)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    breaker = CircuitBreaker('test-probe', minimum_calls=2, open_seconds=30)
+    _trip(breaker, 2)
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    _trip(breaker, 1)
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED
+
+
+def test_excluded_exceptions_count_as_success(clock):
+    breaker = CircuitBreaker('test-excluded', minimum_calls=2, excluded_exceptions=(KeyError,))
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            breaker.call(lambda: {}['missing'])
+    assert breaker.state == CLOSED
+    assert breaker.stats()['window_failures'] == 0
+
+
+def test_old_outcomes_leave_the_window(clock):
+    breaker = CircuitBreaker('test-window', minimum_calls=3, window_seconds=60)
+    _trip(breaker, 2)
+    clock.now += 61
+    breaker.call(lambda: 'ok')
+    assert breaker.state == CLOSED
+    assert breaker.stats()['window_calls'] == 1
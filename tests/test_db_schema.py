@@ -0,0 +1,37 @@
+import pymysql
+import pytest
+
+from app import db_schema
+from app.db_schema import apply_schema
+
+
+@pytest.fixture
+def schema(monkeypatch):
+    monkeypatch.setattr(db_schema, 'SCHEMA_STATEMENTS', ['CREATE TABLE a', 'ALTER TABLE a ADD COLUMN b INT'])
+    monkeypatch.setattr(db_schema, 'REQUIRED_COLUMNS', {'transactions': {'amount', 'transaction_date'}})
+
+
+def _columns(*names):
+    return ('INFORMATION_SCHEMA.COLUMNS', [{'COLUMN_NAME': name} for name in names])
+
+
+def test_apply_schema_skips_applied_statements_and_checks_required_columns(schema, fake_db):
+    def duplicate_column(params):
+        raise pymysql.MySQLError(1060, "Duplicate column name 'b'")
+    connections = fake_db([('ADD COLUMN b', duplicate_column), _columns('amount', 'transaction_date', 'status')],
+                          db_schema)
+
+    apply_schema()
+
+    [(_, params)] = connections[0].statements('INFORMATION_SCHEMA.COLUMNS')
+    assert params == ('transactions',)
+    assert connections[0].commits == 1 and connections[0].closed
+
+
+def test_apply_schema_fails_on_a_missing_required_column(schema, fake_db):
+    connections = fake_db([_columns('amount')], db_schema)
+
+    with pytest.raises(RuntimeError, match='transactions.transaction_date'):
+        apply_schema()
+
+    assert connections[0].commits == 0 and connections[0].closed
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import pytest
+
+from app.eth_rpc import (JsonRpcError, MultiEndpointClient, RpcBatcher, build_batch_payload, decode_usdt_transfer,
+                         get_transaction_bundle, parse_batch_reply)
+
+
+class RecordingClient:
+    batch_timeout = 2
+
+    def __init__(self, answer=None):
+        self.batches = []
+        self.answer = answer or (lambda method, params: f"{method}:{','.join(params)}")
+
+    def batch(self, calls):
+        self.batches.append(list(calls))
+        return [self.answer(method, params) for method, params in calls]
+
+
+def test_batch_replies_are_matched_by_id():
+    calls = [('eth_blockNumber', ()), ('eth_getTransactionByHash', ('0xa',)), ('eth_getTransactionReceipt', ('0xa',))]
+    payload = build_batch_payload(calls)
+    assert [p['id'] for p in payload] == [0, 1, 2]
+    assert payload[1] == {'jsonrpc': '2.0', 'id': 1, 'method': 'eth_getTransactionByHash', 'params': ['0xa']}
+
+    results = parse_batch_reply(calls, [
+        {'id': 2, 'error': {'code': -32000, 'message': 'boom'}},
+        {'id': 0, 'result': '0x10'},
+    ])
+    assert results[0] == '0x10'
+    assert isinstance(results[1], JsonRpcError) and 'Missing reply' in str(results[1])
+    assert isinstance(results[2], JsonRpcError) and results[2].code == -32000
+
+
+def test_non_list_batch_reply_raises():
+    with pytest.raises(JsonRpcError, match='rate limited'):
+        parse_batch_reply([('eth_blockNumber', ())], {'error': {'message': 'rate limited'}})
+
+
+def test_decode_usdt_transfer():
+    recipient = 'ab' * 20
+    calldata = '0xa9059cbb' + recipient.rjust(64, '0') + hex(2_500_000)[2:].rjust(64, '0')
+    assert decode_usdt_transfer(calldata) == ('0x' + recipient, 2_500_000)
+    assert decode_usdt_transfer('0x') is None
+    assert decode_usdt_transfer('0x095ea7b3' + '0' * 128) is None
+
+
+def test_concurrent_callers_share_one_deduplicated_batch():
+    client = RecordingClient()
+    batcher = RpcBatcher(client, window=0.05)
+    results = {}
+
+    def lookup(tx_hash):
+        results[tx_hash] = get_transaction_bundle(batcher, tx_hash)
+
+    client.answer = lambda method, params: '0x20' if method == 'eth_blockNumber' else {'hash': params[0]}
+    threads = [threading.Thread(target=lookup, args=(h,)) for h in ('0xa', '0xb', '0xa')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(client.batches) == 1
+    assert len(client.batches[0]) == 5  # eth_blockNumber and the 0xa calls only once
+    assert results['0xb'] == ({'hash': '0xb'}, {'hash': '0xb'}, 32)
+
+
+def test_bundle_raises_per_call_errors():
+    client = RecordingClient(lambda method, params: JsonRpcError(method, {'message': 'nope'})
+                             if method == 'eth_getTransactionReceipt' else None)
+    with pytest.raises(JsonRpcError, match='eth_getTransactionReceipt'):
+        get_transaction_bundle(RpcBatcher(client, window=0), '0xa')
+
+
+class ScriptedEndpoint:
+    def __init__(self, url, delay=0.0, error=None, timeout=1):
+        self.url = url
+        self.delay = delay
+        self.error = error
+        self.timeout = timeout
+        self.calls = 0
+
+    def batch(self, calls):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return [self.url for _ in calls]
+
+
+def _multi_client(*endpoints, hedge=True):
+    client = MultiEndpointClient([endpoint.url for endpoint in endpoints], timeout=1, hedge=hedge)
+    for health, endpoint in zip(client.endpoints, endpoints):
+        health.client = endpoint
+    return client
+
+
+def test_failed_endpoint_fails_over_to_the_next():
+    broken, healthy = ScriptedEndpoint('a', error=ConnectionError("refused")), ScriptedEndpoint('b')
+    client = _multi_client(broken, healthy, hedge=False)
+
+    assert client.call('eth_blockNumber') == 'b'
+    assert broken.calls == 1 and client.endpoints[0].error_ewma > 0
+    # The failing endpoint now ranks behind the healthy one
+    assert client.call('eth_blockNumber') == 'b' and broken.calls == 1
+
+
+def test_slow_primary_is_hedged_to_the_backup():
+    slow, fast = ScriptedEndpoint('a', delay=0.5), ScriptedEndpoint('b')
+    client = _multi_client(slow, fast)
+    client.endpoints[0].latencies.extend([0.01] * 20)
+
+    started = time.monotonic()
+    assert client.call('eth_blockNumber') == 'b'
+    assert time.monotonic() - started < 0.4
+    assert client.endpoints[1].hedged == 1
+
+
+def test_repeated_errors_cool_an_endpoint_down():
+    broken = ScriptedEndpoint('a', error=ConnectionError("refused"))
+    client = _multi_client(broken, ScriptedEndpoint('b'), hedge=False)
+    for _ in range(3):
+        client.endpoints[0].record(None, False)
+    assert not client.endpoints[0].healthy(time.monotonic())
+    assert client.call('eth_blockNumber') == 'b' and broken.calls == 0
+
+
+def test_every_endpoint_failing_raises_the_last_error():
+    client = _multi_client(ScriptedEndpoint('a', error=ConnectionError("a down")),
+                           ScriptedEndpoint('b', error=ConnectionError("b down")), hedge=False)
+    with pytest.raises(ConnectionError):
+        client.call('eth_blockNumber')
+
+
+def test_followers_wait_for_the_leaders_whole_failover():
+    broken = ScriptedEndpoint('a', delay=0.15, error=ConnectionError("refused"))
+    client = _multi_client(broken, ScriptedEndpoint('b', delay=0.15), hedge=False)
+    client.timeout = 0.1
+    batcher = RpcBatcher(client, window=0.02)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(batcher.execute([('eth_blockNumber', ())])))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The failover takes longer than timeout * 2, yet no caller gives up on it
+    assert results == [['b'], ['b']] and broken.calls == 1
+    assert client.batch_timeout == 2 * 6 * 0.1
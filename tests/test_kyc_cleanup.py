@@ -0,0 +1,48 @@
+import os
+import time
+
+from app import kyc_cleanup
+from app.kyc_cleanup import sweep_temp_kyc_documents
+
+
+def test_sweep_releases_blobs_and_deletes_rows_by_their_unique_key(tmp_path, fake_db, monkeypatch):
+    legacy = tmp_path / 'temp'
+    legacy.mkdir()
+    (legacy / 'old_scan.png').write_bytes(b'1234')
+    outside = tmp_path / 'elsewhere.png'
+    outside.write_bytes(b'keep')
+    monkeypatch.setattr(kyc_cleanup, 'LEGACY_TEMP_FOLDER', os.path.realpath(legacy))
+    monkeypatch.setattr(kyc_cleanup, 'KYC_STAGING_FOLDER', str(tmp_path / 'missing'))
+    connections = fake_db([('FROM temp_kyc_documents', [
+        {'temp_user_id': 'temp_a', 'document_type': 'selfie', 'file_path': '/blobs/aa', 'file_sha256': 'aa'},
+        {'temp_user_id': 'temp_a', 'document_type': 'id_front', 'file_path': str(legacy / 'old_scan.png'),
+         'file_sha256': None},
+        {'temp_user_id': 'temp_b', 'document_type': 'selfie', 'file_path': str(outside), 'file_sha256': None},
+    ])], kyc_cleanup)
+
+    assert sweep_temp_kyc_documents() == {'rows': 3, 'bytes': 4}
+
+    connection = connections[0]
+    [(_, released)] = connection.statements('UPDATE kyc_blobs')
+    assert released == ('aa',)
+    [(delete_sql, keys)] = connection.statements('DELETE FROM temp_kyc_documents')
+    assert 'WHERE (temp_user_id, document_type) IN ((%s, %s), (%s, %s), (%s, %s))' in delete_sql
+    assert keys == ['temp_a', 'selfie', 'temp_a', 'id_front', 'temp_b', 'selfie']
+    assert not (legacy / 'old_scan.png').exists() and outside.exists()
+    assert connection.commits == 1 and connection.closed
+
+
+def test_sweep_removes_only_stale_staged_parts(tmp_path, fake_db, monkeypatch):
+    monkeypatch.setattr(kyc_cleanup, 'KYC_STAGING_FOLDER', str(tmp_path))
+    stale, fresh, other = tmp_path / 'stale.part', tmp_path / 'fresh.part', tmp_path / 'notes.txt'
+    for path in (stale, fresh, other):
+        path.write_bytes(b'12345')
+    long_ago = time.time() - kyc_cleanup.KYC_TEMP_MAX_AGE_HOURS * 3600 - 60
+    os.utime(stale, (long_ago, long_ago))
+    os.utime(other, (long_ago, long_ago))
+    connections = fake_db([], kyc_cleanup)
+
+    assert sweep_temp_kyc_documents() == {'rows': 0, 'bytes': 5}
+
+    assert not stale.exists() and fresh.exists() and other.exists()
+    assert connections[0].rollbacks == 1 and connections[0].closed
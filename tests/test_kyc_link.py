@@ -0,0 +1,57 @@
+from app.kyc_handler import KYCService, kyc_status_cache
+from conftest import FakeConnection
+
+TEMP_DOCUMENTS = [
+    {'document_type': 'id_front', 'file_path': '/blobs/aa', 'file_sha256': 'aa', 'status': 'pending'},
+    {'document_type': 'selfie', 'file_path': '/blobs/bb', 'file_sha256': 'bb', 'status': 'pending'},
+]
+
+
+def _existing(params):
+    return [{'id': 40, 'file_sha256': 'old'}] if params[1] == 'id_front' else []
+
+
+def test_link_moves_rows_and_their_blob_references():
+    connection = FakeConnection([
+        ('FROM temp_kyc_documents WHERE temp_user_id', TEMP_DOCUMENTS),
+        ('SELECT id, file_sha256 FROM kyc_documents', _existing),
+    ])
+    kyc_status_cache.set(('account', '12'), [])
+    kyc_status_cache.set(('temp', 'temp_abc'), TEMP_DOCUMENTS)
+
+    assert KYCService(connection).link_temp_documents('temp_abc', 12)[0]
+
+    select_sql, params = connection.executed[0]
+    assert 'WHERE temp_user_id = %s' in select_sql and 'FOR UPDATE' in select_sql and params == ('temp_abc',)
+    [(_, updated)] = connection.statements('UPDATE kyc_documents')
+    assert updated == ('/blobs/aa', 'aa', 40)
+    [(_, released)] = connection.statements('UPDATE kyc_blobs')
+    assert released == ('old',)
+    [(_, inserted)] = connection.statements('INSERT INTO kyc_documents')
+    assert inserted == (12, 'selfie', '/blobs/bb', 'bb')
+    [(_, deleted)] = connection.statements('DELETE FROM temp_kyc_documents')
+    assert deleted == ('temp_abc',)
+    assert connection.commits == 1 and connection.rollbacks == 0
+    assert kyc_status_cache.get(('account', '12')) is None and kyc_status_cache.get(('temp', 'temp_abc')) is None
+
+
+def test_link_without_temp_documents_is_a_no_op():
+    connection = FakeConnection()
+    success, message = KYCService(connection).link_temp_documents('temp_none', 12)
+
+    assert success and message == "No temporary KYC documents to link"
+    assert len(connection.executed) == 1 and connection.rollbacks == 1 and connection.commits == 0
+
+
+def test_link_failure_rolls_everything_back():
+    def fail(params):
+        raise RuntimeError("lock wait timeout")
+    connection = FakeConnection([
+        ('FROM temp_kyc_documents WHERE temp_user_id', TEMP_DOCUMENTS),
+        ('SELECT id, file_sha256 FROM kyc_documents', fail),
+    ])
+
+    success, message = KYCService(connection).link_temp_documents('temp_abc', 12)
+
+    assert not success and 'lock wait timeout' in message
+    assert connection.rollbacks == 1 and connection.commits == 0
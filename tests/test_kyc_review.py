@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+from app import api, kyc_handler
+from app.kyc_handler import KYCService, kyc_status_cache, parse_review_decisions
+from conftest import FakeConnection
+
+BASE = datetime(2026, 3, 1, 9, 0)
+PENDING = [{'id': document_id, 'user_id': 1, 'document_type': 'selfie', 'file_path': '', 'file_sha256': None,
+            'created_at': BASE, 'updated_at': BASE + timedelta(minutes=minute)}
+           for document_id, minute in ((3, 0), (7, 0), (2, 1), (9, 2), (4, 3))]
+
+
+def _queue(params):
+    """Answer the review queue like MySQL would: oldest first, after the keyset, limited."""
+    params = list(params)
+    rows = PENDING
+    if len(params) == 4:
+        updated_at, _, document_id = params[:3]
+        rows = [row for row in rows if (row['updated_at'], row['id']) > (updated_at, document_id)]
+    return rows[:params[-1]]
+
+
+def test_review_queue_pages_by_updated_at_and_id():
+    connection = FakeConnection([('FROM kyc_documents', _queue)])
+    service = KYCService(connection)
+    pages, cursor_token = [], None
+    while True:
+        page, cursor_token = service.get_review_queue(limit=2, cursor_token=cursor_token)
+        pages.append([row['id'] for row in page])
+        if cursor_token is None:
+            break
+
+    assert pages == [[3, 7], [2, 9], [4]]
+    sql, params = connection.executed[1]
+    assert 'ORDER BY updated_at, id' in sql and params == [BASE, BASE, 7, 3]
+
+
+def test_review_queue_rejects_a_malformed_cursor():
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        KYCService(FakeConnection()).get_review_queue(cursor_token='%%%')
+
+
+def test_parse_review_decisions_collects_every_error():
+    decisions, errors = parse_review_decisions([
+        {'id': '5', 'status': 'approved', 'rejection_reason': 'ignored'},
+        {'id': 6, 'status': 'rejected', 'rejection_reason': 'blurry'},
+        {'id': 7, 'status': 'pending'},
+        {'id': 5, 'status': 'rejected'},
+        {'status': 'approved'},
+        'not a decision',
+    ])
+
+    assert decisions == [{'id': 5, 'status': 'approved', 'rejection_reason': None},
+                         {'id': 6, 'status': 'rejected', 'rejection_reason': 'blurry'}]
+    assert [error['index'] for error in errors] == [2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('items', [None, [], {'id': 1}])
+def test_parse_review_decisions_needs_a_non_empty_list(items):
+    assert parse_review_decisions(items) == ([], [{"index": None, "message": "decisions must be a non-empty list"}])
+
+
+def test_parse_review_decisions_is_bounded(monkeypatch):
+    monkeypatch.setattr(kyc_handler, 'KYC_BULK_VERIFY_MAX', 2)
+    decisions, errors = parse_review_decisions([{'id': i, 'status': 'approved'} for i in range(3)])
+    assert not decisions and 'At most 2' in errors[0]['message']
+
+
+def test_bulk_verification_is_one_transaction_with_one_grouped_recompute():
+    connection = FakeConnection([('SELECT id, user_id FROM kyc_documents',
+                                  [{'id': 5, 'user_id': 20}, {'id': 6, 'user_id': 10}, {'id': 8, 'user_id': 20}])])
+    kyc_status_cache.set(('account', '20'), [])
+    decisions, _ = parse_review_decisions([{'id': 5, 'status': 'approved'}, {'id': 6, 'status': 'approved'},
+                                           {'id': 8, 'status': 'rejected', 'rejection_reason': 'expired'}])
+
+    success, _, updated = KYCService(connection).verify_documents(decisions, verified_by=1)
+
+    assert success and updated == [5, 6, 8]
+    [(_, updates)] = connection.statements('UPDATE kyc_documents')
+    assert updates == [('approved', 1, None, 5), ('approved', 1, None, 6), ('rejected', 1, 'expired', 8)]
+    [(recompute_sql, user_ids)] = connection.statements('UPDATE user_profiles')
+    assert "HAVING SUM(status != 'approved') = 0" in recompute_sql and user_ids == [10, 20]
+    assert connection.commits == 1 and kyc_status_cache.get(('account', '20')) is None
+
+
+def test_bulk_verification_with_unknown_ids_changes_nothing():
+    connection = FakeConnection([('SELECT id, user_id FROM kyc_documents', [{'id': 5, 'user_id': 20}])])
+    decisions, _ = parse_review_decisions([{'id': 5, 'status': 'approved'}, {'id': 99, 'status': 'approved'}])
+
+    success, message, updated = KYCService(connection).verify_documents(decisions, verified_by=1)
+
+    assert not success and '99' in message and updated == []
+    assert not connection.statements('UPDATE kyc_documents') and connection.rollbacks == 1
+
+
+def _headers(is_superuser):
+    token = jwt.encode({'user_id': 1, 'is_superuser': is_superuser}, api.SECRET_KEY, algorithm='HS256')
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_review_routes_are_for_admins_and_validate_their_input(fake_db):
+    connections = fake_db([], api)
+    client = api.app.test_client()
+
+    assert client.get('/api/kyc/review-queue', headers=_headers(False)).status_code == 403
+    assert client.get('/api/kyc/review-queue?cursor=%25', headers=_headers(True)).status_code == 400
+    assert client.get('/api/kyc/review-queue?limit=x', headers=_headers(True)).status_code == 400
+    response = client.post('/api/kyc/verify-bulk', headers=_headers(True), json={'decisions': [{'id': 1}]})
+    assert response.status_code == 400 and response.get_json()['details'][0]['index'] == 0
+    assert len(connections) == 1 and connections[0].closed
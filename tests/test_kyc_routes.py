@@ -0,0 +1,51 @@
+from io import BytesIO
+
+import pytest
+
+from app import api
+from app.kyc_handler import KYCService, kyc_status_cache
+
+
+@pytest.fixture
+def client():
+    kyc_status_cache.clear()
+    return api.app.test_client()
+
+
+def test_status_route_answers_on_the_request_thread_and_closes_its_connection(client, fake_db):
+    connections = fake_db([], api)
+
+    response = client.get('/api/kyc/status?user_id=5')
+
+    assert response.status_code == 200 and response.get_json()['status'] == 'not_started'
+    assert len(connections) == 1 and connections[0].closed
+
+
+def test_upload_route_closes_its_connection_when_the_service_fails(client, fake_db, monkeypatch):
+    def fail(self, user_id, document_type, file):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(KYCService, 'upload_kyc_document', fail)
+    connections = fake_db([], api)
+
+    response = client.post('/kyc/upload', content_type='multipart/form-data', data={
+        'user_id': '5', 'document_type': 'selfie', 'file': (BytesIO(b'scan'), 'scan.png'),
+    })
+
+    assert response.status_code == 500 and 'disk full' in response.get_json()['message']
+    assert connections[0].closed
+
+
+def test_upload_route_rejects_missing_fields_without_a_connection(client, fake_db):
+    connections = fake_db([], api)
+
+    response = client.post('/kyc/upload', content_type='multipart/form-data', data={'user_id': '5'})
+
+    assert response.status_code == 400 and not connections
+
+
+def test_link_route_closes_its_connection(client, fake_db):
+    connections = fake_db([], api)
+
+    response = client.post('/api/kyc/link-documents', json={'temp_user_id': 'temp_a', 'new_user_id': 5})
+
+    assert response.status_code == 200 and connections[0].closed
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+
+from app.kyc_handler import KYCService, kyc_status_cache
+from conftest import FakeConnection
+
+NOW = datetime(2026, 3, 1)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    kyc_status_cache.clear()
+
+
+def _documents(**owners):
+    """Answer the status UNION with the given {owner: [(document_type, status)]} documents."""
+    def query(params):
+        return [{'source': 'temp' if owner.startswith('temp_') else 'account', 'owner': owner,
+                 'document_type': document_type, 'status': status, 'created_at': NOW, 'updated_at': NOW}
+                for owner in params[::2] for document_type, status in owners.get(owner, [])]
+    return [('AS source', query)]
+
+
+def test_account_and_temp_documents_load_in_one_query_and_are_cached():
+    connection = FakeConnection(_documents(**{'5': [('id_front', 'approved'), ('selfie', 'pending')]}))
+    service = KYCService(connection)
+
+    status = service.get_kyc_status('5', 'temp_x')
+
+    assert status['status'] == 'pending' and len(status['documents']) == 2
+    [(sql, params)] = connection.executed
+    assert sql.count('UNION ALL') == 2 and params == ['5', '5', 'temp_x', 'temp_x', 'temp_5', 'temp_5']
+    assert service.get_kyc_status('5', 'temp_x') == status
+    assert len(connection.executed) == 1
+
+
+def test_only_uncached_keys_are_fetched():
+    kyc_status_cache.set(('account', '5'), [])
+    connection = FakeConnection(_documents(temp_5=[('passport', 'pending')]))
+
+    status = KYCService(connection).get_kyc_status('5')
+
+    assert status['status'] == 'in_progress' and status['documents'][0]['document_type'] == 'passport'
+    [(sql, params)] = connection.executed
+    assert 'UNION ALL' not in sql and params == ['temp_5', 'temp_5']
+
+
+@pytest.mark.parametrize('documents, expected', [
+    ([('id_front', 'approved'), ('selfie', 'rejected')], 'rejected'),
+    ([('id_front', 'approved'), ('selfie', 'approved')], 'approved'),
+    ([], 'not_started'),
+])
+def test_overall_status(documents, expected):
+    connection = FakeConnection(_documents(**{'5': documents}))
+    assert KYCService(connection).get_kyc_status('5')['status'] == expected
+
+
+def test_review_invalidates_the_cached_status():
+    connection = FakeConnection(_documents(**{'5': [('id_front', 'pending')]}))
+    service = KYCService(connection)
+    assert service.get_kyc_status('5')['status'] == 'pending'
+
+    connection.responses = _documents(**{'5': [('id_front', 'approved')]})
+    assert service.verify_document('5', 'id_front', 'approved', verified_by=1)[0]
+
+    assert service.get_kyc_status('5')['status'] == 'approved'
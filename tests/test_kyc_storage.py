@@ -0,0 +1,103 @@
+import hashlib
+import os
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app import kyc_storage
+from app.kyc_handler import KYCService, KYCUploadFile
+from app.kyc_storage import blob_path, collect_kyc_blobs, release_blob, store_blob, track_orphan_blob
+from conftest import FakeConnection
+
+
+@pytest.fixture(autouse=True)
+def blob_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(kyc_storage, 'KYC_BLOB_FOLDER', str(tmp_path / 'blobs'))
+    return tmp_path / 'blobs'
+
+
+def _staged(tmp_path, content):
+    staged = KYCUploadFile(folder=str(tmp_path))
+    staged.write(content)
+    return staged
+
+
+def test_blobs_are_content_addressed_and_deduplicated(tmp_path):
+    connection = FakeConnection()
+    first, second = _staged(tmp_path, b'same scan'), _staged(tmp_path, b'same scan')
+
+    path = store_blob(connection.cursor(), first)
+    assert store_blob(connection.cursor(), second) == path
+
+    sha256 = hashlib.sha256(b'same scan').hexdigest()
+    assert path == os.path.join(kyc_storage.KYC_BLOB_FOLDER, sha256[:2], sha256[2:4], sha256)
+    with open(path, 'rb') as stored:
+        assert stored.read() == b'same scan'
+    # The duplicate only adds a reference; its staged part is discarded
+    assert not os.path.exists(second.path)
+    upserts = connection.statements('INSERT INTO kyc_blobs')
+    assert len(upserts) == 2 and 'ref_count = ref_count + 1, unreferenced_at = NULL' in upserts[0][0]
+
+
+def test_release_drops_one_reference_and_skips_pre_blob_documents():
+    connection = FakeConnection()
+    release_blob(connection.cursor(), None)
+    release_blob(connection.cursor(), 'ab' * 32)
+
+    [(sql, params)] = connection.executed
+    assert params == ('ab' * 32,)
+    assert sql.index('ref_count = ref_count - 1') < sql.index('IF(ref_count = 0, NOW(), NULL)')
+    assert 'ref_count > 0' in sql
+
+
+def test_orphan_of_a_rolled_back_upload_is_recorded_unreferenced(tmp_path):
+    staged = _staged(tmp_path, b'rolled back')
+    store_blob(FakeConnection().cursor(), staged)
+    connection = FakeConnection()
+
+    track_orphan_blob(connection, staged.sha256)
+    track_orphan_blob(connection, 'cd' * 32)
+
+    [(sql, params)] = connection.executed
+    assert 'INSERT IGNORE' in sql and params == (staged.sha256, blob_path(staged.sha256), len(b'rolled back'))
+    assert connection.commits == 1
+
+
+def test_collector_unlinks_expired_blobs_while_holding_their_locks(tmp_path, fake_db):
+    staged = _staged(tmp_path, b'expired')
+    path = store_blob(FakeConnection().cursor(), staged)
+    gone = blob_path('ef' * 32)
+    connections = fake_db([('FROM kyc_blobs', [
+        {'sha256': staged.sha256, 'file_path': path, 'size': 7},
+        {'sha256': 'ef' * 32, 'file_path': gone, 'size': 3},
+    ])], kyc_storage)
+
+    assert collect_kyc_blobs() == 2
+
+    connection = connections[0]
+    select_sql, params = connection.executed[0]
+    assert 'SKIP LOCKED' in select_sql and params == (kyc_storage.KYC_BLOB_GC_GRACE, kyc_storage.KYC_BLOB_GC_BATCH)
+    [(delete_sql, hashes)] = connection.statements('DELETE FROM kyc_blobs')
+    assert 'ref_count = 0' in delete_sql and hashes == [staged.sha256, 'ef' * 32]
+    assert not os.path.exists(path) and connection.commits == 1 and connection.closed
+
+
+def test_collector_with_nothing_to_reclaim(fake_db):
+    connections = fake_db([], kyc_storage)
+    assert collect_kyc_blobs() == 0
+    assert connections[0].rollbacks == 1 and connections[0].closed
+
+
+def test_replacing_a_document_moves_its_reference_to_the_new_blob():
+    connection = FakeConnection([('SELECT id, file_sha256 FROM kyc_documents', [{'id': 4, 'file_sha256': 'old'}])])
+    upload = FileStorage(BytesIO(b'new scan'), filename='id.png')
+
+    assert KYCService(connection).upload_kyc_document(9, 'id_front', upload)[0]
+
+    statements = [sql for sql, _ in connection.executed]
+    reference = next(i for i, sql in enumerate(statements) if 'INSERT INTO kyc_blobs' in sql)
+    release = next(i for i, sql in enumerate(statements) if 'ref_count = ref_count - 1' in sql)
+    assert reference < release and connection.executed[release][1] == ('old',)
+    _, params = connection.statements('UPDATE kyc_documents')[0]
+    assert params[1] == hashlib.sha256(b'new scan').hexdigest() and connection.commits == 1
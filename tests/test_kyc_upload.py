@@ -0,0 +1,79 @@
+import hashlib
+import os
+from io import BytesIO
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from app import api, kyc_handler, kyc_storage
+from app.kyc_handler import KYCUploadFile
+
+
+@pytest.fixture
+def blob_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(kyc_storage, 'KYC_BLOB_FOLDER', str(tmp_path / 'blobs'))
+    return tmp_path / 'blobs'
+
+
+def _staged_parts():
+    return [name for name in os.listdir(kyc_handler.KYC_STAGING_FOLDER) if name.endswith('.part')]
+
+
+def test_upload_file_hashes_and_counts_as_it_writes(tmp_path):
+    staged = KYCUploadFile(folder=str(tmp_path), max_bytes=100)
+    staged.write(b'front ')
+    staged.write(b'of the card')
+
+    assert staged.size == 17
+    assert staged.sha256 == hashlib.sha256(b'front of the card').hexdigest()
+    destination = tmp_path / 'stored'
+    staged.persist(str(destination))
+    staged.close()
+    assert destination.read_bytes() == b'front of the card' and staged.closed
+    assert not list(tmp_path.glob('*.part'))
+
+
+def test_oversized_upload_is_refused_and_its_part_removed(tmp_path):
+    staged = KYCUploadFile(folder=str(tmp_path), max_bytes=8)
+    staged.write(b'12345')
+
+    with pytest.raises(RequestEntityTooLarge):
+        staged.write(b'67890')
+
+    assert staged.closed and not os.path.exists(staged.path)
+
+
+def test_closing_an_unpersisted_part_deletes_it(tmp_path):
+    staged = KYCUploadFile(folder=str(tmp_path))
+    staged.write(b'abandoned')
+    staged.close()
+    staged.close()
+    assert not os.path.exists(staged.path)
+
+
+def test_upload_route_streams_the_part_into_its_blob(fake_db, blob_folder):
+    content = b'%PDF-1.4 streamed upload'
+    connections = fake_db([('FROM temp_kyc_documents', [])], api)
+
+    response = api.app.test_client().post('/kyc/upload', content_type='multipart/form-data', data={
+        'user_id': 'temp_stream', 'document_type': 'passport', 'file': (BytesIO(content), 'scan.pdf'),
+    })
+
+    assert response.status_code == 200 and response.get_json()['success']
+    sha256 = hashlib.sha256(content).hexdigest()
+    with open(kyc_storage.blob_path(sha256), 'rb') as stored:
+        assert stored.read() == content
+    [(_, params)] = connections[0].statements('INSERT INTO kyc_blobs')
+    assert params == (sha256, kyc_storage.blob_path(sha256), len(content))
+    assert not _staged_parts()
+
+
+def test_upload_route_rejects_bodies_over_the_cap_before_touching_the_database(fake_db, monkeypatch):
+    monkeypatch.setattr(api, 'KYC_MAX_REQUEST_BYTES', 1024)
+    connections = fake_db([], api)
+
+    response = api.app.test_client().post('/kyc/upload', content_type='multipart/form-data', data={
+        'user_id': 'temp_big', 'document_type': 'passport', 'file': (BytesIO(b'x' * 4096), 'scan.pdf'),
+    })
+
+    assert response.status_code == 413 and not connections
@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+from app import ledger
+from app.ledger import append_entries, compact_ledger, lock_balances, pending_balances
+from app.money import Money
+from conftest import FakeConnection
+
+
+def test_append_entries_inserts_exact_decimals_in_one_statement():
+    connection = FakeConnection()
+    with connection.cursor() as cursor:
+        count = append_entries(cursor, [('W1', -Money(150_000_000, 'TNC'), 'transfer_out', 'tx1'),
+                                        ('W2', Money(150_000_000, 'TNC'), 'transfer_in', 'tx1')])
+        assert append_entries(cursor, []) == 0
+
+    assert count == 2
+    [(_, rows)] = connection.statements('INSERT INTO tnc_ledger')
+    assert rows == [('W1', Decimal('-1.50000000'), 'transfer_out', 'tx1'),
+                    ('W2', Decimal('1.50000000'), 'transfer_in', 'tx1')]
+
+
+def test_lock_balances_locks_in_id_order_and_adds_the_tail():
+    connection = FakeConnection([
+        ('SELECT tnc_wallet_id, balance', [{'tnc_wallet_id': 'A', 'balance': Decimal('10.5')},
+                                           {'tnc_wallet_id': 'B', 'balance': None}]),
+        ('SUM(amount) AS pending', [{'tnc_wallet_id': 'A', 'pending': Decimal('-0.25')},
+                                    {'tnc_wallet_id': 'Z', 'pending': Decimal('3')}]),
+    ])
+    with connection.cursor() as cursor:
+        balances = lock_balances(cursor, ['B', 'A', 'B'])
+
+    assert balances == {'A': Money.parse('10.25', 'TNC'), 'B': Money.zero('TNC')}
+    lock_sql, params = connection.executed[0]
+    assert params == ['A', 'B'] and lock_sql.endswith('FOR UPDATE')
+    assert connection.executed[1][0].endswith('LOCK IN SHARE MODE')
+    assert lock_balances(connection.cursor(), []) == {}
+
+
+def test_pending_balances_do_not_lock():
+    connection = FakeConnection([('SUM(amount) AS pending', [{'tnc_wallet_id': 'A', 'pending': Decimal('2')}])])
+    assert pending_balances(connection.cursor(), ['A']) == {'A': Money.parse('2', 'TNC')}
+    assert 'FOR UPDATE' not in connection.executed[0][0] and 'SHARE MODE' not in connection.executed[0][0]
+
+
+def test_compaction_folds_only_the_entries_it_read(fake_db):
+    connections = fake_db([
+        ('SELECT DISTINCT tnc_wallet_id', [{'tnc_wallet_id': 'B'}, {'tnc_wallet_id': 'A'}, {'tnc_wallet_id': 'GONE'}]),
+        ('SELECT balance FROM tnc_wallets', lambda params: [] if params[0] == 'GONE' else [{'balance': 1}]),
+        ('SELECT id, amount FROM tnc_ledger', lambda params: {
+            'A': [{'id': 1, 'amount': Decimal('2.5')}, {'id': 4, 'amount': Decimal('-1')}],
+            'B': [{'id': 2, 'amount': Decimal('0.00000001')}],
+        }[params[0]]),
+    ], ledger)
+
+    assert compact_ledger() == 3
+
+    connection = connections[0]
+    snapshots = connection.statements('UPDATE tnc_wallets SET balance = balance +')
+    assert [params for _, params in snapshots] == [(Decimal('1.50000000'), 'A'), (Decimal('1E-8'), 'B')]
+    marked = connection.statements('UPDATE tnc_ledger SET compacted = 1')
+    assert [params for _, params in marked] == [[1, 4], [2]]
+    # One commit for the wallet list and one per compacted wallet; the unknown wallet is rolled back
+    assert connection.commits == 3 and connection.rollbacks == 1 and connection.closed
+
+
+def test_compaction_failure_of_one_wallet_does_not_stop_the_others(fake_db):
+    def entries(params):
+        if params[0] == 'A':
+            raise RuntimeError("lock wait timeout")
+        return [{'id': 9, 'amount': Decimal('1')}]
+    connections = fake_db([
+        ('SELECT DISTINCT tnc_wallet_id', [{'tnc_wallet_id': 'A'}, {'tnc_wallet_id': 'B'}]),
+        ('SELECT balance FROM tnc_wallets', [{'balance': 0}]),
+        ('SELECT id, amount FROM tnc_ledger', entries),
+    ], ledger)
+
+    assert compact_ledger() == 1
+    assert connections[0].rollbacks == 1
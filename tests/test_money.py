@@ -0,0 +1,66 @@
+import time
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+from app.money import Money, to_fraction
+
+
+@pytest.mark.parametrize('value, currency, units', [
+    ('1.5', 'ETH', 15 * 10 ** 17),
+    ('0.00000001', 'BTC', 1),
+    (Decimal('12.34'), 'EUR', 1234),
+    (3, 'USDT', 3_000_000),
+    (0.1, 'TNC', 10_000_000),
+    ('1e-6', 'USDT', 1),
+    ('-2.5', 'EUR', -250),
+])
+def test_parse_to_minor_units(value, currency, units):
+    assert Money.parse(value, currency).units == units
+
+
+@pytest.mark.parametrize('value', ['0.001', '1e-3'])
+def test_parse_rejects_more_decimals_than_the_currency_has(value):
+    with pytest.raises(ValueError, match='more than 2 decimals'):
+        Money.parse(value, 'EUR')
+
+
+@pytest.mark.parametrize('value', ['abc', '', None, 'Infinity', '-inf', 'NaN', 'sNaN', float('inf'), float('nan')])
+def test_parse_rejects_non_numbers(value):
+    with pytest.raises(ValueError):
+        Money.parse(value, 'ETH')
+
+
+@pytest.mark.parametrize('value', ['1e10000000', '1e-10000000', '9' * 61, '1e41'])
+def test_parse_rejects_out_of_range_values_quickly(value):
+    started = time.monotonic()
+    with pytest.raises(ValueError, match='out of range'):
+        Money.parse(value, 'ETH')
+    assert time.monotonic() - started < 0.1
+
+
+def test_zero_with_a_large_exponent_is_still_zero():
+    assert to_fraction('0e10000000') == 0
+
+
+def test_unknown_currency_is_rejected():
+    with pytest.raises(ValueError, match='Unsupported currency'):
+        Money(1, 'DOGE')
+
+
+def test_exchange_and_percentages_round_down():
+    one_eth = Money.parse('1', 'ETH')
+    assert one_eth.exchange(Fraction(1, 3), 'TNC') == Money(33_333_333, 'TNC')
+    assert Money(100, 'TNC').add_percentage('12.5') == Money(112, 'TNC')
+    assert Money(7, 'EUR').scale(Fraction(1, 2)) == Money(3, 'EUR')
+    assert Money.from_fraction(Fraction(2, 3), 'EUR') == Money(67, 'EUR')
+
+
+def test_arithmetic_and_formatting():
+    total = Money.parse('1.10', 'EUR') + Money.parse('2.05', 'EUR')
+    assert str(total) == '3.15' and total.to_decimal() == Decimal('3.15')
+    assert str(-Money(5, 'BTC')) == '-0.00000005'
+    assert Money(1, 'EUR') < Money(2, 'EUR') and not Money.zero('EUR')
+    with pytest.raises(TypeError):
+        Money(1, 'EUR') + Money(1, 'ETH')
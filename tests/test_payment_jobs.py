@@ -0,0 +1,129 @@
+import json
+from fractions import Fraction
+
+import pytest
+
+from app import payment_jobs, wallet_communications
+from app.money import Money
+from app.wallet_communications import NOT_A_PAYMENT, SENDER_NOT_BUYER, WRONG_RECEIVER
+
+
+def _job_row(status, job_id=7, user_id=1, result=None):
+    return {'id': job_id, 'user_id': user_id, 'tx_hash': '0xabc', 'payment_method': 'ETH', 'status': status,
+            'attempts': 0, 'result': json.dumps(result) if result else None, 'last_error': None,
+            'created_at': None, 'updated_at': None}
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    payment_jobs.finished_jobs.clear()
+    wallet_communications.terminal_payment_results.clear()
+
+
+def test_enqueue_returns_the_job_and_requeues_failed_ones(fake_db):
+    connections = fake_db([
+        ('INSERT INTO payment_verification_jobs', {'rowcount': 2, 'lastrowid': 7}),
+        ('SELECT', [_job_row('queued')]),
+    ], payment_jobs)
+    payment_jobs._remember_finished({**_job_row('failed'), 'job_id': 7})
+
+    job = payment_jobs.enqueue_verification_job(1, '0xabc', 'ETH')
+
+    assert job['job_id'] == 7 and job['status'] == 'queued'
+    assert 'user_id' not in job
+    insert_sql = connections[0].statements('INSERT INTO payment_verification_jobs')[0][0]
+    # Reset last, so the other assignments still see the failed status
+    assert insert_sql.rstrip().endswith("status = IF(status = 'failed', 'queued', status)")
+    # The remembered failure no longer short-circuits polls
+    assert payment_jobs.get_finished_job(1, tx_hash='0xabc') is None
+    assert connections[0].commits == 1 and connections[0].closed
+
+
+def test_finished_jobs_are_remembered_per_user(fake_db):
+    fake_db([('SELECT', [_job_row('completed', result={'status': 'confirmed'})])], payment_jobs)
+    payment_jobs.get_job(7, 1)
+
+    assert payment_jobs.get_finished_job(1, tx_hash='0xabc')['status'] == 'completed'
+    assert payment_jobs.get_finished_job(2, tx_hash='0xabc') is None
+
+
+@pytest.mark.parametrize('result, expected', [
+    ({'status': 'confirmed'}, ('finish', 'completed')),
+    ({'status': 'failed'}, ('finish', 'failed')),
+    ({'status': 'error', 'message': SENDER_NOT_BUYER}, ('finish', 'failed')),
+    ({'status': 'error', 'message': WRONG_RECEIVER}, ('finish', 'failed')),
+    ({'status': 'error', 'message': NOT_A_PAYMENT}, ('finish', 'failed')),
+    ({'status': 'error', 'message': 'Transaction not found or invalid transaction hash'}, ('retry', None)),
+    ({'status': 'pending', 'confirmations': 3}, ('retry', None)),
+    ({'status': 'unavailable', 'retry_after': 30}, ('retry', None)),
+])
+def test_process_job_outcomes(monkeypatch, result, expected):
+    calls = []
+    monkeypatch.setattr(payment_jobs, 'verify_payment', lambda job: result)
+    monkeypatch.setattr(payment_jobs, '_finish_job', lambda job_id, status, *a: calls.append(('finish', status)))
+    monkeypatch.setattr(payment_jobs, '_retry_job', lambda *a: calls.append(('retry', None)))
+
+    payment_jobs.process_job({'id': 7, 'tx_hash': '0xabc', 'attempts': 1})
+
+    assert calls == [expected]
+
+
+def test_process_job_gives_up_after_max_attempts(monkeypatch):
+    calls = []
+    monkeypatch.setattr(payment_jobs, 'verify_payment', lambda job: {'status': 'pending'})
+    monkeypatch.setattr(payment_jobs, '_finish_job', lambda job_id, status, *a: calls.append(status))
+    monkeypatch.setattr(payment_jobs, '_retry_job', lambda *a: calls.append('retry'))
+
+    payment_jobs.process_job({'id': 7, 'tx_hash': '0xabc', 'attempts': payment_jobs.PAYMENT_JOB_MAX_ATTEMPTS})
+
+    assert calls == ['failed']
+
+
+def test_payment_is_not_credited_to_another_submitter(fake_db, monkeypatch):
+    connections = fake_db([], wallet_communications)
+    monkeypatch.setattr(wallet_communications, 'get_user_id_by_wallet_address', lambda address: 5)
+
+    ok, message, credit = wallet_communications.store_transaction_in_db(
+        '0xabc', Money(10, 'ETH'), 'ETH', '0xsender', Money(100, 'TNC'), buyer_id=6)
+
+    assert (ok, message, credit) == (False, SENDER_NOT_BUYER, None)
+    assert not any(connection.executed for connection in connections)
+
+
+def test_check_payment_outcomes_are_kept_per_submitter(monkeypatch):
+    lookups = []
+
+    def lookup(tx_hash, promo_code, buyer_id):
+        lookups.append(buyer_id)
+        return {'status': 'confirmed'} if buyer_id == 5 else {'status': 'error', 'message': SENDER_NOT_BUYER}
+    monkeypatch.setattr(wallet_communications, 'get_transaction_status', lookup)
+
+    assert wallet_communications.check_payment('0xabc', 'ETH', None, 6)['status'] == 'error'
+    assert wallet_communications.check_payment('0xabc', 'ETH', None, 5)['status'] == 'confirmed'
+    assert wallet_communications.check_payment('0xabc', 'ETH', None, 5)['status'] == 'confirmed'
+    assert wallet_communications.check_payment('0xabc', 'ETH', None, 6)['status'] == 'error'
+    assert lookups == [6, 5, 6]
+
+
+def _mined(transaction):
+    transaction = {'from': '0xsender', 'value': hex(10 ** 18), 'blockNumber': hex(100), **transaction}
+    return lambda batcher, tx_hash: (transaction, {'status': '0x1'}, 200)
+
+
+def test_wrong_receiver_is_a_terminal_error(monkeypatch):
+    monkeypatch.setattr(wallet_communications, 'get_transaction_bundle', _mined({'to': '0x' + '22' * 20}))
+    monkeypatch.setattr(wallet_communications, 'RECEIVER_ADDRESS', '0x' + '11' * 20)
+    monkeypatch.setattr(wallet_communications, 'get_tanacoin_rates_in_crypto', lambda: (Fraction(1),) * 4)
+
+    result = wallet_communications.get_transaction_status('0xabc', buyer_id=5)
+
+    assert result == {'status': 'error', 'message': WRONG_RECEIVER}
+
+
+def test_contract_creation_is_not_reported_as_a_payment(monkeypatch):
+    monkeypatch.setattr(wallet_communications, 'get_transaction_bundle', _mined({'to': None}))
+    monkeypatch.setattr(wallet_communications, 'get_tanacoin_rates_in_crypto', lambda: (Fraction(1),) * 4)
+
+    result = wallet_communications.get_transaction_status('0xabc', buyer_id=5)
+
+    assert result['status'] == 'error' and result['message'] == NOT_A_PAYMENT
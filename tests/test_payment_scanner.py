@@ -0,0 +1,146 @@
+from fractions import Fraction
+
+import pytest
+
+from app import payment_scanner
+from app.eth_rpc import JsonRpcError
+from app.payment_scanner import PaymentScanner
+from app.wallet_communications import NO_LINKED_USER
+
+RECEIVER = '0x' + '11' * 20
+
+
+class FakeChain:
+    """Blocks 100..head, each holding one ETH payment to RECEIVER."""
+
+    def __init__(self, head=120, fail_logs=False):
+        self.head = head
+        self.fail_logs = fail_logs
+
+    def call(self, method, *params):
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        raise AssertionError(method)
+
+    def batch(self, calls):
+        if self.fail_logs:
+            raise OSError("node overloaded")
+        results = []
+        for method, params in calls:
+            if method == 'eth_getBlockByNumber':
+                number = int(params[0], 16)
+                results.append({'transactions': [{'hash': f'0x{number:x}', 'from': '0xpayer', 'to': RECEIVER,
+                                                  'value': hex(10 ** 18), 'blockNumber': params[0]}]})
+            else:
+                results.append({'status': '0x1'})
+        return results
+
+
+@pytest.fixture
+def scanner_env(monkeypatch, fake_db):
+    checkpoints, credited = [], []
+    fake_db([], payment_scanner)
+    monkeypatch.setattr(payment_scanner, 'RECEIVER_ADDRESS', RECEIVER)
+    monkeypatch.setattr(payment_scanner, 'RECEIVER_USDT_ADDRESS', None)
+    monkeypatch.setattr(payment_scanner, 'save_checkpoint', checkpoints.append)
+    monkeypatch.setattr(payment_scanner, 'get_tanacoin_rates_in_crypto', lambda: (1, Fraction(1, 1000), 1, 1))
+    return checkpoints, credited
+
+
+def _store(credited, outcome):
+    def store(tx_hash, *args, **kwargs):
+        credited.append(tx_hash)
+        return outcome
+    return store
+
+
+def test_range_is_checkpointed_after_crediting(monkeypatch, scanner_env):
+    checkpoints, credited = scanner_env
+    monkeypatch.setattr(payment_scanner, 'store_transaction_in_db', _store(credited, (True, 'stored', {})))
+    scanner = PaymentScanner(FakeChain(), min_batch=3, max_batch=3, confirmations=12)
+
+    assert scanner.scan_once(99) == 102
+    assert credited == ['0x64', '0x65', '0x66'] and checkpoints == [102]
+
+
+def test_unlinked_senders_do_not_hold_the_scanner_back(monkeypatch, scanner_env):
+    checkpoints, credited = scanner_env
+    monkeypatch.setattr(payment_scanner, 'store_transaction_in_db', _store(credited, (False, NO_LINKED_USER, None)))
+    scanner = PaymentScanner(FakeChain(), min_batch=2, max_batch=2, confirmations=1)
+
+    assert scanner.scan_once(99) == 101
+    assert checkpoints == [101]
+
+
+def test_failed_credit_keeps_the_checkpoint(monkeypatch, scanner_env):
+    checkpoints, credited = scanner_env
+    monkeypatch.setattr(payment_scanner, 'store_transaction_in_db', _store(credited, (False, 'deadlock', None)))
+    scanner = PaymentScanner(FakeChain(), min_batch=2, max_batch=2, confirmations=1)
+
+    with pytest.raises(RuntimeError, match='deadlock'):
+        scanner.scan_once(99)
+    assert checkpoints == []
+
+
+def test_rpc_failure_shrinks_the_range_and_retries_it(monkeypatch, scanner_env):
+    checkpoints, _ = scanner_env
+    scanner = PaymentScanner(FakeChain(fail_logs=True), min_batch=1, max_batch=64, confirmations=1)
+    scanner.batch_size = 16
+
+    assert scanner.scan_once(99) == 99
+    assert scanner.batch_size == 8 and checkpoints == []
+
+
+def test_caught_up_scanner_waits_for_confirmations(scanner_env):
+    checkpoints, _ = scanner_env
+    scanner = PaymentScanner(FakeChain(head=120), confirmations=12)
+    assert scanner.scan_once(109) == 109
+    assert checkpoints == []
+
+
+def test_node_error_on_a_single_block_is_raised(monkeypatch, scanner_env):
+    chain = FakeChain()
+    monkeypatch.setattr(chain, 'batch', lambda calls: [JsonRpcError('eth_getBlockByNumber', {'message': 'gone'})])
+    scanner = PaymentScanner(chain, min_batch=1, max_batch=1, confirmations=1)
+    with pytest.raises(JsonRpcError):
+        scanner.scan_once(99)
+
+
+def test_hashes_with_an_open_job_are_deferred_to_it(monkeypatch, scanner_env, fake_db):
+    checkpoints, credited = scanner_env
+    monkeypatch.setattr(payment_scanner, 'store_transaction_in_db', _store(credited, (True, 'stored', {})))
+    connections = fake_db([('FROM payment_verification_jobs', [{'tx_hash': '0x65'}])], payment_scanner)
+    scanner = PaymentScanner(FakeChain(), min_batch=3, max_batch=3, confirmations=12)
+
+    assert scanner.scan_once(99) == 102
+
+    assert credited == ['0x64', '0x66'] and checkpoints == [102]
+    jobs_sql, hashes = connections[0].executed[0]
+    assert "status IN ('queued', 'running')" in jobs_sql and hashes == ['0x64', '0x65', '0x66']
+    [(_, deferred)] = connections[1].statements('INSERT IGNORE INTO payment_scanner_deferred')
+    assert deferred == [('0x65', 'ETH', '0xpayer', 10 ** 18, 101)]
+
+
+def test_deferred_payments_are_credited_once_their_jobs_close(monkeypatch, scanner_env, fake_db):
+    _, credited = scanner_env
+    monkeypatch.setattr(payment_scanner, 'store_transaction_in_db', _store(credited, (True, 'stored', {})))
+    connections = fake_db([('FROM payment_scanner_deferred d', [
+        {'tx_hash': '0x65', 'currency': 'ETH', 'sender': '0xpayer', 'units': 10 ** 18, 'block_number': 101},
+    ])], payment_scanner)
+
+    assert PaymentScanner(FakeChain()).credit_deferred() == 1
+
+    assert credited == ['0x65']
+    ready_sql, _ = connections[0].executed[0]
+    assert 'NOT EXISTS' in ready_sql
+    [(_, dropped)] = connections[1].statements('DELETE FROM payment_scanner_deferred')
+    assert dropped == ('0x65',) and connections[1].commits == 1
+
+
+def test_standalone_scanner_is_opt_in(monkeypatch):
+    monkeypatch.setattr(payment_scanner, 'PAYMENT_SCANNER_ENABLED', False)
+    monkeypatch.setattr(PaymentScanner, 'run', lambda self, stop, once=False: pytest.fail("scanner started"))
+
+    with pytest.raises(SystemExit) as exited:
+        payment_scanner.main(['--once'])
+    assert exited.value.code == 1
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pymysql
+import pytest
+
+from app import promo_archive, promo_cache, user_management
+from app.promo_archive import ensure_archive_partitions, sweep_promo_codes
+from app.user_management import get_promo_codes_by_creator
+from conftest import FakeConnection
+
+BASE = datetime(2026, 3, 1, 12, 0)
+
+
+def _promo_rows(codes):
+    return [{'code': code, 'added_tnc_percentage': Decimal('10.00'), 'start_date': BASE, 'end_date': BASE,
+             'spender_id': None, 'created_at': BASE + timedelta(minutes=minute)} for code, minute in codes]
+
+
+LIVE = _promo_rows([('L5', 5), ('L3', 3), ('L1', 1)])
+ARCHIVED = _promo_rows([('A4', 4), ('A2', 2), ('A0', 0)])
+
+
+def _table(rows):
+    """Answer the creator listing like MySQL would: keyset, newest first, optional LIMIT."""
+    def query(params):
+        params = list(params[1:])
+        matching = rows
+        if len(params) >= 3:
+            created_at, _, code = params[:3]
+            matching = [row for row in rows
+                        if (row['created_at'], row['code']) < (created_at, code)]
+            params = params[3:]
+        return matching[:params[0]] if params else matching
+    return query
+
+
+@pytest.fixture
+def listing(fake_db):
+    return fake_db([
+        ('FROM promo_codes_archive', _table(ARCHIVED)),
+        ('FROM promo_codes WHERE', _table(LIVE)),
+    ], user_management)
+
+
+def test_creator_listing_is_unpaged_by_default(listing):
+    codes, next_cursor = get_promo_codes_by_creator(7)
+
+    assert [row['code'] for row in codes] == ['L5', 'A4', 'L3', 'A2', 'L1', 'A0']
+    assert [row['archived'] for row in codes[:2]] == [False, True]
+    assert next_cursor is None
+    assert all('LIMIT' not in sql for sql, _ in listing[0].executed)
+
+
+def test_keyset_pages_walk_live_and_archived_codes(listing):
+    seen, cursor_token = [], None
+    while True:
+        page, cursor_token = get_promo_codes_by_creator(7, limit=4, cursor_token=cursor_token)
+        seen.append([row['code'] for row in page])
+        if cursor_token is None:
+            break
+
+    assert seen == [['L5', 'A4', 'L3', 'A2'], ['L1', 'A0']]
+    sql, params = listing[1].statements('FROM promo_codes WHERE')[0]
+    assert 'created_at < %s OR (created_at = %s AND code < %s)' in sql
+    assert params == [7, BASE + timedelta(minutes=2), BASE + timedelta(minutes=2), 'A2', 5]
+    assert all(connection.closed for connection in listing)
+
+
+def test_cursor_alone_uses_the_default_page_size(listing, monkeypatch):
+    monkeypatch.setattr(user_management, 'PROMO_PAGE_SIZE', 1)
+    _, cursor_token = get_promo_codes_by_creator(7, limit=1)
+
+    page, _ = get_promo_codes_by_creator(7, cursor_token=cursor_token)
+
+    assert [row['code'] for row in page] == ['A4']
+
+
+def test_malformed_cursor_is_rejected(listing):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        get_promo_codes_by_creator(7, cursor_token='not-a-cursor')
+
+
+EXPIRED = [{'id': 11, 'code': 'OLD1', 'added_tnc_percentage': Decimal('5.00'), 'start_date': BASE,
+            'end_date': BASE, 'creator_id': 3, 'spender_id': None, 'created_at': BASE}]
+
+
+def test_sweep_moves_expired_unredeemed_codes_with_their_id(fake_db, monkeypatch):
+    monkeypatch.setattr(promo_archive, '_partitioning_unsupported', False)
+    promo_cache.promo_metadata.set('OLD1', {'cached': True})
+    connections = fake_db([
+        ('INFORMATION_SCHEMA.PARTITIONS', [{'PARTITION_NAME': 'p_future'}]),
+        ('FROM promo_codes WHERE end_date < NOW()', EXPIRED),
+    ], promo_archive)
+
+    assert sweep_promo_codes() == 1
+
+    connection = connections[0]
+    select_sql, _ = connection.statements('FROM promo_codes WHERE end_date')[0]
+    assert 'spender_id IS NULL' in select_sql and 'SKIP LOCKED' in select_sql
+    [(_, archived)] = connection.statements('INSERT INTO promo_codes_archive')
+    assert archived == [(11, 'OLD1', Decimal('5.00'), BASE, BASE, 3, None, BASE)]
+    [(_, deleted)] = connection.statements('DELETE FROM promo_codes')
+    assert deleted == ['OLD1']
+    assert connection.commits == 1 and connection.closed
+    assert promo_cache.promo_metadata.get('OLD1') is None
+
+
+def test_partitions_are_created_once_per_upcoming_month(monkeypatch):
+    monkeypatch.setattr(promo_archive, '_partitioning_unsupported', False)
+    connection = FakeConnection([('INFORMATION_SCHEMA.PARTITIONS', [])])
+
+    assert ensure_archive_partitions(connection)
+
+    reorganized = connection.statements('REORGANIZE PARTITION p_future')
+    assert len(connection.statements('PARTITION BY RANGE')) == 1
+    assert len(reorganized) == promo_archive.PROMO_ARCHIVE_MONTHS_AHEAD + 1
+
+
+def test_unsupported_partitioning_is_not_retried(monkeypatch):
+    monkeypatch.setattr(promo_archive, '_partitioning_unsupported', False)
+
+    def refuse(params):
+        raise pymysql.OperationalError(1505, "Partitioning not supported")
+    connection = FakeConnection([('PARTITION BY RANGE', refuse)])
+
+    assert not ensure_archive_partitions(connection)
+    assert not ensure_archive_partitions(connection)
+    assert len(connection.statements('INFORMATION_SCHEMA.PARTITIONS')) == 1
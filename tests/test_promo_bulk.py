@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pymysql
+import pytest
+
+from app import promo_bulk
+from app.promo_bulk import create_promo_codes_bulk, parse_bulk_request
+from app.self_utils import PROMO_CODE_ALPHABET, random_promo_code
+
+START, END = datetime(2026, 1, 1), datetime(2026, 4, 1)
+
+
+def test_random_codes_use_the_alphabet_and_length():
+    codes = {random_promo_code(12) for _ in range(200)}
+    assert len(codes) == 200
+    assert all(len(code) == 12 and set(code) <= set(PROMO_CODE_ALPHABET) for code in codes)
+
+
+@pytest.fixture
+def scripted_codes(monkeypatch):
+    """Make random_promo_code return the given codes in order."""
+    def install(*codes):
+        sequence = iter(codes)
+        monkeypatch.setattr(promo_bulk, 'random_promo_code', lambda length: next(sequence))
+    return install
+
+
+def test_codes_taken_live_or_archived_are_redrawn(fake_db, scripted_codes):
+    scripted_codes('LIVE', 'AAAA', 'ARCH', 'BBBB', 'CCCC')
+    taken = {'LIVE', 'ARCH'}
+    connections = fake_db([
+        ('FROM promo_codes_archive', lambda params: [{'code': c} for c in params[:len(params) // 2] if c in taken]),
+    ], promo_bulk)
+
+    created, error = create_promo_codes_bulk(3, 10, START, END, creator_id=1, chunk_size=3)
+
+    assert error is None and sorted(created) == ['AAAA', 'BBBB', 'CCCC']
+    existing_sql, _ = connections[0].statements('FROM promo_codes_archive')[0]
+    assert 'UNION' in existing_sql
+    [(_, rows)] = connections[0].statements('INSERT INTO promo_codes')
+    assert sorted(row[0] for row in rows) == ['AAAA', 'BBBB', 'CCCC']
+    assert rows[0][1:] == (10, START, END, 1)
+    assert connections[0].commits == 1
+
+
+def test_chunk_colliding_with_a_concurrent_insert_is_redrawn(fake_db, scripted_codes):
+    scripted_codes('AAAA', 'BBBB')
+    attempts = []
+
+    def insert(params):
+        attempts.append([row[0] for row in params])
+        if len(attempts) == 1:
+            raise pymysql.IntegrityError(promo_bulk.DUPLICATE_ENTRY, "Duplicate entry")
+        return {'rowcount': len(params)}
+    connections = fake_db([('INSERT INTO promo_codes', insert)], promo_bulk)
+
+    created, error = create_promo_codes_bulk(1, 10, START, END, creator_id=1)
+
+    assert (created, error) == (['BBBB'], None)
+    assert attempts == [['AAAA'], ['BBBB']]
+    assert connections[0].rollbacks == 1 and connections[0].commits == 1
+
+
+def test_database_error_returns_the_codes_created_so_far(fake_db, scripted_codes):
+    scripted_codes('AAAA', 'BBBB')
+    calls = []
+
+    def insert(params):
+        calls.append(params)
+        if len(calls) == 2:
+            raise pymysql.OperationalError(2013, "Lost connection")
+        return {'rowcount': len(params)}
+    fake_db([('INSERT INTO promo_codes', insert)], promo_bulk)
+
+    created, error = create_promo_codes_bulk(2, 10, START, END, creator_id=1, chunk_size=1)
+
+    assert created == ['AAAA'] and 'Lost connection' in error
+
+
+def test_parse_bulk_request_defaults_and_bounds():
+    campaign = parse_bulk_request({'count': '5', 'start_date': '2026-01-01', 'days': 30}, default_creator_id=4)
+    assert campaign['count'] == 5 and campaign['creator_id'] == 4 and campaign['added_tnc_percentage'] == 10
+    assert (campaign['end_date'] - campaign['start_date']).days == 30
+
+    for body in ({'count': 0}, {'count': 1, 'added_tnc_percentage': 150}, {'count': 1, 'length': 4},
+                 {'count': 'many'}, {'count': 1, 'start_date': '2026-02-01', 'end_date': '2026-01-01'}):
+        with pytest.raises(ValueError):
+            parse_bulk_request(body, default_creator_id=4)
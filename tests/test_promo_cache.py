@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import handle_token, promo_cache
+from app.handle_token import check_promocode_status
+from app.promo_cache import BloomFilter, PromoCodeFilter
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(capacity=2000, error_rate=0.01)
+    for i in range(2000):
+        bloom.add(f"CODE{i}")
+    assert all(f"CODE{i}" in bloom for i in range(2000))
+    false_positives = sum(f"OTHER{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_filter_lets_everything_through_until_loaded(fake_db, monkeypatch):
+    promo_filter = PromoCodeFilter()
+    monkeypatch.setattr(promo_filter, '_load_in_background', lambda: None)
+    assert promo_filter.might_exist('ANY')
+
+    fake_db([('SELECT NOW()', [{'now': datetime(2026, 1, 1)}]),
+             ('SELECT code FROM promo_codes', [{'code': 'KNOWN'}])], promo_cache)
+    promo_filter._load()
+
+    assert promo_filter.might_exist('KNOWN')
+    assert not promo_filter.might_exist('NEVER-CREATED')
+    promo_filter.add('NEW')
+    assert promo_filter.might_exist('NEW')
+    assert promo_filter.stats()['rejected_lookups'] == 1
+
+
+@pytest.fixture
+def loaded_filter(monkeypatch):
+    promo_filter = PromoCodeFilter()
+    promo_filter._filter = BloomFilter(1000, 0.001)
+    promo_filter._loaded_at = promo_filter._last_sync = float('inf')
+    promo_filter.add('CODE')
+    monkeypatch.setattr(handle_token, 'promo_filter', promo_filter)
+    promo_cache.promo_metadata.clear()
+    return promo_filter
+
+
+def _row(**overrides):
+    now = datetime.now()
+    row = {'status': 'valid', 'added_tnc_percentage': '10.00', 'creator_id': 3, 'spender_id': None,
+           'start_date': now - timedelta(days=1), 'end_date': now + timedelta(days=1)}
+    row.update(overrides)
+    return row
+
+
+def test_unknown_codes_never_reach_the_database(fake_db, loaded_filter):
+    connections = fake_db([], handle_token)
+    assert check_promocode_status('NOPE', 5)['status'] == 'invalid'
+    assert connections == []
+
+
+def test_valid_codes_are_cached_and_rechecked_per_user(fake_db, loaded_filter):
+    connections = fake_db([('CALL check_promocode_status', [_row()])], handle_token)
+
+    assert check_promocode_status('CODE', 5)['status'] == 'valid'
+    assert check_promocode_status('CODE', 5)['added_tnc_percentage'] == '10.00'
+    assert check_promocode_status('CODE', 3)['status'] == 'error'
+    assert len(connections) == 1
+
+
+def test_cached_code_expiring_or_redeemed_is_rejected(loaded_filter):
+    promo_cache.promo_metadata.set('CODE', _row(end_date=datetime.now() - timedelta(seconds=1)))
+    assert check_promocode_status('CODE', 5)['status'] == 'invalid'
+
+    promo_cache.promo_metadata.set('CODE', _row(spender_id=9))
+    assert check_promocode_status('CODE', 5)['status'] == 'invalid'
@@ -0,0 +1,130 @@
+from decimal import Decimal
+
+import pytest
+
+from app import promo_cache, wallet_communications
+from app.money import Money
+from app.wallet_communications import PROMO_AFTER_CREDIT, redeem_promo_code, store_transaction_in_db
+from conftest import FakeConnection
+
+PROMO = {'added_tnc_percentage': Decimal('10.00'), 'creator_id': 3, 'spender_id': None}
+
+
+def _promo_db(claimed, promo=PROMO, credited=True):
+    return [
+        ('INSERT IGNORE INTO credited_payments', {'rowcount': 1 if credited else 0}),
+        ('UPDATE promo_codes SET spender_id', {'rowcount': 1 if claimed else 0}),
+        ('SELECT added_tnc_percentage', [promo] if promo else []),
+        ('INSERT IGNORE INTO creator_bonus_accruals', {'rowcount': 1}),
+        ('CALL purchase_and_update_tanacoin', [{'message': 'ok'}]),
+    ]
+
+
+@pytest.mark.parametrize('claimed, promo, buyer, expected', [
+    (True, PROMO, 5, (10, 3, None)),
+    (False, PROMO, 3, (None, None, "Le créateur du code promo ne peut pas l'utiliser.")),
+    (False, {**PROMO, 'spender_id': 6}, 5, (None, None, "Promo code has already been used.")),
+    (False, None, 5, (None, None, "Promo code is either expired or not found.")),
+])
+def test_redeem_is_a_single_conditional_claim(claimed, promo, buyer, expected):
+    connection = FakeConnection(_promo_db(claimed, promo))
+    promo_cache.promo_metadata.set('CODE', {'cached': True})
+
+    assert redeem_promo_code(connection.cursor(), 'CODE', buyer) == expected
+    sql, params = connection.statements('UPDATE promo_codes')[0]
+    assert 'spender_id IS NULL' in sql and 'creator_id <>' in sql and params == (buyer, 'CODE', buyer)
+    assert promo_cache.promo_metadata.get('CODE') is None
+
+
+@pytest.fixture
+def buyer(monkeypatch):
+    monkeypatch.setattr(wallet_communications, 'get_user_id_by_wallet_address', lambda address: 5)
+
+
+def test_purchase_redemption_and_bonus_commit_together(fake_db, buyer):
+    connections = fake_db(_promo_db(claimed=True), wallet_communications)
+
+    ok, message, credit = store_transaction_in_db('0xtx', Money.parse('1', 'ETH'), 'ETH', '0xpayer',
+                                                  Money.parse('100', 'TNC'), promo_code='CODE', buyer_id=5)
+
+    assert ok and credit['tanacoin_purchased'] == Money.parse('110', 'TNC') and credit['promo_applied'] == 'CODE'
+    connection = connections[0]
+    assert len(connections) == 1 and connection.commits == 1 and connection.rollbacks == 0
+    _, accrual = connection.statements('creator_bonus_accruals')[0]
+    assert accrual == (3, Decimal('10.00000000'), '0xtx')
+    _, purchase = connection.statements('CALL purchase_and_update_tanacoin')[0]
+    assert purchase[0] == 5 and purchase[-1] == Decimal('110.00000000')
+    [(_, recorded)] = connection.statements('UPDATE credited_payments')
+    assert recorded == (Decimal('110.00000000'), 'CODE', '0xtx')
+
+
+def test_used_promo_still_credits_the_payment_without_bonus(fake_db, buyer):
+    connections = fake_db(_promo_db(claimed=False, promo={**PROMO, 'spender_id': 6}), wallet_communications)
+
+    ok, _, credit = store_transaction_in_db('0xtx', Money.parse('1', 'ETH'), 'ETH', '0xpayer',
+                                            Money.parse('100', 'TNC'), promo_code='CODE', buyer_id=5)
+
+    assert ok and credit['tanacoin_purchased'] == Money.parse('100', 'TNC')
+    assert credit['promo_error'] == "Promo code has already been used."
+    assert not connections[0].statements('creator_bonus_accruals')
+
+
+def test_already_credited_payment_is_not_redeemed_again(fake_db, buyer):
+    connections = fake_db(_promo_db(claimed=True, credited=False), wallet_communications)
+
+    ok, message, credit = store_transaction_in_db('0xtx', Money.parse('1', 'ETH'), 'ETH', '0xpayer',
+                                                  Money.parse('100', 'TNC'), promo_code='CODE', buyer_id=5)
+
+    assert ok and message == "Transaction already credited"
+    assert credit == {'promo_error': PROMO_AFTER_CREDIT}
+    assert not connections[0].statements('UPDATE promo_codes')
+    assert connections[0].rollbacks == 1 and connections[0].commits == 0
+
+
+def _credited_by_scanner(promo_code=None):
+    return _promo_db(claimed=True, credited=False) + [
+        ('FROM credited_payments', [{'user_id': 5, 'tanacoin_credited': Decimal('100.00000000'),
+                                     'promo_code': promo_code}]),
+        ('SELECT tnc_wallet_id FROM tnc_wallets', [{'tnc_wallet_id': 'W5'}]),
+    ]
+
+
+def test_promo_is_added_to_a_payment_the_scanner_credited_first(fake_db, buyer):
+    connections = fake_db(_credited_by_scanner(), wallet_communications)
+
+    ok, message, credit = store_transaction_in_db('0xtx', Money.parse('1', 'ETH'), 'ETH', '0xpayer',
+                                                  Money.parse('99', 'TNC'), promo_code='CODE', buyer_id=5)
+
+    assert ok and message == "Transaction already credited"
+    assert credit == {'tanacoin_purchased': Money.parse('110', 'TNC'), 'promo_applied': 'CODE'}
+    connection = connections[0]
+    [(_, entries)] = connection.statements('INSERT INTO tnc_ledger')
+    assert entries == [('W5', Decimal('10.00000000'), 'promo_bonus', '0xtx')]
+    _, accrual = connection.statements('creator_bonus_accruals')[0]
+    assert accrual == (3, Decimal('10.00000000'), '0xtx')
+    [(_, recorded)] = connection.statements('UPDATE credited_payments')
+    assert recorded == (Decimal('110.00000000'), 'CODE', '0xtx')
+    assert not connection.statements('CALL purchase_and_update_tanacoin') and connection.commits == 1
+
+
+def test_second_promo_on_a_credited_payment_is_reported(fake_db, buyer):
+    connections = fake_db(_credited_by_scanner(promo_code='FIRST'), wallet_communications)
+
+    ok, _, credit = store_transaction_in_db('0xtx', Money.parse('1', 'ETH'), 'ETH', '0xpayer',
+                                            Money.parse('99', 'TNC'), promo_code='CODE', buyer_id=5)
+
+    assert ok and credit == {'tanacoin_purchased': Money.parse('100', 'TNC'), 'promo_applied': 'FIRST',
+                             'promo_error': PROMO_AFTER_CREDIT}
+    assert not connections[0].statements('UPDATE promo_codes') and connections[0].rollbacks == 1
+
+
+def test_failure_rolls_back_the_whole_redemption(fake_db, buyer):
+    responses = _promo_db(claimed=True)
+    responses[-1] = ('CALL purchase_and_update_tanacoin', lambda params: 1 / 0)
+    connections = fake_db(responses, wallet_communications)
+
+    ok, _, credit = store_transaction_in_db('0xtx', Money.parse('1', 'ETH'), 'ETH', '0xpayer',
+                                            Money.parse('100', 'TNC'), promo_code='CODE', buyer_id=5)
+
+    assert not ok and credit is None
+    assert connections[0].rollbacks == 1 and connections[0].commits == 0
@@ -0,0 +1,63 @@
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+from app import api, wallet_communications
+from app.wallet_communications import build_quote_table, get_rate_quotes, refresh_rate_quotes
+
+RATES = (Fraction(1, 2), Fraction(1, 6000), Fraction(1, 2), Fraction(1, 120000))
+
+
+@pytest.fixture
+def quotes(monkeypatch):
+    """Serve fixed rates and promo percentages; returns the number of upstream refreshes."""
+    refreshes = []
+    monkeypatch.setattr(wallet_communications, 'compute_tanacoin_rates',
+                        lambda: refreshes.append(1) or RATES)
+    monkeypatch.setattr(wallet_communications, 'get_active_promo_percentages', lambda: [Decimal('10')])
+    monkeypatch.setattr(wallet_communications, '_rate_quotes',
+                        {"rates": None, "table": None, "body": None, "etag": None, "expires_at": 0.0})
+    return refreshes
+
+
+def test_quote_table_prices_each_currency_and_promo():
+    table = build_quote_table(RATES, [Decimal('25')])
+    assert table['tanacoin_price']['EUR'] == '0.50'
+    assert table['tanacoin_price']['ETH'] == '0.000166666666666667'
+    assert table['promo_price']['25']['EUR'] == '0.40'
+
+
+def test_quotes_are_served_from_memory_until_they_expire(quotes):
+    first = get_rate_quotes()
+    second = get_rate_quotes()
+    assert first[0] == second[0] and first[2] > 0
+    assert len(quotes) == 1
+
+
+def test_etag_ignores_the_refresh_timestamp(quotes):
+    refresh_rate_quotes()
+    body, etag, _ = get_rate_quotes()
+    refresh_rate_quotes()
+    new_body, new_etag, _ = get_rate_quotes()
+    assert new_etag == etag
+    assert '"computed_at"' in body
+
+
+def test_matching_if_none_match_gets_a_304(quotes):
+    client = api.app.test_client()
+    first = client.get('/api/rates')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('"') and 'max-age=' in first.headers['Cache-Control']
+
+    cached = client.get('/api/rates', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b''
+
+    changed = client.get('/api/rates', headers={'If-None-Match': '"stale"'})
+    assert changed.status_code == 200 and changed.get_json()['tanacoin_price']['EUR'] == '0.50'
+
+
+def test_rates_unavailable_without_a_table(monkeypatch, quotes):
+    monkeypatch.setattr(wallet_communications, 'compute_tanacoin_rates', lambda: (None, None, None, None))
+    assert api.app.test_client().get('/api/rates').status_code == 503
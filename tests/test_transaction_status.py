@@ -0,0 +1,89 @@
+import threading
+
+import jwt
+import pytest
+
+from app import api, payment_jobs, wallet_communications
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    payment_jobs.finished_jobs.clear()
+    wallet_communications.terminal_payment_results.clear()
+
+
+def test_concurrent_lookups_share_one_call_and_terminal_results_are_memoized(monkeypatch):
+    started, gate, calls = threading.Event(), threading.Event(), []
+
+    def lookup(tx_hash, promo_code, buyer_id):
+        calls.append(tx_hash)
+        started.set()
+        gate.wait(5)
+        return {'status': 'confirmed', 'tx_hash': tx_hash}
+    monkeypatch.setattr(wallet_communications, 'get_transaction_status', lookup)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(wallet_communications.check_payment('0xa', 'ETH', None, 1)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4 and all(result['status'] == 'confirmed' for result in results)
+    assert wallet_communications.check_payment('0xa', 'ETH', None, 1)['status'] == 'confirmed'
+    assert calls == ['0xa']
+
+
+def test_pending_results_are_not_memoized(monkeypatch):
+    calls = []
+    monkeypatch.setattr(wallet_communications, 'get_transaction_status',
+                        lambda *args: calls.append(args) or {'status': 'pending', 'confirmations': 1})
+    wallet_communications.check_payment('0xa', 'ETH', None, 1)
+    wallet_communications.check_payment('0xa', 'ETH', None, 1)
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def client():
+    token = jwt.encode({'user_id': 1}, api.SECRET_KEY, algorithm='HS256')
+    client = api.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return client
+
+
+def test_invalid_promo_code_is_rejected_before_queueing(client, monkeypatch):
+    queued = []
+    monkeypatch.setattr(api, 'check_promocode_status',
+                        lambda code, user_id: {'status': 'invalid', 'message': 'Promo code has already been used.'})
+    monkeypatch.setattr(api, 'enqueue_verification_job', lambda *args: queued.append(args))
+
+    response = client.post('/api/transaction-status',
+                           json={'tx_hash': '0xa', 'payment_method': 'ETH', 'promo_code': 'USED'})
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Promo code has already been used.'
+    assert queued == []
+
+
+def test_valid_submission_returns_the_job(client, monkeypatch):
+    monkeypatch.setattr(api, 'check_promocode_status', lambda code, user_id: {'status': 'valid'})
+    monkeypatch.setattr(api, 'enqueue_verification_job',
+                        lambda user_id, tx_hash, method, promo: {'job_id': 3, 'tx_hash': tx_hash, 'status': 'queued'})
+
+    response = client.post('/api/transaction-status',
+                           json={'tx_hash': '0xa', 'payment_method': 'ETH', 'promo_code': 'GOOD'})
+
+    assert response.status_code == 202
+    assert response.get_json() == {'job_id': 3, 'tx_hash': '0xa', 'status': 'queued'}
+
+
+def test_completed_job_is_answered_from_memory(client, monkeypatch):
+    payment_jobs._remember_finished({'job_id': 3, 'user_id': 1, 'tx_hash': '0xa', 'status': 'completed'})
+    monkeypatch.setattr(api, 'enqueue_verification_job', lambda *args: pytest.fail("should not queue"))
+
+    response = client.post('/api/transaction-status', json={'tx_hash': '0xa', 'payment_method': 'ETH'})
+
+    assert response.status_code == 200 and response.get_json()['status'] == 'completed'
@@ -0,0 +1,78 @@
+import pytest
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+from app import api, user_management
+from app.user_management import (get_user_id_by_wallet_address, issue_wallet_nonce, verify_wallet_signature,
+                                 wallet_proof_message)
+
+NONCE = 'ab' * 16
+
+
+@pytest.fixture
+def wallet():
+    return Account.create()
+
+
+def _sign(account, address=None, nonce=NONCE):
+    message = wallet_proof_message((address or account.address).lower(), nonce)
+    return account.sign_message(encode_defunct(text=message)).signature.hex()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    user_management.wallet_owner_cache.clear()
+
+
+def test_issued_message_carries_the_stored_nonce(fake_db, wallet):
+    connections = fake_db([], user_management)
+    message = issue_wallet_nonce(wallet.address)
+
+    _, params = connections[0].statements('REPLACE INTO wallet_nonces')[0]
+    assert params[0] == wallet.address.lower()
+    assert message == wallet_proof_message(wallet.address.lower(), params[1])
+    assert connections[0].commits == 1
+
+
+def test_signature_of_the_current_nonce_is_accepted_once(fake_db, wallet):
+    connections = fake_db([('SELECT nonce', [{'nonce': NONCE}])], user_management)
+
+    assert verify_wallet_signature(wallet.address, _sign(wallet))
+    assert connections[0].statements('DELETE FROM wallet_nonces')
+
+
+@pytest.mark.parametrize('signer, nonce', [('other', NONCE), ('owner', 'cd' * 16)])
+def test_wrong_signer_or_nonce_is_rejected(fake_db, wallet, signer, nonce):
+    connections = fake_db([('SELECT nonce', [{'nonce': NONCE}])], user_management)
+    account = Account.create() if signer == 'other' else wallet
+
+    assert not verify_wallet_signature(wallet.address, _sign(account, wallet.address, nonce))
+    # The nonce is spent even by a failed attempt
+    assert connections[0].statements('DELETE FROM wallet_nonces')
+
+
+def test_missing_or_expired_nonce_is_rejected(fake_db, wallet):
+    fake_db([('SELECT nonce', [])], user_management)
+    assert not verify_wallet_signature(wallet.address, _sign(wallet))
+    assert not verify_wallet_signature(wallet.address, None)
+    assert not verify_wallet_signature(wallet.address, '0xnot-a-signature')
+
+
+def test_connect_wallet_requires_a_signature(monkeypatch, wallet):
+    monkeypatch.setattr(api, 'verify_wallet_signature', lambda address, signature: False)
+    monkeypatch.setattr(api, 'login_with_wallet', lambda address: pytest.fail("must not log in"))
+
+    response = api.app.test_client().post('/connect_wallet', json={'wallet_address': wallet.address})
+
+    assert response.status_code == 401
+
+
+def test_wallet_owner_lookup_is_normalized_and_caches_hits_only(fake_db):
+    responses = {'0xabc': [{'user_id': 9}]}
+    connections = fake_db([('FROM user_wallets', lambda params: responses.get(params[0], []))], user_management)
+
+    assert get_user_id_by_wallet_address(' 0xABC ') == 9
+    assert get_user_id_by_wallet_address('0xabc') == 9
+    assert get_user_id_by_wallet_address('0xdef') is None
+    assert get_user_id_by_wallet_address('0xdef') is None
+    assert len(connections) == 3